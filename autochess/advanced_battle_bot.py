@@ -1,10 +1,11 @@
 import cv2
 import numpy as np
-import pyautogui
 import time
 import random
 import os
 from autogame import AutoGame
+from hud_reader import EnergyBarReader
+from unit_detector import UnitDetector, empty_detections
 
 class AdvancedBattleBot(AutoGame):
     """
@@ -25,6 +26,14 @@ class AdvancedBattleBot(AutoGame):
         self.card_positions = []  # 卡牌位置
         self.opponent_units = []  # 对手单位位置
         self.ally_units = []  # 我方单位位置
+        self.opponent_detections = empty_detections()  # 对手单位的中心点、面积和外接矩形数组
+        self.ally_detections = empty_detections()  # 我方单位的中心点、面积和外接矩形数组
+        
+        # 按队伍颜色检测单位（根据实际游戏调整），假设我方为蓝色、对手为红色
+        self.unit_detector = UnitDetector({
+            'ally': [((100, 120, 80), (130, 255, 255))],
+            'opponent': [((0, 120, 80), (10, 255, 255)), ((170, 120, 80), (179, 255, 255))],
+        })
         
         # 战斗区域定义（根据实际游戏调整）
         self.battle_area = None  # 将在首次截图后设置
@@ -37,6 +46,9 @@ class AdvancedBattleBot(AutoGame):
         self.card_play_order = [1, 2, 3, 4]  # 卡牌优先级
         self.target_areas = []  # 优先放置区域
         
+        # 能量条（根据实际游戏调整），假设为屏幕下方中央的一条蓝色横条
+        self.energy_bar = EnergyBarReader(region=(0.3, 0.9, 0.4, 0.02), hue_range=(95, 130))
+        
         # 确保模板目录存在
         self.check_templates()
     
@@ -86,7 +98,7 @@ class AdvancedBattleBot(AutoGame):
         if self.screen is None:
             self.take_screenshot()
         
-        screen_width, screen_height = self.screen.size
+        screen_height, screen_width = self.screen.shape[:2]
         
         # 设置战斗区域（根据实际游戏调整）
         # 假设战斗区域在屏幕中央
@@ -124,41 +136,37 @@ class AdvancedBattleBot(AutoGame):
     
     def detect_battle_state(self):
         """
-        检测当前战斗状态
+        检测当前战斗状态，画面指纹能确定时不做模板匹配
         :return: 状态描述字符串
         """
-        # 检测是否在主界面
-        if self.find_template('battle_button.png', confidence=0.7):
-            return "main_menu"
-        
-        # 检测是否在战斗中
-        # 这里可以通过识别战斗界面的特定元素来判断
-        # 例如能量条、场地等
-        
-        # 检测是否战斗结束
-        if self.find_template('victory_screen.png', confidence=0.7):
-            return "victory"
-        
-        if self.find_template('defeat_screen.png', confidence=0.7):
-            return "defeat"
-        
-        # 默认假设在战斗中
-        return "in_battle"
+        return self.classify_scene(self._match_battle_state)
+    
+    def _match_battle_state(self):
+        """
+        通过模板匹配检测当前战斗状态
+        :return: 状态描述字符串
+        """
+        # 按上一个状态下最可能出现的顺序依次检查，命中即停止
+        return self.match_state([
+            ("main_menu", lambda: self.find_template('battle_button.png', confidence=0.7) is not None),
+            ("victory", lambda: self.find_template('victory_screen.png', confidence=0.7) is not None),
+            ("defeat", lambda: self.find_template('defeat_screen.png', confidence=0.7) is not None),
+        ], default="in_battle")  # 默认假设在战斗中
     
     def detect_energy(self):
         """
         检测当前能量/法力值
-        使用颜色识别或模板匹配
-        :return: 估计的能量值(0-10)
+        通过能量条的填充长度判断
+        :return: 估计的能量值(0-10)，可以是小数
         """
-        # 实际实现中，可以通过识别能量条的颜色或长度来判断
-        # 这里使用简化版本，通过查找能量满格指示器来判断
-        if self.find_template('energy_full.png', confidence=0.7):
-            return 10
-        
-        # 简化版本，随机返回一个值用于测试
-        return random.randint(5, 9)
+        energy = self.energy_bar.read(self.get_frame())
+        if energy is None:
+            self.log("无法读取能量条")
+            return self.energy
         
+        self.energy = energy
+        return self.energy
+    
     def detect_gold(self):
         """
         检测当前金币数量
@@ -172,9 +180,15 @@ class AdvancedBattleBot(AutoGame):
             # 如果找不到金币图标，返回一个默认值
             return 50
         
-        # 实际实现中，应该使用OCR识别金币图标旁边的数字
-        # 这里使用简化版本，随机返回一个值用于测试
-        self.gold = random.randint(30, 100)
+        # 识别金币图标右侧的数字
+        gold = self.digit_reader.read_number(self.hud_region('gold_coin.png', gold_position))
+        if gold is not None:
+            self.gold = gold
+        elif not self.digit_reader.available:
+            # 没有数字字形库时随机返回一个值用于测试
+            self.gold = random.randint(30, 100)
+        else:
+            self.log("无法识别金币数字，沿用上一次的值")
         self.log(f"当前金币: {self.gold}")
         return self.gold
     
@@ -191,9 +205,17 @@ class AdvancedBattleBot(AutoGame):
             # 如果找不到刷新按钮，返回一个默认值
             return 2
         
-        # 实际实现中，应该使用OCR识别刷新按钮上的数字
-        # 这里使用简化版本，随机返回一个值用于测试
-        self.refresh_cost = random.randint(1, 5)
+        # 识别刷新按钮上的数字
+        refresh_cost = self.digit_reader.read_number(
+            self.hud_region('refresh_cards.png', refresh_position, side='inside')
+        )
+        if refresh_cost is not None:
+            self.refresh_cost = refresh_cost
+        elif not self.digit_reader.available:
+            # 没有数字字形库时随机返回一个值用于测试
+            self.refresh_cost = random.randint(1, 5)
+        else:
+            self.log("无法识别刷新消耗数字，沿用上一次的值")
         self.log(f"刷新卡牌消耗: {self.refresh_cost} 金币")
         return self.refresh_cost
     
@@ -210,42 +232,34 @@ class AdvancedBattleBot(AutoGame):
             # 如果找不到人口图标，返回默认值
             return (3, 6)
         
-        # 实际实现中，应该使用OCR识别人口图标旁边的数字
-        # 这里使用简化版本，随机返回一些值用于测试
-        self.population = random.randint(1, 5)
-        self.population_limit = random.randint(self.population, 10)
+        # 识别人口图标右侧 "当前/上限" 形式的数字
+        population = self.digit_reader.read_fraction(self.hud_region('population.png', population_position))
+        if population is not None:
+            self.population, self.population_limit = population
+        elif not self.digit_reader.available:
+            # 没有数字字形库时随机返回一些值用于测试
+            self.population = random.randint(1, 5)
+            self.population_limit = random.randint(self.population, 10)
+        else:
+            self.log("无法识别人口数字，沿用上一次的值")
         self.log(f"当前人口: {self.population}/{self.population_limit}")
         return (self.population, self.population_limit)
     
     def detect_units(self):
         """
         检测场上的单位
-        :return: (我方单位列表, 对手单位列表)
+        按队伍颜色在战斗区域内检测，检测结果的数组保存在 ally_detections 和 opponent_detections 中
+        :return: (我方单位列表, 对手单位列表)，每个单位为中心点坐标 (x, y)
         """
-        # 实际实现中，可以使用对象检测或颜色识别来检测场上单位
-        # 这里使用简化版本
-        
-        # 随机生成一些单位位置用于测试
-        self.ally_units = []
-        self.opponent_units = []
-        
         if self.battle_area is None:
             self.setup_battle_areas()
         
-        battle_left, battle_top, battle_width, battle_height = self.battle_area
-        
-        # 随机生成1-3个我方单位
-        for _ in range(random.randint(1, 3)):
-            x = battle_left + random.randint(0, battle_width)
-            y = battle_top + random.randint(battle_height // 2, battle_height)
-            self.ally_units.append((x, y))
-        
-        # 随机生成1-3个敌方单位
-        for _ in range(random.randint(1, 3)):
-            x = battle_left + random.randint(0, battle_width)
-            y = battle_top + random.randint(0, battle_height // 2)
-            self.opponent_units.append((x, y))
+        detections = self.unit_detector.detect(self.get_frame(), self.battle_area)
+        self.ally_detections = detections['ally']
+        self.opponent_detections = detections['opponent']
         
+        self.ally_units = [(int(round(x)), int(round(y))) for x, y in self.ally_detections.centroids]
+        self.opponent_units = [(int(round(x)), int(round(y))) for x, y in self.opponent_detections.centroids]
         return self.ally_units, self.opponent_units
     
     def start_battle(self):
@@ -261,15 +275,17 @@ class AdvancedBattleBot(AutoGame):
                 self.log("无法找到对战按钮")
                 return False
             
-            # 等待确认对战按钮出现
-            time.sleep(1)
-            if not self.click_template('confirm_battle.png'):
+            # 等待确认对战按钮出现，按钮通常很快弹出，快速轮询
+            self.expect_transition()
+            confirm_position = self.wait_for_template('confirm_battle.png', max_wait=3)
+            if not self.click(confirm_position):
                 self.log("无法找到确认对战按钮")
                 return False
+            self.expect_transition()
             
             # 等待进入战斗
             self.log("等待进入战斗...")
-            time.sleep(5)  # 等待加载战斗场景
+            self.wait_until_stable(max_wait=5, min_wait=1.0)  # 等待加载战斗场景
             
             # 设置战斗区域
             self.setup_battle_areas()
@@ -332,7 +348,7 @@ class AdvancedBattleBot(AutoGame):
             return (x, y)
         
         # 默认在屏幕中央
-        screen_width, screen_height = pyautogui.size()
+        screen_width, screen_height = self.screen_size()
         return (screen_width // 2, screen_height // 2)
     
     def play_card(self, card_index, target_position=None):
@@ -358,12 +374,12 @@ class AdvancedBattleBot(AutoGame):
             target_position = self.select_target_position()
         
         # 点击目标位置放置卡牌
-        time.sleep(0.5)  # 短暂延迟，模拟人类操作
+        self.sleep(0.5)  # 短暂延迟，模拟人类操作
         self.click(target_position)
         
         self.log(f"已打出卡牌{card_index}到位置{target_position}")
         return True
-        
+    
     def upgrade_population(self):
         """
         升级人口上限
@@ -386,7 +402,7 @@ class AdvancedBattleBot(AutoGame):
             self.log(f"已点击升级人口按钮，人口上限从 {population_limit} 提升")
             
             # 等待升级动画完成
-            time.sleep(1.0)
+            self.wait_until_stable(max_wait=1.0)
             
             # 重新检测人口数量和上限
             self.detect_population()
@@ -426,10 +442,10 @@ class AdvancedBattleBot(AutoGame):
         self.log(f"剩余金币: {self.gold}")
         
         # 等待刷新动画完成
-        time.sleep(1.0)
+        self.wait_until_stable(max_wait=1.0)
         
         return True
-        
+    
     def buy_card(self):
         """
         从中间三张卡牌中购买一张
@@ -462,7 +478,7 @@ class AdvancedBattleBot(AutoGame):
         self.log(f"剩余金币: {self.gold}")
         
         # 等待购买动画完成
-        time.sleep(1.0)
+        self.wait_until_stable(max_wait=1.0)
         
         return True
     
@@ -471,23 +487,27 @@ class AdvancedBattleBot(AutoGame):
         合并同名卡牌以升星
         :return: 是否成功合并
         """
-        # 查找同名卡牌
-        same_card_positions = []
-        
-        # 使用模板匹配查找同名卡牌
+        # 使用模板匹配一次性查找所有同名卡牌
         # 这里假设已经有一个模板用于识别同名卡牌
-        same_card_position = self.find_template('same_card.png', confidence=0.7)
+        same_cards = self.find_all('same_card.png', threshold=0.7, max_results=10)
         
-        if not same_card_position:
+        if len(same_cards) == 0:
             self.log("未找到可合并的同名卡牌")
             return False
         
-        # 点击同名卡牌进行合并
-        self.click(same_card_position)
-        self.log("已点击同名卡牌进行合并")
-        
-        # 等待合并动画完成
-        time.sleep(1.0)
+        # 每次合并都会改变卡牌布局，之前找到的位置只在第一次点击前有效，
+        # 因此每次合并完成、画面稳定后重新查找；每次合并至少消耗一张卡牌，合并次数不超过最初找到的数量
+        max_merges = len(same_cards)
+        merges = 0
+        while len(same_cards) > 0 and merges < max_merges:
+            same_card_position = (int(same_cards[0][0]), int(same_cards[0][1]))
+            self.click(same_card_position)
+            self.log(f"已点击同名卡牌进行合并，位置: {same_card_position}")
+            merges += 1
+            
+            # 等待合并动画完成，点击后共享截图已作废，下一次查找使用合并之后的画面
+            self.wait_until_stable(max_wait=1.0)
+            same_cards = self.find_all('same_card.png', threshold=0.7, max_results=10)
         
         return True
     
@@ -502,7 +522,7 @@ class AdvancedBattleBot(AutoGame):
         
         # 检测当前能量
         energy = self.detect_energy()
-        self.log(f"当前能量: {energy}")
+        self.log(f"当前能量: {energy:.1f}")
         
         # 检测当前金币
         gold = self.detect_gold()
@@ -518,8 +538,8 @@ class AdvancedBattleBot(AutoGame):
         if random.random() < 0.3:  # 30%概率尝试合并卡牌
             if self.merge_same_cards():
                 self.log("成功合并同名卡牌升星")
-                # 合并后等待一段时间
-                time.sleep(1.0)
+                # 合并后等待画面稳定
+                self.wait_until_stable(max_wait=1.0)
                 return
         
         # 尝试升级人口
@@ -527,8 +547,8 @@ class AdvancedBattleBot(AutoGame):
         if population >= population_limit - 1:
             if self.upgrade_population():
                 self.log("成功升级人口上限")
-                # 升级后等待一段时间
-                time.sleep(1.0)
+                # 升级后等待画面稳定
+                self.wait_until_stable(max_wait=1.0)
                 return
         
         # 尝试购买卡牌
@@ -537,8 +557,8 @@ class AdvancedBattleBot(AutoGame):
             if random.random() < 0.4:  # 40%概率尝试购买卡牌
                 if self.buy_card():
                     self.log("成功购买卡牌")
-                    # 购买后等待一段时间
-                    time.sleep(1.0)
+                    # 购买后等待画面稳定
+                    self.wait_until_stable(max_wait=1.0)
                     return
         
         # 尝试刷新卡牌
@@ -548,8 +568,8 @@ class AdvancedBattleBot(AutoGame):
             if random.random() < 0.25:  # 25%概率尝试刷新卡牌
                 if self.refresh_cards():
                     self.log("成功刷新卡牌")
-                    # 刷新后等待一段时间
-                    time.sleep(1.0)
+                    # 刷新后等待画面稳定
+                    self.wait_until_stable(max_wait=1.0)
                     return
         
         # 根据战场状况选择策略
@@ -581,7 +601,7 @@ class AdvancedBattleBot(AutoGame):
             # 等待一段时间，让能量恢复
             wait_time = random.uniform(1.5, 3.0)
             self.log(f"等待{wait_time:.1f}秒后继续操作")
-            time.sleep(wait_time)
+            self.sleep(wait_time)
     
     def handle_battle_result(self):
         """
@@ -599,7 +619,7 @@ class AdvancedBattleBot(AutoGame):
             else:
                 self.log("无法找到确认按钮，尝试点击屏幕中央")
                 # 如果找不到确认按钮，尝试点击屏幕中央
-                screen_width, screen_height = pyautogui.size()
+                screen_width, screen_height = self.screen_size()
                 self.click((screen_width // 2, screen_height // 2))
             
             self.in_battle = False
@@ -613,7 +633,7 @@ class AdvancedBattleBot(AutoGame):
             else:
                 self.log("无法找到确认按钮，尝试点击屏幕中央")
                 # 如果找不到确认按钮，尝试点击屏幕中央
-                screen_width, screen_height = pyautogui.size()
+                screen_width, screen_height = self.screen_size()
                 self.click((screen_width // 2, screen_height // 2))
             
             self.in_battle = False
@@ -642,11 +662,15 @@ class AdvancedBattleBot(AutoGame):
         try:
             while battles_completed < num_battles:
                 self.log(f"\n===== 开始第 {battles_completed + 1} 场战斗 =====")
+                replay_position = self.replay_position()
                 
                 # 开始战斗
-                if not self.start_battle():
+                with self.frame_tick():
+                    started = self.start_battle()
+                if not started:
                     self.log("无法开始战斗，等待后重试")
-                    time.sleep(wait_between)
+                    self.check_replay_progress(replay_position)
+                    self.sleep(wait_between)
                     continue
                 
                 # 战斗中的操作循环
@@ -655,20 +679,23 @@ class AdvancedBattleBot(AutoGame):
                 check_interval = 2  # 检查间隔（秒）
                 
                 while battle_time < max_battle_time:
-                    # 检查战斗是否结束
-                    state = self.detect_battle_state()
-                    if state in ["victory", "defeat"]:
-                        break
-                    
-                    # 执行战斗操作
-                    self.perform_battle_actions()
+                    # 每个决策帧只截图一次，状态检测和战斗操作共用
+                    with self.frame_tick():
+                        # 检查战斗是否结束
+                        state = self.detect_battle_state()
+                        if state in ["victory", "defeat"]:
+                            break
+                        
+                        # 执行战斗操作
+                        self.perform_battle_actions()
                     
                     # 等待一段时间
-                    time.sleep(check_interval)
+                    self.sleep(check_interval)
                     battle_time += check_interval
                 
                 # 处理战斗结果
-                result = self.handle_battle_result()
+                with self.frame_tick():
+                    result = self.handle_battle_result()
                 
                 if result == "victory":
                     victories += 1
@@ -680,186 +707,12 @@ class AdvancedBattleBot(AutoGame):
                 # 战斗间等待
                 if battles_completed < num_battles:
                     self.log(f"等待 {wait_between} 秒后开始下一场战斗")
-                    time.sleep(wait_between)
+                    self.sleep(wait_between)
             
             self.log(f"\n===== 战斗循环结束 =====")
             self.log(f"总场次: {battles_completed}, 胜利: {victories}, 失败: {defeats}")
             self.log(f"胜率: {victories / battles_completed * 100:.1f}%")
-            
-        except KeyboardInterrupt:
-            self.log("\n用户中断，停止战斗循环")
-            self.log(f"已完成场次: {battles_completed}, 胜利: {victories}, 失败: {defeats}")
-            if battles_completed > 0:
-                self.log(f"胜率: {victories / battles_completed * 100:.1f}%")
-
-
-def main():
-    """
-    主函数
-    """
-    print("===== 高级战斗机器人 =====")
-    print("初始化中...")
-    
-    # 创建机器人实例
-    bot = AdvancedBattleBot(confidence=0.7)
-    
-    # 给用户5秒时间切换到游戏窗口
-    print("请在5秒内切换到游戏窗口...")
-    for i in range(5, 0, -1):
-        print(f"{i}...")
-        time.sleep(1)
-    
-    # 开始自动战斗循环
-    num_battles = 3
-    try:
-        num_battles = int(input("请输入要进行的战斗次数: "))
-    except ValueError:
-        print("输入无效，使用默认值3")
-    
-    bot.auto_battle_loop(num_battles=num_battles)
-
-
-if __name__ == "__main__":
-    main()")
-        
-        # 检测场上单位
-        ally_units, opponent_units = self.detect_units()
-        self.log(f"我方单位数量: {len(ally_units)}, 敌方单位数量: {len(opponent_units)}")
-        
-        # 根据战场状况选择策略
-        if len(opponent_units) > len(ally_units) and len(opponent_units) >= 2:
-            # 敌方单位较多，采用防御策略
-            self.log("敌方单位较多，采用防御策略")
-            self.aggressive_mode = False
-        elif energy >= 8:  # 能量充足，采用进攻策略
-            self.log("能量充足，采用进攻策略")
-            self.aggressive_mode = True
-        
-        # 选择要打出的卡牌
-        card_to_play = self.select_card_to_play()
-        
-        if card_to_play:
-            # 根据当前策略选择目标位置
-            if self.aggressive_mode:
-                # 进攻策略，优先选择靠近敌方的位置
-                target_areas = self.target_areas[3:] if self.target_areas else None
-                target_position = random.choice(target_areas) if target_areas else None
-            else:
-                # 防御策略，优先选择靠近我方的位置
-                target_areas = self.target_areas[:3] if self.target_areas else None
-                target_position = random.choice(target_areas) if target_areas else None
-            
-            # 打出卡牌
-            self.play_card(card_to_play, target_position)
-            
-            # 等待一段时间，让能量恢复
-            wait_time = random.uniform(1.5, 3.0)
-            self.log(f"等待{wait_time:.1f}秒后继续操作")
-            time.sleep(wait_time)
-    
-    def handle_battle_result(self):
-        """
-        处理战斗结果
-        :return: 战斗结果描述
-        """
-        # 检测战斗结果
-        state = self.detect_battle_state()
-        
-        if state == "victory":
-            self.log("战斗胜利！")
-            # 点击确认按钮
-            if self.click_template('ok_button.png'):
-                self.log("已确认胜利")
-            else:
-                self.log("无法找到确认按钮，尝试点击屏幕中央")
-                # 如果找不到确认按钮，尝试点击屏幕中央
-                screen_width, screen_height = pyautogui.size()
-                self.click((screen_width // 2, screen_height // 2))
-            
-            self.in_battle = False
-            return "victory"
-        
-        elif state == "defeat":
-            self.log("战斗失败！")
-            # 点击确认按钮
-            if self.click_template('ok_button.png'):
-                self.log("已确认失败")
-            else:
-                self.log("无法找到确认按钮，尝试点击屏幕中央")
-                # 如果找不到确认按钮，尝试点击屏幕中央
-                screen_width, screen_height = pyautogui.size()
-                self.click((screen_width // 2, screen_height // 2))
-            
-            self.in_battle = False
-            return "defeat"
-        
-        elif state == "in_battle":
-            self.log("战斗仍在进行中")
-            return "in_battle"
         
-        else:
-            self.log(f"未知状态: {state}")
-            return "unknown"
-    
-    def auto_battle_loop(self, num_battles=5, wait_between=5):
-        """
-        自动战斗循环
-        :param num_battles: 要进行的战斗次数
-        :param wait_between: 战斗之间的等待时间（秒）
-        """
-        self.log(f"开始自动战斗循环，计划进行 {num_battles} 次战斗")
-        
-        battles_completed = 0
-        victories = 0
-        defeats = 0
-        
-        try:
-            while battles_completed < num_battles:
-                self.log(f"\n===== 开始第 {battles_completed + 1} 场战斗 =====")
-                
-                # 开始战斗
-                if not self.start_battle():
-                    self.log("无法开始战斗，等待后重试")
-                    time.sleep(wait_between)
-                    continue
-                
-                # 战斗中的操作循环
-                battle_time = 0
-                max_battle_time = 180  # 最长战斗时间（秒）
-                check_interval = 2  # 检查间隔（秒）
-                
-                while battle_time < max_battle_time:
-                    # 检查战斗是否结束
-                    state = self.detect_battle_state()
-                    if state in ["victory", "defeat"]:
-                        break
-                    
-                    # 执行战斗操作
-                    self.perform_battle_actions()
-                    
-                    # 等待一段时间
-                    time.sleep(check_interval)
-                    battle_time += check_interval
-                
-                # 处理战斗结果
-                result = self.handle_battle_result()
-                
-                if result == "victory":
-                    victories += 1
-                elif result == "defeat":
-                    defeats += 1
-                
-                battles_completed += 1
-                
-                # 战斗间等待
-                if battles_completed < num_battles:
-                    self.log(f"等待 {wait_between} 秒后开始下一场战斗")
-                    time.sleep(wait_between)
-            
-            self.log(f"\n===== 战斗循环结束 =====")
-            self.log(f"总场次: {battles_completed}, 胜利: {victories}, 失败: {defeats}")
-            self.log(f"胜率: {victories / battles_completed * 100:.1f}%")
-            
         except KeyboardInterrupt:
             self.log("\n用户中断，停止战斗循环")
             self.log(f"已完成场次: {battles_completed}, 胜利: {victories}, 失败: {defeats}")
@@ -890,7 +743,12 @@ def main():
     except ValueError:
         print("输入无效，使用默认值3")
     
-    bot.auto_battle_loop(num_battles=num_battles)
+    # 动作异步执行，下一帧在动作执行期间预取并预先匹配
+    bot.start_pipeline()
+    try:
+        bot.auto_battle_loop(num_battles=num_battles)
+    finally:
+        bot.stop_pipeline()
 
 
 if __name__ == "__main__":
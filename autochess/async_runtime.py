@@ -0,0 +1,352 @@
+import asyncio
+import inspect
+import random
+import numpy as np
+from capture_service import Frame
+from frame_change import FrameChangeDetector
+
+
+class AsyncBotRuntime:
+    """
+    基于asyncio的机器人运行时
+    截图、模板匹配、等待和点击都是可等待的协程，耗CPU的截图和匹配在线程池中执行，
+    因此同一进程内可以并发运行多个互不相关的感知任务，例如在战斗循环旁边运行一个弹窗监视器
+    
+    - 所有任务共享最新的一帧截图，max_frame_age内的并发截图请求只截图一次
+    - 同一帧上相同的模板查找只匹配一次，结果在画面对应区域没有变化前一直复用
+    - 点击和拖动由输入锁串行执行，动作之前开始截取的帧不再被使用
+    
+    用法:
+        runtime = bot.async_runtime()
+        
+        async def main():
+            runtime.watch(['close_popup.png'], lambda name, pos: runtime.click(pos))
+            name, pos = await runtime.wait_for(['battle_button.png'], timeout=30)
+            await runtime.click(pos)
+        
+        runtime.run(main())
+    """
+    def __init__(self, bot, max_frame_age=0.1):
+        """
+        初始化运行时
+        :param bot: AutoGame 实例，提供截图后端、输入后端、模板缓存和时钟
+        :param max_frame_age: 共享截图最多允许多旧（秒）
+        """
+        self.bot = bot
+        self.max_frame_age = max_frame_age
+        self.change_detector = FrameChangeDetector()
+        
+        self._frame = None  # 最新的共享截图
+        self._frame_version = 0  # 最新截图对应的画面变化版本号
+        self._seq = 0
+        self._last_action_time = float('-inf')  # 最近一次动作完成的时间
+        self._matches = {}  # 缓存键 -> (模板, 匹配结果, 版本号, 依赖区域)
+        self._pending = {}  # (帧序号, 缓存键) -> 正在进行的匹配
+        self._watchers = []
+        
+        # asyncio的锁在事件循环中创建
+        self._capture_lock = None
+        self._input_lock = None
+        
+        # 统计信息
+        self.captures = 0
+        self.match_cache_hits = 0
+    
+    def _ensure_locks(self):
+        if self._capture_lock is None:
+            self._capture_lock = asyncio.Lock()
+            self._input_lock = asyncio.Lock()
+    
+    async def sleep(self, seconds):
+        """
+        等待指定的秒数；机器人使用虚拟时钟时推进虚拟时间并立即让出事件循环
+        """
+        if self.bot.clock.name == 'virtual':
+            self.bot.clock.sleep(seconds)
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(max(0.0, seconds))
+    
+    async def capture(self, max_age=None):
+        """
+        获取共享截图，最新帧足够新且在最近一次动作之后截取时直接复用
+        :param max_age: 截图最多允许多旧（秒），默认使用self.max_frame_age
+        :return: Frame(seq, timestamp, image)，image是独立的副本，可以跨await使用
+        """
+        if max_age is None:
+            max_age = self.max_frame_age
+        self._ensure_locks()
+        async with self._capture_lock:
+            # 等锁期间其他任务可能已经截取了新帧
+            frame = self._frame
+            if frame is not None and self._fresh(frame, max_age):
+                return frame
+            
+            loop = asyncio.get_running_loop()
+            frame, version = await loop.run_in_executor(None, self._grab)
+            self._frame = frame
+            self._frame_version = version
+            self.captures += 1
+            return frame
+    
+    def _fresh(self, frame, max_age):
+        # 截图服务的帧时间戳也取自机器人时钟，与动作时间、当前时间在同一时间基准上比较
+        if frame.timestamp < self._last_action_time:
+            return False
+        return self.bot.clock.now() - frame.timestamp <= max_age
+    
+    def _grab(self):
+        """
+        在线程池中截图并复制，截图后端的缓冲区随即可以被下一次截图复用
+        :return: (Frame, 画面变化版本号)
+        """
+        bot = self.bot
+        service = bot.capture_service
+        if service is not None and service.running:
+            captured = service.acquire_latest(
+                max_age=bot.max_frame_age, min_timestamp=self._last_action_time, timeout=1.0,
+            )
+            if captured is None:
+                raise RuntimeError(f"后台截图服务未能提供新帧: {service.last_error}")
+            try:
+                image, timestamp = np.array(captured.image, copy=True), captured.timestamp
+            finally:
+                service.release(captured)
+        else:
+            timestamp = bot.clock.now()
+            image = np.array(bot.capture_backend.grab(bot.region), copy=True)
+        
+        if bot.recorder is not None:
+            bot.recorder.record(image, timestamp)
+        self.change_detector.update(image)
+        self._seq += 1
+        return Frame(self._seq, timestamp, image), self.change_detector.version
+    
+    async def find(self, template_name, confidence=None, frame=None, pyramid=None):
+        """
+        在截图上查找模板
+        :param template_name: 模板图像文件名
+        :param confidence: 可选的置信度覆盖
+        :param frame: 可选的截图(Frame)，默认使用共享截图
+        :param pyramid: 是否使用金字塔匹配，默认根据模板大小自动选择
+        :return: 匹配位置的中心点坐标，如果未找到则返回None
+        """
+        if confidence is None:
+            confidence = self.bot.confidence
+        match = await self._find(template_name, confidence, frame, pyramid)
+        if match is None:
+            return None
+        center, max_val = match
+        return self.bot._report_match(template_name, center, max_val, confidence)
+    
+    async def _find(self, template_name, confidence, frame, pyramid):
+        """
+        :return: (最佳匹配位置的中心点坐标, 最高置信度)，模板不存在或匹配出错时返回None
+        """
+        bot = self.bot
+        template = bot.template_store.get(template_name)
+        if template is None:
+            bot.log(f"模板文件不存在或无法加载: {template_name}")
+            return None
+        if frame is None:
+            frame = await self.capture()
+        
+        key = ('locate', template_name, confidence, pyramid)
+        if frame is self._frame:
+            entry = self._matches.get(key)
+            if entry is not None:
+                cached_template, result, version, region = entry
+                if cached_template is template and not self.change_detector.changed_since(version, region):
+                    self.match_cache_hits += 1
+                    return result
+        
+        # 同一帧上相同的查找正在进行时等待它的结果，而不是重复匹配
+        pending_key = (frame.seq, key)
+        future = self._pending.get(pending_key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                bot._get_match_executor(), bot._locate_template,
+                frame.image, template_name, template, confidence, pyramid,
+            )
+            self._pending[pending_key] = future
+            future.add_done_callback(lambda done: self._match_done(done, pending_key, frame, key, template))
+        
+        try:
+            center, max_val, region = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            bot.log(f"模板 {template_name} 匹配过程中出错: {str(e)}")
+            return None
+        return center, max_val
+    
+    def _match_done(self, future, pending_key, frame, key, template):
+        """
+        匹配完成后移出进行中的列表；结果属于最新截图时放入缓存
+        """
+        self._pending.pop(pending_key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        if frame is self._frame:
+            center, max_val, region = future.result()
+            self._matches[key] = (template, (center, max_val), self._frame_version, region)
+    
+    async def find_templates(self, template_names, frame=None, confidence=None):
+        """
+        在同一张截图上并发查找多个模板，与 AutoGame.find_templates 相同
+        :param template_names: 模板图像文件名列表
+        :param frame: 可选的截图(Frame)，默认使用共享截图
+        :param confidence: 可选的置信度覆盖
+        :return: {模板名: 匹配位置的中心点坐标或None}
+        """
+        if frame is None:
+            frame = await self.capture()
+        positions = await asyncio.gather(*(self.find(name, confidence, frame=frame) for name in template_names))
+        return dict(zip(template_names, positions))
+    
+    async def wait_for(self, template_names, timeout=30, confidence=None, min_interval=0.1, max_interval=2.0, backoff=1.5):
+        """
+        等待多个模板中的任意一个出现，轮询间隔按backoff倍数从min_interval递增到max_interval
+        等待期间事件循环可以运行其他任务
+        :param template_names: 模板图像文件名列表
+        :param timeout: 最大等待时间（秒）
+        :return: (找到的模板名, 位置)，超时返回(None, None)
+        """
+        self.bot.log(f"等待模板 {', '.join(template_names)} 出现，最多等待 {timeout} 秒")
+        start_time = self.bot.clock.now()
+        interval = min_interval
+        
+        while True:
+            matches = await self.find_templates(template_names, confidence=confidence)
+            for template_name in template_names:
+                if matches[template_name] is not None:
+                    return template_name, matches[template_name]
+            
+            remaining = timeout - (self.bot.clock.now() - start_time)
+            if remaining <= 0:
+                break
+            await self.sleep(min(interval, remaining))
+            interval = min(max_interval, interval * backoff)
+        
+        self.bot.log(f"等待模板 {', '.join(template_names)} 超时")
+        return None, None
+    
+    async def click(self, position, random_offset=5):
+        """
+        点击指定位置，与其他任务的动作串行执行
+        :param position: (x, y) 坐标元组，截图坐标
+        :param random_offset: 随机偏移的最大像素数
+        :return: 是否执行了点击
+        """
+        if position is None:
+            self.bot.log("无法点击：位置为None")
+            return False
+        
+        bot = self.bot
+        self._ensure_locks()
+        async with self._input_lock:
+            # 与机器人自身的点击相同：先激活窗口，再把截图坐标转换为屏幕坐标
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, bot.prepare_input):
+                bot.log("无法激活窗口，点击操作取消")
+                return False
+            x, y = bot.to_screen(position)
+            if random_offset > 0:
+                x += random.randint(-random_offset, random_offset)
+                y += random.randint(-random_offset, random_offset)
+            
+            await loop.run_in_executor(None, lambda: bot.input.click(x, y, hold=bot.timing.click_hold))
+            bot.log(f"点击位置: ({x}, {y})")
+            self._action_done()
+            await self.sleep(bot.timing.after_click)
+        return True
+    
+    async def drag(self, start, end, duration=None):
+        """
+        按住鼠标从起点拖动到终点，与其他任务的动作串行执行
+        :param start: 起点 (x, y)，截图坐标
+        :param end: 终点 (x, y)，截图坐标
+        :return: 是否执行了拖动
+        """
+        bot = self.bot
+        if duration is None:
+            duration = bot.timing.drag_duration
+        self._ensure_locks()
+        async with self._input_lock:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, bot.prepare_input):
+                bot.log("无法激活窗口，拖动操作取消")
+                return False
+            start, end = bot.to_screen(start), bot.to_screen(end)
+            
+            await loop.run_in_executor(
+                None, lambda: bot.input.drag(start, end, duration=duration, steps=bot.timing.drag_steps)
+            )
+            bot.log(f"拖动: {start} -> {end}")
+            self._action_done()
+            await self.sleep(bot.timing.after_drag)
+        return True
+    
+    def _action_done(self):
+        """
+        动作完成后画面可能变化，之前截取的帧和匹配缓存不再使用
+        """
+        self._last_action_time = self.bot.clock.now()
+        self.bot._last_action_time = self._last_action_time
+    
+    def watch(self, template_names, handler, interval=0.5, confidence=None):
+        """
+        启动一个监视任务：定期查找模板，出现时调用handler(模板名, 位置)
+        handler可以是普通函数或协程函数；监视任务一直运行到被取消或 stop_watchers()
+        必须在事件循环中调用
+        :param template_names: 模板图像文件名列表
+        :param handler: 模板出现时的回调
+        :param interval: 检查间隔（秒）
+        :return: asyncio.Task
+        """
+        if confidence is None:
+            confidence = self.bot.confidence
+        
+        async def watcher():
+            while True:
+                frame = await self.capture()
+                matches = await asyncio.gather(
+                    *(self._find(name, confidence, frame, None) for name in template_names)
+                )
+                for template_name, match in zip(template_names, matches):
+                    # 只记录命中，避免每次检查都输出未找到的日志
+                    if match is not None and match[1] >= confidence:
+                        self.bot._report_match(template_name, match[0], match[1], confidence)
+                        result = handler(template_name, match[0])
+                        if inspect.isawaitable(result):
+                            await result
+                        break
+                await self.sleep(interval)
+        
+        task = asyncio.get_running_loop().create_task(watcher())
+        self._watchers.append(task)
+        return task
+    
+    async def stop_watchers(self):
+        """
+        取消所有监视任务并等待它们结束
+        """
+        watchers, self._watchers = self._watchers, []
+        for task in watchers:
+            task.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+    
+    def run(self, coroutine):
+        """
+        在新的事件循环中运行协程，结束时取消所有监视任务
+        :param coroutine: 主协程
+        :return: 协程的返回值
+        """
+        async def runner():
+            try:
+                return await coroutine
+            finally:
+                await self.stop_watchers()
+        
+        return asyncio.run(runner())
@@ -1,27 +1,33 @@
 import cv2
 import numpy as np
-import pyautogui
 import time
 import random
 import os
-import win32gui
-import win32con
-import win32ui
-import win32api
-from ctypes import windll
 from PIL import Image
+
+try:
+    import win32gui
+    import win32con
+    import win32ui
+    import win32api
+except ImportError:
+    # 非Windows环境（如在Linux上回放录制画面）没有pywin32
+    win32gui = win32con = win32ui = win32api = None
 from autogame import AutoGame
+from hud_reader import EnergyBarReader
+from vision_utils import to_gray
 
 class AutoBattleSpirit(AutoGame):
     """
     对战精灵游戏的自动战斗机器人
     能够自动获取游戏窗口句柄，并在指定窗口内进行操作
     """
-    def __init__(self, window_title="对战精灵", confidence=0.8):
+    def __init__(self, window_title="对战精灵", confidence=0.8, hwnd=None):
         """
         初始化自动对战精灵机器人
         :param window_title: 游戏窗口标题，用于查找窗口句柄
         :param confidence: 图像匹配的置信度阈值
+        :param hwnd: 指定的窗口句柄，同时运行多个游戏实例时用于区分窗口
         """
         super().__init__(confidence=confidence)
         self.log("对战精灵自动战斗机器人已初始化")
@@ -31,6 +37,7 @@ class AutoBattleSpirit(AutoGame):
         self.hwnd = None  # 窗口句柄
         self.window_rect = None  # 窗口矩形区域
         self.client_rect = None  # 客户区矩形区域
+        self.fleet_mode = False  # 多窗口模式下不切换前台窗口
         
         # 游戏特定的状态标志
         self.in_battle = False
@@ -39,29 +46,56 @@ class AutoBattleSpirit(AutoGame):
         self.card_positions = []  # 卡牌位置
         self.population = 0  # 当前人口
         self.max_population = 0  # 最大人口
+        self.refresh_cost = 2  # 刷新商店消耗的金币
+        
+        # 能量条在客户区中的位置和颜色（根据实际游戏调整），假设为底部中央的一条蓝色横条
+        self.energy_bar = EnergyBarReader(region=(0.3, 0.9, 0.4, 0.02), hue_range=(95, 130))
         self.relic_selected = False  # 是否已选择圣物
         
         # 初始化窗口句柄
-        self.find_game_window()
+        if hwnd is not None:
+            self.hwnd = hwnd
+            self.update_window_rect()
+        else:
+            self.find_game_window()
         
         # 确保所需的模板存在
         self.check_templates()
     
-    def find_game_window(self):
+    @staticmethod
+    def list_game_windows(window_title="对战精灵"):
         """
-        查找游戏窗口并获取窗口句柄
-        :return: 是否成功获取窗口句柄
+        列出所有标题包含window_title的可见窗口
+        :param window_title: 游戏窗口标题
+        :return: 窗口句柄列表，未安装pywin32时返回空列表
         """
+        if win32gui is None:
+            return []
+        
         def callback(hwnd, hwnds):
             if win32gui.IsWindowVisible(hwnd) and win32gui.IsWindowEnabled(hwnd):
                 window_text = win32gui.GetWindowText(hwnd)
-                if self.window_title in window_text:
+                if window_title in window_text:
                     hwnds.append(hwnd)
             return True
         
         hwnds = []
         win32gui.EnumWindows(callback, hwnds)
+        return hwnds
+    
+    def find_game_window(self):
+        """
+        查找游戏窗口并获取窗口句柄
+        :return: 是否成功获取窗口句柄
+        """
+        if self.dry_run:
+            # 回放模式下使用录制画面代替游戏窗口
+            return True
+        if win32gui is None:
+            self.log("未安装pywin32，无法查找游戏窗口")
+            return False
         
+        hwnds = self.list_game_windows(self.window_title)
         if hwnds:
             self.hwnd = hwnds[0]  # 使用找到的第一个匹配窗口
             self.log(f"找到游戏窗口，句柄: {self.hwnd}")
@@ -99,17 +133,27 @@ class AutoBattleSpirit(AutoGame):
         激活游戏窗口，使其成为前台窗口
         :return: 是否成功激活窗口
         """
+        if self.dry_run:
+            return True
+        
         if not self.hwnd:
             if not self.find_game_window():
                 return False
         
+        if self.fleet_mode:
+            # 多窗口模式下各窗口并排显示，截图取自共享的桌面截图，输入由仲裁器依次执行，不抢占前台
+            if win32gui.IsIconic(self.hwnd):
+                self.log("游戏窗口已最小化，多窗口模式下无法操作")
+                return False
+            return True
+        
         # 如果窗口最小化，则恢复
         if win32gui.IsIconic(self.hwnd):
             win32gui.ShowWindow(self.hwnd, win32con.SW_RESTORE)
         
         # 将窗口设为前台
         win32gui.SetForegroundWindow(self.hwnd)
-        time.sleep(0.5)  # 等待窗口激活
+        self.sleep(0.5)  # 等待窗口激活
         
         # 更新窗口位置信息
         self.update_window_rect()
@@ -120,7 +164,7 @@ class AutoBattleSpirit(AutoGame):
         获取游戏窗口的截图
         :return: 游戏窗口截图的numpy数组
         """
-        if not self.hwnd:
+        if not self.hwnd and not self.dry_run:
             if not self.find_game_window():
                 return None
         
@@ -130,24 +174,19 @@ class AutoBattleSpirit(AutoGame):
         # 使用父类的截图方法，但限定在客户区范围内
         return super().take_screenshot()
     
-    def click(self, position, random_offset=5):
+    def prepare_input(self):
         """
-        在游戏窗口内点击指定位置
-        :param position: (x, y) 坐标元组，相对于屏幕的绝对坐标
-        :param random_offset: 随机偏移的最大像素数
-        :return: 是否成功点击
+        点击或拖动之前确保窗口处于激活状态
         """
-        if position is None:
-            self.log("无法点击：位置为None")
-            return False
-        
-        # 确保窗口处于激活状态
-        if not self.activate_window():
-            self.log("无法激活窗口，点击操作取消")
-            return False
-        
-        # 执行点击操作
-        return super().click(position, random_offset)
+        return self.activate_window()
+    
+    def to_screen(self, position):
+        """
+        截图只包含客户区，模板匹配返回的位置加上客户区的位置即为屏幕坐标
+        """
+        if self.region is None:
+            return position
+        return position[0] + self.region[0], position[1] + self.region[1]
     
     def check_templates(self):
         """
@@ -184,28 +223,26 @@ class AutoBattleSpirit(AutoGame):
     
     def detect_battle_state(self):
         """
-        检测当前战斗状态
+        检测当前战斗状态，画面指纹能确定时不做模板匹配
         :return: 状态描述字符串
         """
-        # 检测是否在主界面
-        if self.find_template('battle_button.png', confidence=0.7):
-            return "main_menu"
-        
-        # 检测是否在圣物选择界面
-        # 通过检测特定文字或界面元素来判断
-        # 这里假设有一个圣物选择的特征可以识别
-        if not self.relic_selected and self.detect_relic_selection_screen():
-            return "relic_selection"
-        
-        # 检测是否战斗结束
-        if self.find_template('victory_screen.png', confidence=0.7):
-            return "victory"
-        
-        if self.find_template('defeat_screen.png', confidence=0.7):
-            return "defeat"
-        
-        # 默认假设在战斗中
-        return "in_battle"
+        # 已选择圣物后不再识别圣物选择界面，该场景不能由指纹直接给出
+        allowed = ("main_menu", "victory", "defeat", "in_battle") if self.relic_selected else None
+        return self.classify_scene(self._match_battle_state, allowed=allowed)
+    
+    def _match_battle_state(self):
+        """
+        通过模板匹配检测当前战斗状态
+        :return: 状态描述字符串
+        """
+        # 按上一个状态下最可能出现的顺序依次检查，命中即停止
+        return self.match_state([
+            ("main_menu", lambda: self.find_template('battle_button.png', confidence=0.7) is not None),
+            # 通过检测特定文字或界面元素来判断是否在圣物选择界面
+            ("relic_selection", lambda: not self.relic_selected and self.detect_relic_selection_screen()),
+            ("victory", lambda: self.find_template('victory_screen.png', confidence=0.7) is not None),
+            ("defeat", lambda: self.find_template('defeat_screen.png', confidence=0.7) is not None),
+        ], default="in_battle")  # 默认假设在战斗中
     
     def detect_relic_selection_screen(self):
         """
@@ -217,12 +254,12 @@ class AutoBattleSpirit(AutoGame):
         # 这里简化实现，通过截图分析来判断
         
         # 获取屏幕截图
-        screen = self.take_screenshot()
+        screen = self.get_frame()
         if screen is None:
             return False
         
-        # 转换为灰度图像
-        gray = cv2.cvtColor(screen, cv2.COLOR_BGR2GRAY)
+        # 转换为灰度图像（截图可能是BGR或BGRA格式）
+        gray = to_gray(screen)
         
         # 在图像中间区域查找亮度较高的区域，这通常是圣物选择界面的特征
         # 这是一个简化的实现，实际应用中可能需要更复杂的图像处理
@@ -244,7 +281,7 @@ class AutoBattleSpirit(AutoGame):
         self.log("检测到圣物选择界面，准备选择圣物")
         
         # 获取屏幕截图
-        screen = self.take_screenshot()
+        screen = self.get_frame()
         if screen is None:
             self.log("无法获取屏幕截图，圣物选择失败")
             return False
@@ -266,7 +303,7 @@ class AutoBattleSpirit(AutoGame):
         if self.click(selected_relic):
             self.log("成功选择圣物")
             self.relic_selected = True
-            time.sleep(2)  # 等待选择动画完成
+            self.sleep(2)  # 等待选择动画完成
             return True
         else:
             self.log("圣物选择失败")
@@ -285,15 +322,17 @@ class AutoBattleSpirit(AutoGame):
                 self.log("无法找到对战按钮")
                 return False
             
-            # 等待确认对战按钮出现
-            time.sleep(1)
-            if not self.click_template('confirm_battle.png'):
+            # 等待确认对战按钮出现，按钮通常很快弹出，快速轮询
+            self.expect_transition()
+            confirm_position = self.wait_for_template('confirm_battle.png', max_wait=3)
+            if not self.click(confirm_position):
                 self.log("无法找到确认对战按钮")
                 return False
+            self.expect_transition()
             
             # 等待进入战斗或圣物选择界面
             self.log("等待进入战斗或圣物选择界面...")
-            time.sleep(5)  # 等待加载场景
+            self.wait_until_stable(max_wait=5, min_wait=1.0)  # 等待加载场景
             
             # 检查是否进入了圣物选择界面
             if self.detect_relic_selection_screen():
@@ -302,7 +341,7 @@ class AutoBattleSpirit(AutoGame):
                     self.log("圣物选择失败")
                     return False
                 # 等待进入战斗
-                time.sleep(3)
+                self.sleep(3)
             
             self.in_battle = True
             # 重置圣物选择状态，为下一场战斗做准备
@@ -315,7 +354,7 @@ class AutoBattleSpirit(AutoGame):
                 self.log("圣物选择失败")
                 return False
             # 等待进入战斗
-            time.sleep(3)
+            self.sleep(3)
             self.in_battle = True
             return True
         elif state == "in_battle":
@@ -329,15 +368,16 @@ class AutoBattleSpirit(AutoGame):
     def detect_energy(self):
         """
         检测当前能量值
-        :return: 估计的能量值
+        通过能量条的填充长度判断
+        :return: 估计的能量值，可以是小数
         """
-        # 实际实现中，可以通过识别能量条的颜色或长度来判断
-        # 这里使用简化版本，通过查找能量满格指示器来判断
-        if self.find_template('energy_full.png', confidence=0.7):
-            return 10
+        energy = self.energy_bar.read(self.get_frame())
+        if energy is None:
+            self.log("无法读取能量条")
+            return self.energy
         
-        # 简化版本，随机返回一个值用于测试
-        return random.randint(5, 9)
+        self.energy = energy
+        return self.energy
     
     def detect_gold(self):
         """
@@ -350,17 +390,15 @@ class AutoBattleSpirit(AutoGame):
             self.log("无法找到金币图标")
             return 0
         
-        # 实际实现中，应该通过OCR识别金币图标旁边的数字
-        # 这里使用简化版本，假设金币数量显示在金币图标右侧
-        # 获取屏幕截图
-        screen = self.take_screenshot()
-        if screen is None:
-            return 0
-        
-        # 在金币图标右侧区域查找数字
-        # 这里简化实现，返回一个随机值用于测试
-        # 实际应用中应该使用OCR技术识别数字
-        self.gold = random.randint(10, 50)  # 假设金币范围在10-50之间
+        # 金币数量显示在金币图标右侧
+        gold = self.digit_reader.read_number(self.hud_region('gold_coin.png', gold_icon_pos))
+        if gold is not None:
+            self.gold = gold
+        elif not self.digit_reader.available:
+            # 没有数字字形库时返回一个随机值用于测试
+            self.gold = random.randint(10, 50)  # 假设金币范围在10-50之间
+        else:
+            self.log("无法识别金币数字，沿用上一次的值")
         self.log(f"当前金币: {self.gold}")
         return self.gold
     
@@ -375,26 +413,43 @@ class AutoBattleSpirit(AutoGame):
             self.log("无法找到人口图标")
             return (0, 0)
         
-        # 实际实现中，应该通过OCR识别人口图标旁边的数字
-        # 这里使用简化版本，假设人口显示在人口图标下方
-        # 获取屏幕截图
-        screen = self.take_screenshot()
-        if screen is None:
-            return (0, 0)
-        
-        # 在人口图标下方区域查找数字
-        # 这里简化实现，返回随机值用于测试
-        # 实际应用中应该使用OCR技术识别数字
-        self.population = random.randint(0, 5)  # 假设当前人口范围在0-5之间
-        self.max_population = random.randint(5, 10)  # 假设最大人口范围在5-10之间
-        
-        # 确保当前人口不超过最大人口
-        if self.population > self.max_population:
-            self.population = self.max_population
+        # 人口以 "当前/最大" 的形式显示在人口图标下方
+        population = self.digit_reader.read_fraction(
+            self.hud_region('population.png', population_icon_pos, side='below', span=2.0)
+        )
+        if population is not None:
+            self.population, self.max_population = population
+        elif not self.digit_reader.available:
+            # 没有数字字形库时返回随机值用于测试
+            self.population = random.randint(0, 5)  # 假设当前人口范围在0-5之间
+            self.max_population = random.randint(5, 10)  # 假设最大人口范围在5-10之间
+            
+            # 确保当前人口不超过最大人口
+            if self.population > self.max_population:
+                self.population = self.max_population
+        else:
+            self.log("无法识别人口数字，沿用上一次的值")
         
         self.log(f"当前人口: {self.population}/{self.max_population}")
         return (self.population, self.max_population)
     
+    def detect_refresh_cost(self):
+        """
+        检测刷新商店所需的金币
+        :return: 刷新消耗的金币，无法识别时沿用上一次的值（初始为2金币）
+        """
+        refresh_button_pos = self.find_template('refresh_cost.png', confidence=0.7)
+        if not refresh_button_pos:
+            self.log("无法找到刷新按钮")
+            return self.refresh_cost
+        
+        # 刷新消耗显示在刷新按钮右侧
+        refresh_cost = self.digit_reader.read_number(self.hud_region('refresh_cost.png', refresh_button_pos, span=1.5))
+        if refresh_cost is not None:
+            self.refresh_cost = refresh_cost
+        self.log(f"刷新消耗: {self.refresh_cost} 金币")
+        return self.refresh_cost
+    
     def upgrade_population(self):
         """
         升级人口上限
@@ -408,8 +463,8 @@ class AutoBattleSpirit(AutoGame):
         # 实际实现中，应该通过模板匹配找到升级按钮
         # 这里简化实现，假设升级按钮的位置是固定的
         if self.client_rect:
-            upgrade_button_x = self.client_rect[0] + self.client_rect[2] // 4
-            upgrade_button_y = self.client_rect[1] + self.client_rect[3] * 3 // 4
+            upgrade_button_x = self.client_rect[2] // 4
+            upgrade_button_y = self.client_rect[3] * 3 // 4
             upgrade_button_pos = (upgrade_button_x, upgrade_button_y)
             
             # 点击升级按钮
@@ -431,10 +486,12 @@ class AutoBattleSpirit(AutoGame):
         """
         positions = []
         
-        # 检测每个卡牌槽位
-        for i in range(1, 5):
-            card_template = f'card_slot_{i}.png'
-            position = self.find_template(card_template, confidence=0.6)
+        # 在同一张截图上并行检测所有卡牌槽位
+        card_templates = [f'card_slot_{i}.png' for i in range(1, 5)]
+        matches = self.find_templates(card_templates, confidence=0.6)
+        
+        for i, card_template in enumerate(card_templates, start=1):
+            position = matches[card_template]
             if position:
                 positions.append((position, i))
         
@@ -447,7 +504,7 @@ class AutoBattleSpirit(AutoGame):
         :return: 卡牌位置列表
         """
         # 获取屏幕截图
-        screen = self.take_screenshot()
+        screen = self.get_frame()
         if screen is None:
             return []
         
@@ -461,7 +518,7 @@ class AutoBattleSpirit(AutoGame):
         
         # 返回卡牌位置列表
         return [left_card, middle_card, right_card]
-        
+    
     def select_card_to_buy(self):
         """
         从商店中选择一张卡牌购买
@@ -517,7 +574,7 @@ class AutoBattleSpirit(AutoGame):
         self.log(f"尝试购买卡牌，位置: {card_position}")
         if self.click(card_position):
             # 等待购买动画完成
-            time.sleep(0.5)
+            self.wait_until_stable(max_wait=0.5)
             self.log(f"购买卡牌成功")
             return True
         else:
@@ -539,7 +596,7 @@ class AutoBattleSpirit(AutoGame):
         self.log("尝试刷新卡牌")
         if self.click(refresh_button_pos):
             # 等待刷新动画完成
-            time.sleep(0.5)
+            self.wait_until_stable(max_wait=0.5)
             
             self.log("刷新卡牌成功")
             return True
@@ -575,8 +632,8 @@ class AutoBattleSpirit(AutoGame):
         if target_position is None:
             # 获取客户区中心位置
             if self.client_rect:
-                center_x = self.client_rect[0] + self.client_rect[2] // 2
-                center_y = self.client_rect[1] + self.client_rect[3] // 2
+                center_x = self.client_rect[2] // 2
+                center_y = self.client_rect[3] // 2
                 
                 # 在中心区域随机选择一个点
                 target_x = center_x + random.randint(-100, 100)
@@ -584,7 +641,7 @@ class AutoBattleSpirit(AutoGame):
                 target_position = (target_x, target_y)
             else:
                 # 如果没有客户区信息，使用屏幕中心
-                screen_width, screen_height = pyautogui.size()
+                screen_width, screen_height = self.screen_size()
                 center_x, center_y = screen_width // 2, screen_height // 2
                 
                 # 在中心区域随机选择一个点
@@ -593,7 +650,7 @@ class AutoBattleSpirit(AutoGame):
                 target_position = (target_x, target_y)
         
         # 点击目标位置放置卡牌
-        time.sleep(0.5)  # 短暂延迟，模拟人类操作
+        self.sleep(0.5)  # 短暂延迟，模拟人类操作
         self.click(target_position)
         
         self.log(f"已打出卡牌{card_index}到位置{target_position}")
@@ -612,7 +669,7 @@ class AutoBattleSpirit(AutoGame):
         gold = self.detect_gold()
         population, max_population = self.detect_population()
         
-        self.log(f"当前状态 - 能量: {energy}, 金币: {gold}, 人口: {population}/{max_population}")
+        self.log(f"当前状态 - 能量: {energy:.1f}, 金币: {gold}, 人口: {population}/{max_population}")
         
         # 战斗策略：
         # 1. 如果人口未满且有足够金币，优先升级人口
@@ -637,7 +694,7 @@ class AutoBattleSpirit(AutoGame):
                 gold = self.detect_gold()
         
         # 3. 刷新商店
-        if gold >= 2:  # 假设刷新价格为2金币
+        if gold >= self.detect_refresh_cost():
             # 随机决定是否刷新，概率为50%
             if random.random() > 0.5:
                 if self.refresh_shop():
@@ -661,40 +718,35 @@ class AutoBattleSpirit(AutoGame):
             # 等待一段时间，让能量恢复
             wait_time = random.uniform(1.5, 3.0)
             self.log(f"等待{wait_time:.1f}秒后继续操作")
-            time.sleep(wait_time)
+            self.sleep(wait_time)
         
         # 5. 判断是否结束回合
-        if gold < 2:  # 如果金币不足以进行任何操作，结束回合
+        if gold < self.refresh_cost:  # 如果金币连刷新商店都不够，结束回合
             self.log("金币已用完，回合结束")
             # 实际游戏中可能需要点击回合结束按钮
             # 这里简化处理，等待一段时间
-            time.sleep(3)
+            self.sleep(3)
     
     def handle_battle_result(self):
         """
         处理战斗结果
         :return: 战斗结果描述
         """
-        # 等待战斗结束画面
+        # 等待战斗结束画面，胜利和失败画面在同一张截图上并行检测，最多等待30秒
         result = None
-        max_wait = 30  # 最多等待30秒
-        start_time = time.time()
-        
-        while time.time() - start_time < max_wait:
-            # 检测胜利画面
-            if self.find_template('victory_screen.png', confidence=0.7):
-                result = "victory"
-                self.log("战斗胜利！")
-                break
-            
-            # 检测失败画面
-            if self.find_template('defeat_screen.png', confidence=0.7):
-                result = "defeat"
-                self.log("战斗失败！")
-                break
-            
-            # 等待一段时间再检测
-            time.sleep(1)
+        template_name, _ = self.wait_for_templates(
+            ['victory_screen.png', 'defeat_screen.png'], max_wait=30, confidence=0.7
+        )
+        
+        # 检测胜利画面
+        if template_name == 'victory_screen.png':
+            result = "victory"
+            self.log("战斗胜利！")
+        
+        # 检测失败画面
+        elif template_name == 'defeat_screen.png':
+            result = "defeat"
+            self.log("战斗失败！")
         
         # 如果超时未检测到结果
         if result is None:
@@ -702,7 +754,7 @@ class AutoBattleSpirit(AutoGame):
             return "timeout"
         
         # 点击确认按钮返回主界面
-        time.sleep(2)  # 等待一段时间，让结算画面完全显示
+        self.sleep(2)  # 等待一段时间，让结算画面完全显示
         if self.click_template('ok_button.png'):
             self.log("已点击确认按钮，返回主界面")
         
@@ -731,10 +783,14 @@ class AutoBattleSpirit(AutoGame):
         try:
             while battles_completed < num_battles:
                 self.log(f"开始第 {battles_completed + 1} 次战斗")
+                replay_position = self.replay_position()
                 
                 # 开始战斗
-                if not self.start_battle():
+                with self.frame_tick():
+                    started = self.start_battle()
+                if not started:
                     self.log("无法开始战斗，尝试重新激活窗口")
+                    self.check_replay_progress(replay_position)
                     if not self.activate_window():
                         self.log("无法激活游戏窗口，自动战斗中断")
                         break
@@ -745,7 +801,9 @@ class AutoBattleSpirit(AutoGame):
                 max_battle_time = 180  # 最长战斗时间（秒）
                 
                 while self.in_battle and battle_duration < max_battle_time:
-                    self.perform_battle_actions()
+                    # 每个决策帧只截图一次，帧内的检测共用
+                    with self.frame_tick():
+                        self.perform_battle_actions()
                     battle_duration += 3  # 假设每次操作大约3秒
                 
                 # 处理战斗结果
@@ -760,7 +818,7 @@ class AutoBattleSpirit(AutoGame):
                 # 战斗之间等待一段时间
                 if battles_completed < num_battles:
                     self.log(f"等待 {wait_between} 秒后开始下一场战斗")
-                    time.sleep(wait_between)
+                    self.sleep(wait_between)
             
             self.log(f"自动战斗完成，共进行 {battles_completed} 次战斗，胜利 {victories} 次，失败 {defeats} 次")
         
@@ -1,14 +1,37 @@
 import cv2
 import numpy as np
-import pyautogui
 import time
 import random
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from async_runtime import AsyncBotRuntime
+from capture_backends import create_capture_backend, ImageGrabCapture, ReplayCapture, ReplayStalled
+from capture_service import CaptureService
+from frame_bus import FrameBus
+from frame_change import FrameChangeDetector
+from frame_recorder import FrameRecorder
+from hud_reader import DigitReader
+from game_clock import create_clock
+from input_backends import create_input_backend, get_timing_profile, RecordingInput
+from pipeline_runtime import PipelineRuntime
+from scene_classifier import SceneClassifier
+from state_tracker import StateTracker
+from template_store import TemplateStore
+from vision_utils import convert_channels, non_max_suppression, to_gray
+
+try:
+    import pyautogui
+except Exception:
+    # 没有显示器的环境（如在Linux上回放录制画面）无法导入pyautogui
+    pyautogui = None
 
 # 设置pyautogui的安全特性
-pyautogui.FAILSAFE = True  # 将鼠标移动到屏幕左上角将中断程序
-pyautogui.PAUSE = 0.5  # 每次pyautogui操作后暂停的秒数
+if pyautogui is not None:
+    pyautogui.FAILSAFE = True  # 将鼠标移动到屏幕左上角将中断程序
+    pyautogui.PAUSE = 0  # 操作后的停顿由输入时序配置通过时钟控制
 
 class AutoGame:
     def __init__(self, confidence=0.8, region=None):
@@ -19,15 +42,89 @@ class AutoGame:
         """
         self.confidence = confidence
         self.region = region
-        self.screen = None
+        self.screen = None  # 最近一次的屏幕截图
+        
+        # 截图后端：Linux下优先使用X11共享内存，截图直接写入复用的numpy缓冲区
+        self.capture_backend = create_capture_backend()
+        self._fallback_capture = None
+        self.fleet_mode = False  # 由 Fleet 加入机器人组后截图只来自组内共享的桌面截图，不使用备用截图方法
+        
+        # 输入后端：默认使用pyautogui（保留左上角紧急停止）；回放录制画面时不操作真实的鼠标，只记录操作
+        self.dry_run = isinstance(self.capture_backend, ReplayCapture)
+        self.input = RecordingInput() if self.dry_run else create_input_backend()
+        self.timing = get_timing_profile()  # 每种操作的按住时长和之后的停顿
+        
+        # 后台截图服务（可选），启用后截图直接读取环形缓冲区中的最新帧
+        self.capture_service = None
+        self.max_frame_age = 0.1  # 读取的帧最多允许多旧（秒）
+        self._service_frame = None  # 当前锁定的后台截图帧
+        self._last_action_time = 0.0  # 最近一次会改变画面的动作的时间（机器人时钟）
+        self._transition_until = 0.0  # 预期画面切换的截止时间，之前的等待快速轮询
+        
+        # 所有等待都通过时钟进行，回放和测试时可以换成立即返回的虚拟时钟
+        self.clock = None
+        self.set_clock(create_clock())
+        
+        # 流水线运行时（可选），启用后动作异步执行，下一帧在动作执行期间预取并预先匹配
+        self.pipeline = None
+        
+        # 帧序号和时间戳，每获得一张新截图序号加一
+        self.frame_seq = 0
+        self.frame_timestamp = None
+        
+        # 会话录制器（可选），每张新截图都会追加到录制文件
+        self.recorder = None
+        
+        # 共享内存帧总线（可选），每张新截图都会发布给其他进程
+        self.frame_bus = None
+        
+        # 模板依赖的画面区域没有变化时直接复用上一次的匹配结果
+        self.change_detector = FrameChangeDetector()
+        self._match_cache = {}
+        self.match_cache_hits = 0
+        
+        # 画面指纹分类器，识别出的场景不需要再做模板匹配
+        self.scene_classifier = SceneClassifier()
+        
+        # 界面状态转移跟踪器，按上一个状态决定状态检查的顺序
+        self.state_tracker = StateTracker()
+        
+        # 决策帧共享截图：一个决策帧内的所有模板查找共用同一张截图
+        self.current_frame = None
+        self._frame_active = False  # 当前是否处于决策帧中
+        self._frame_stale = False  # 动作执行后画面已变化，需要重新截图
+        
         self.templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
         
         # 确保模板目录存在
         if not os.path.exists(self.templates_dir):
             os.makedirs(self.templates_dir)
         
+        # 模板图像缓存，避免每次匹配都从磁盘读取和解码PNG
+        self.template_store = TemplateStore(self.templates_dir)
+        
+        # HUD数字读取器，字形库位于模板目录的 digits 子目录
+        self.digit_reader = DigitReader(self.template_store)
+        
+        # 多模板并行匹配使用的线程池，首次使用时创建
+        self._match_executor = None
+        
         # 日志设置
         self.log_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'autogame.log')
+        self.log_prefix = ''  # 多个机器人同时运行时用于区分日志来源
+        
+        # 模板搜索区域(ROI)提示：{模板名: (x, y, width, height)}，坐标相对于截图
+        # 配置的ROI来自模板目录下的template_rois.json，学习的ROI来自之前的命中位置
+        # 匹配时先搜索ROI，未命中再回退到全屏搜索
+        self.template_rois = self.load_template_rois()
+        self.learned_rois = {}
+        self.roi_padding = 0.5  # 学习的ROI在命中框四周各扩展模板尺寸的比例
+        
+        # 金字塔匹配：大模板先在缩小的截图上找候选位置，再只在候选窗口内按原分辨率精确匹配
+        self.pyramid_scales = (8, 4)  # 可选的缩小倍数，优先使用更大的倍数
+        self.pyramid_min_side = 16  # 缩小后模板的最短边不能小于该值
+        self.pyramid_min_area = 40000  # 模板面积达到该值时自动使用金字塔匹配
+        self.pyramid_top_k = 3  # 在原分辨率下精确匹配的候选数量
         
         print("自动游戏脚本已初始化")
     
@@ -37,7 +134,7 @@ class AutoGame:
         :param message: 日志消息
         """
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_message = f"[{timestamp}] {message}"
+        log_message = f"[{timestamp}] {self.log_prefix}{message}"
         print(log_message)
         
         with open(self.log_file, 'a', encoding='utf-8') as f:
@@ -46,72 +143,767 @@ class AutoGame:
     def take_screenshot(self):
         """
         获取屏幕截图
-        :return: 屏幕截图的numpy数组，如果截图失败则返回None
+        返回的数组可能是截图后端复用缓冲区的视图，下一次截图后内容会被覆盖
+        :return: 屏幕截图的numpy数组(BGR或BGRA)，如果截图失败则返回None
         """
+        if self.pipeline is not None:
+            return self._read_pipeline()
+        if self.capture_service is not None and self.capture_service.running:
+            return self._read_capture_service()
+        
         try:
-            self.screen = pyautogui.screenshot(region=self.region)
-            return cv2.cvtColor(np.array(self.screen), cv2.COLOR_RGB2BGR)
+            self.screen = self.capture_backend.grab(self.region)
+            self._new_frame(self.clock.now())
+            return self.screen
         except Exception as e:
             self.log(f"截图失败: {str(e)}")
+            if self.fleet_mode:
+                # 单独截图会绕开机器人组共享的桌面截图
+                return None
             self.log("尝试使用备用截图方法...")
             try:
                 # 备用方法：使用PIL的ImageGrab直接截图
-                from PIL import ImageGrab
-                if self.region:
-                    self.screen = ImageGrab.grab(bbox=self.region)
-                else:
-                    self.screen = ImageGrab.grab()
-                return cv2.cvtColor(np.array(self.screen), cv2.COLOR_RGB2BGR)
+                if self._fallback_capture is None:
+                    self._fallback_capture = ImageGrabCapture()
+                self.screen = self._fallback_capture.grab(self.region)
+                self._new_frame(self.clock.now())
+                return self.screen
             except Exception as e2:
                 self.log(f"备用截图方法也失败: {str(e2)}")
                 return None
     
-    def find_template(self, template_name, confidence=None):
+    def set_clock(self, clock):
+        """
+        设置机器人使用的时钟
+        回放录制画面时，按时间戳回放的画面也跟随该时钟前进
+        :param clock: SystemClock 或 VirtualClock
+        """
+        self.clock = clock
+        self.input.sleep = clock.sleep
+        if isinstance(self.input, RecordingInput):
+            self.input.clock = clock.now
+        if self.dry_run:
+            self.capture_backend.clock = clock.now
+        if self.capture_service is not None:
+            # 帧时间戳与动作时间、帧年龄使用同一个时钟
+            self.capture_service.clock = clock.now
+    
+    def sleep(self, seconds):
+        """
+        通过时钟等待，虚拟时钟下立即返回
+        启用流水线时先等待已提交的动作执行完，并在等待结束前提前预取下一帧
+        :param seconds: 等待的秒数
+        """
+        if self.pipeline is None or seconds <= 0:
+            self.clock.sleep(seconds)
+            return
+        
+        deadline = self.clock.now() + seconds
+        self.pipeline.drain(timeout=seconds)
+        remaining = deadline - self.clock.now() - self.pipeline.prefetch_time
+        if remaining > 0:
+            self.clock.sleep(remaining)
+        self.pipeline.request_prefetch()
+        self.clock.sleep(deadline - self.clock.now())
+    
+    def _new_frame(self, timestamp):
+        """
+        记录获得了一张新截图
+        """
+        self.frame_seq += 1
+        self.frame_timestamp = timestamp
+        if self.recorder is not None:
+            self.recorder.record(self.screen, timestamp)
+        if self.frame_bus is not None:
+            try:
+                self.frame_bus.publish(self.screen, timestamp)
+            except ValueError as e:
+                self.log(f"发布到帧总线失败: {str(e)}")
+        self.change_detector.update(self.screen)
+    
+    def start_recording(self, path, keyframe_interval=30):
+        """
+        开始录制会话，之后的每张截图都写入录制文件，可用 run_replay.py 回放
+        :param path: 录制文件路径（.agfr）
+        :param keyframe_interval: 关键帧间隔（帧）
+        """
+        self.stop_recording()
+        self.recorder = FrameRecorder(path, keyframe_interval=keyframe_interval)
+        self.log(f"开始录制会话: {path}")
+    
+    def stop_recording(self):
+        """
+        停止录制并写入索引
+        """
+        if self.recorder is None:
+            return
+        recorder = self.recorder
+        self.recorder = None
+        recorder.close()
+        self.log(
+            f"录制结束: {recorder.frames_recorded} 帧，丢弃 {recorder.frames_dropped} 帧，"
+            f"{recorder.bytes_written / 1024 / 1024:.1f} MB"
+        )
+    
+    def start_frame_bus(self, name=None, slots=8, slot_bytes=None):
+        """
+        创建共享内存帧总线，之后的每张截图都发布到总线上，
+        工作进程用 FrameBus.attach(name) 或环境变量AUTOGAME_FRAME_BUS=name 零复制地读取
+        :param name: 共享内存名称，默认自动生成
+        :param slots: 环形缓冲区的槽位数，工作进程最多可以落后这么多帧
+        :param slot_bytes: 每个槽位的字节数，默认按当前截图的大小
+        :return: 帧总线名称，截图失败时返回None
+        """
+        self.stop_frame_bus()
+        if slot_bytes is None:
+            screen = self.take_screenshot()
+            if screen is None:
+                self.log("无法创建帧总线：截图失败")
+                return None
+            slot_bytes = screen.nbytes
+        self.frame_bus = FrameBus.create(slot_bytes, slots=slots, name=name)
+        self.log(f"帧总线已创建: {self.frame_bus.name}，{slots} 个槽位，每个 {slot_bytes / 1024 / 1024:.1f} MB")
+        return self.frame_bus.name
+    
+    def stop_frame_bus(self):
+        """
+        删除帧总线，已连接的工作进程随后读不到新帧
+        """
+        if self.frame_bus is None:
+            return
+        bus = self.frame_bus
+        self.frame_bus = None
+        bus.close()
+        self.log(f"帧总线已关闭: 发布 {bus.frames_published} 帧")
+    
+    def start_capture_service(self, interval=0.0, buffer_size=4, max_age=0.1):
+        """
+        启动后台截图服务，之后的截图都从后台线程的环形缓冲区读取，不再阻塞决策循环
+        :param interval: 后台截图的最小间隔（秒）
+        :param buffer_size: 环形缓冲区的槽位数
+        :param max_age: 读取的帧最多允许多旧（秒）
+        """
+        if self.capture_service is None:
+            self.capture_service = CaptureService(
+                self.capture_backend, self.region, buffer_size, interval, clock=self.clock.now,
+            )
+        self.max_frame_age = max_age
+        self.capture_service.start()
+        self.log(f"后台截图服务已启动，截图后端: {self.capture_backend.name}")
+    
+    def stop_capture_service(self):
+        """
+        停止后台截图服务，恢复同步截图
+        """
+        if self.capture_service is None:
+            return
+        self.capture_service.release(self._service_frame)
+        self._service_frame = None
+        self.capture_service.stop()
+        self.capture_service = None
+        self.log("后台截图服务已停止")
+    
+    def _read_capture_service(self):
+        """
+        从后台截图服务读取最新帧
+        只接受在最近一次动作之后才开始截取、且不超过max_frame_age的帧
+        """
+        service = self.capture_service
+        service.region = self.region
+        frame = service.acquire_latest(
+            max_age=self.max_frame_age,
+            min_timestamp=self._last_action_time,
+            timeout=1.0,
+        )
+        if frame is None:
+            self.log(f"后台截图服务未能提供新帧: {service.last_error}")
+            return None
+        
+        previous = self._service_frame
+        service.release(previous)
+        self._service_frame = frame
+        self.screen = frame.image
+        if previous is None or previous.seq != frame.seq:
+            self._new_frame(frame.timestamp)
+        return self.screen
+    
+    def start_pipeline(self, max_action_age=1.0, max_frame_age=0.3, scene_change=0.6):
+        """
+        启用流水线运行时：点击和拖动提交后立即返回，由输入线程执行；
+        下一帧在动作执行期间截取并预先匹配最近使用过的模板，策略代码不需要任何修改
+        :param max_action_age: 动作从提交到执行允许的最长时间（秒），超过则丢弃
+        :param max_frame_age: 预取的帧最多允许多旧（秒）
+        :param scene_change: 变化图块的比例达到该值时视为画面切换，丢弃基于旧画面的动作
+        """
+        if self.pipeline is not None:
+            return
+        self._get_match_executor()
+        self.pipeline = PipelineRuntime(
+            self, max_action_age=max_action_age, max_frame_age=max_frame_age, scene_change=scene_change,
+        )
+        self.pipeline.start()
+        self.log("流水线运行时已启动")
+    
+    def stop_pipeline(self):
+        """
+        执行完已提交的动作后停止流水线运行时，恢复同步执行
+        """
+        if self.pipeline is None:
+            return
+        pipeline = self.pipeline
+        pipeline.stop()
+        self.pipeline = None
+        self.log(
+            f"流水线运行时已停止: 执行 {pipeline.actions_executed} 个动作，丢弃 {pipeline.actions_dropped} 个过期动作，"
+            f"预取 {pipeline.frames_prefetched} 帧，使用 {pipeline.frames_adopted} 帧"
+        )
+    
+    def _read_pipeline(self):
+        """
+        从流水线运行时取得预取的帧，并把预先计算的匹配结果放入匹配缓存
+        """
+        frame = self.pipeline.acquire_frame()
+        if frame is None:
+            self.log("流水线运行时未能提供新帧")
+            return None
+        
+        self.screen = frame.image
+        self._new_frame(frame.timestamp)
+        for key, (template, result, region) in frame.matches.items():
+            self._store_match(self.screen, key, template, result, region)
+        return self.screen
+    
+    def async_runtime(self, max_frame_age=None):
+        """
+        创建基于asyncio的运行时，截图、匹配、等待和点击都可以在协程中并发进行
+        :param max_frame_age: 共享截图最多允许多旧（秒），默认与self.max_frame_age相同
+        :return: AsyncBotRuntime
+        """
+        if max_frame_age is None:
+            max_frame_age = self.max_frame_age
+        return AsyncBotRuntime(self, max_frame_age=max_frame_age)
+    
+    @contextmanager
+    def frame_tick(self):
+        """
+        决策帧上下文：进入时截图一次，帧内所有模板查找共用这张截图
+        执行点击等会改变画面的动作后，下一次查找会自动重新截图；
+        也可以调用 refresh_frame() 显式刷新
+        嵌套使用时沿用外层的决策帧
+        
+        用法:
+            with bot.frame_tick():
+                bot.detect_energy()
+                bot.detect_gold()
+        """
+        if self._frame_active:
+            yield self.get_frame()
+            return
+        
+        self._frame_active = True
+        try:
+            yield self.refresh_frame()
+        finally:
+            self._frame_active = False
+            self._frame_stale = False
+            self.current_frame = None
+    
+    def refresh_frame(self):
+        """
+        重新截图并作为当前决策帧的共享截图
+        :return: 新的屏幕截图，截图失败时返回None
+        """
+        self.current_frame = self.take_screenshot()
+        self._frame_stale = False
+        return self.current_frame
+    
+    def invalidate_frame(self):
+        """
+        标记当前共享截图已过期，下一次查找时重新截图
+        """
+        self._frame_stale = True
+    
+    def get_frame(self):
+        """
+        获取用于模板匹配的屏幕截图
+        在决策帧内返回共享截图（必要时刷新），否则直接截图
+        :return: 屏幕截图的numpy数组，如果截图失败则返回None
+        """
+        if not self._frame_active:
+            return self.take_screenshot()
+        
+        if self.current_frame is None or self._frame_stale:
+            return self.refresh_frame()
+        return self.current_frame
+    
+    def find_template(self, template_name, confidence=None, frame=None, pyramid=None):
         """
         在屏幕上查找模板图像
         :param template_name: 模板图像文件名
         :param confidence: 可选的置信度覆盖
+        :param frame: 可选的屏幕截图，默认使用当前决策帧的截图
+        :param pyramid: 是否使用金字塔匹配，默认根据模板大小自动选择
         :return: 匹配位置的中心点坐标，如果未找到则返回None
         """
         if confidence is None:
             confidence = self.confidence
-            
-        template_path = os.path.join(self.templates_dir, template_name)
-        if not os.path.exists(template_path):
-            self.log(f"模板文件不存在: {template_path}")
+        
+        # 从内存缓存获取已解码的模板
+        template = self.template_store.get(template_name)
+        if template is None:
+            template_path = os.path.join(self.templates_dir, template_name)
+            self.log(f"模板文件不存在或无法加载: {template_path}")
             return None
         
-        screen = self.take_screenshot()
+        screen = frame if frame is not None else self.get_frame()
         if screen is None:
             self.log("无法获取屏幕截图，无法进行模板匹配")
             return None
-            
-        template = cv2.imread(template_path)
         
-        # 确保模板和屏幕截图都已正确加载
+        key = ('locate', template_name, confidence, pyramid)
+        if self.pipeline is not None:
+            self.pipeline.watch(key, template_name, confidence, pyramid)
+        match = self._cached_match(screen, key, template)
+        if match is None:
+            # 使用OpenCV的模板匹配
+            try:
+                center, max_val, region = self._locate_template(screen, template_name, template, confidence, pyramid)
+            except Exception as e:
+                self.log(f"模板匹配过程中出错: {str(e)}")
+                return None
+            match = (center, max_val)
+            self._store_match(screen, key, template, match, region)
+        
+        center, max_val = match
+        return self._report_match(template_name, center, max_val, confidence)
+    
+    def find_templates(self, template_names, frame=None, confidence=None, pyramid=None):
+        """
+        在同一张截图上并行匹配多个模板
+        OpenCV在matchTemplate期间会释放GIL，因此使用线程池即可并行匹配
+        :param template_names: 模板图像文件名列表
+        :param frame: 可选的屏幕截图，默认使用当前决策帧的截图
+        :param confidence: 可选的置信度覆盖
+        :param pyramid: 是否使用金字塔匹配，默认根据模板大小自动选择
+        :return: {模板名: 匹配位置的中心点坐标或None}
+        """
+        if confidence is None:
+            confidence = self.confidence
+        
+        results = {template_name: None for template_name in template_names}
+        
+        templates = {}
+        for template_name in results:
+            template = self.template_store.get(template_name)
+            if template is None:
+                template_path = os.path.join(self.templates_dir, template_name)
+                self.log(f"模板文件不存在或无法加载: {template_path}")
+                continue
+            templates[template_name] = template
+        
+        if not templates:
+            return results
+        
+        screen = frame if frame is not None else self.get_frame()
+        if screen is None:
+            self.log("无法获取屏幕截图，无法进行模板匹配")
+            return results
+        
+        # 只有一个模板时直接匹配，省去线程调度开销
+        if len(templates) == 1:
+            template_name, template = next(iter(templates.items()))
+            results[template_name] = self.find_template(template_name, confidence, frame=screen, pyramid=pyramid)
+            return results
+        
+        # 画面未变化的模板直接使用缓存的结果，其余的提交到线程池
+        executor = self._get_match_executor()
+        futures = {}
+        for template_name, template in templates.items():
+            key = ('locate', template_name, confidence, pyramid)
+            if self.pipeline is not None:
+                self.pipeline.watch(key, template_name, confidence, pyramid)
+            match = self._cached_match(screen, key, template)
+            if match is not None:
+                results[template_name] = self._report_match(template_name, match[0], match[1], confidence)
+                continue
+            futures[template_name] = executor.submit(
+                self._locate_template, screen, template_name, template, confidence, pyramid
+            )
+        
+        for template_name, future in futures.items():
+            try:
+                center, max_val, region = future.result()
+            except Exception as e:
+                self.log(f"模板 {template_name} 匹配过程中出错: {str(e)}")
+                continue
+            key = ('locate', template_name, confidence, pyramid)
+            self._store_match(screen, key, templates[template_name], (center, max_val), region)
+            results[template_name] = self._report_match(template_name, center, max_val, confidence)
+        
+        return results
+    
+    def find_all(self, template_name, threshold=None, max_results=20, frame=None, iou_threshold=0.3):
+        """
+        在截图上查找模板的所有实例
+        对匹配响应图做阈值和局部极大值筛选，再用向量化的非极大值抑制去除重叠结果，
+        一次匹配即可得到所有实例，无需每次点击后重新搜索
+        :param template_name: 模板图像文件名
+        :param threshold: 置信度阈值，默认使用self.confidence
+        :param max_results: 最多返回的实例数量
+        :param frame: 可选的屏幕截图，默认使用当前决策帧的截图
+        :param iou_threshold: 两个实例的交并比超过该值时只保留得分高的一个
+        :return: (N, 3) float32数组，每行为 (中心x, 中心y, 置信度)，按置信度从高到低排列
+        """
+        empty = np.empty((0, 3), dtype=np.float32)
+        if threshold is None:
+            threshold = self.confidence
+        
+        template = self.template_store.get(template_name)
         if template is None:
-            self.log(f"无法加载模板图像: {template_path}")
-            return None
+            template_path = os.path.join(self.templates_dir, template_name)
+            self.log(f"模板文件不存在或无法加载: {template_path}")
+            return empty
+        
+        screen = frame if frame is not None else self.get_frame()
+        if screen is None:
+            self.log("无法获取屏幕截图，无法进行模板匹配")
+            return empty
+        
+        key = ('all', template_name, threshold, max_results, iou_threshold)
+        instances = self._cached_match(screen, key, template)
+        if instances is None:
+            instances = self._find_all_instances(screen, template_name, template, threshold, max_results, iou_threshold)
+            if instances is None:
+                return empty
+            self._store_match(screen, key, template, instances)
         
-        # 使用OpenCV的模板匹配
+        if len(instances) == 0:
+            self.log(f"未找到模板 {template_name} 的任何实例")
+        else:
+            self.log(f"找到模板 {template_name} 的 {len(instances)} 个实例")
+        # 返回副本，调用方修改结果不影响缓存
+        return instances.copy()
+    
+    def _find_all_instances(self, screen, template_name, template, threshold, max_results, iou_threshold):
+        """
+        匹配模板并用非极大值抑制提取所有实例
+        :return: (N, 3) float32数组，匹配出错时返回None
+        """
         try:
+            template = self._template_for_frame(template_name, template, screen)
             result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-            
-            if max_val >= confidence:
-                # 计算匹配区域的中心点
-                h, w = template.shape[:2]
-                center_x = max_loc[0] + w // 2
-                center_y = max_loc[1] + h // 2
-                
-                self.log(f"找到模板 {template_name} 在位置 ({center_x}, {center_y}) 置信度: {max_val:.2f}")
-                return (center_x, center_y)
-            else:
-                self.log(f"未找到模板 {template_name} (最高置信度: {max_val:.2f})")
-                return None
         except Exception as e:
             self.log(f"模板匹配过程中出错: {str(e)}")
             return None
+        
+        # 只保留超过阈值的局部极大值，避免同一实例周围的大量相邻响应进入NMS
+        local_max = cv2.dilate(result, np.ones((3, 3), dtype=np.uint8))
+        ys, xs = np.nonzero((result >= threshold) & (result >= local_max))
+        if len(xs) == 0:
+            return np.empty((0, 3), dtype=np.float32)
+        scores = result[ys, xs]
+        
+        h, w = template.shape[:2]
+        boxes = np.empty((len(xs), 4), dtype=np.float32)
+        boxes[:, 0] = xs
+        boxes[:, 1] = ys
+        boxes[:, 2] = w
+        boxes[:, 3] = h
+        keep = non_max_suppression(boxes, scores, iou_threshold, max_results)
+        
+        instances = np.empty((len(keep), 3), dtype=np.float32)
+        instances[:, 0] = xs[keep] + w // 2
+        instances[:, 1] = ys[keep] + h // 2
+        instances[:, 2] = scores[keep]
+        return instances
+    
+    def _cached_match(self, screen, key, template):
+        """
+        获取缓存的匹配结果，结果所依赖的区域内有图块变化时缓存失效
+        只有最近一次截图的结果会被缓存，调用方传入的其他截图总是重新匹配
+        :param key: 匹配方式和参数组成的缓存键
+        :param template: 当前的模板图像，模板重新加载后缓存失效
+        :return: 缓存的结果，没有可用缓存时返回None
+        """
+        if screen is not self.screen:
+            return None
+        entry = self._match_cache.get(key)
+        if entry is None:
+            return None
+        cached_template, result, version, region = entry
+        if cached_template is not template or self.change_detector.changed_since(version, region):
+            return None
+        self.match_cache_hits += 1
+        return result
+    
+    def _store_match(self, screen, key, template, result, region=None):
+        """
+        缓存最近一次截图的匹配结果
+        :param region: 结果所依赖的截图区域 (x, y, width, height)，None表示整个画面
+        """
+        if screen is self.screen:
+            self._match_cache[key] = (template, result, self.change_detector.version, region)
+    
+    def _get_match_executor(self):
+        """
+        获取模板匹配线程池，首次使用时创建
+        """
+        if self._match_executor is None:
+            self._match_executor = ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 1),
+                thread_name_prefix='template-match',
+            )
+        return self._match_executor
+    
+    def load_template_rois(self):
+        """
+        从模板目录下的template_rois.json加载模板搜索区域配置
+        文件格式: {"battle_button.png": [x, y, width, height], ...}
+        :return: {模板名: (x, y, width, height)}
+        """
+        rois_path = os.path.join(self.templates_dir, 'template_rois.json')
+        if not os.path.exists(rois_path):
+            return {}
+        
+        try:
+            with open(rois_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            return {name: tuple(int(v) for v in roi) for name, roi in config.items()}
+        except (OSError, ValueError, TypeError) as e:
+            self.log(f"加载模板搜索区域配置失败: {str(e)}")
+            return {}
+    
+    def set_template_roi(self, template_name, roi):
+        """
+        设置模板的搜索区域
+        :param template_name: 模板图像文件名
+        :param roi: (x, y, width, height) 坐标相对于截图，为None时清除配置
+        """
+        if roi is None:
+            self.template_rois.pop(template_name, None)
+        else:
+            self.template_rois[template_name] = tuple(int(v) for v in roi)
+        self.learned_rois.pop(template_name, None)
+        self._match_cache.clear()
+    
+    def get_template_roi(self, template_name):
+        """
+        获取模板的搜索区域，配置的ROI优先于学习的ROI
+        :return: (x, y, width, height) 或None
+        """
+        roi = self.template_rois.get(template_name)
+        if roi is None:
+            roi = self.learned_rois.get(template_name)
+        return roi
+    
+    def _locate_template(self, screen, template_name, template, confidence, pyramid=None):
+        """
+        先在模板的搜索区域内匹配，未达到阈值时回退到全屏匹配
+        匹配耗时与搜索面积成正比，固定位置的界面元素大多可以在ROI内命中
+        :return: (最佳匹配位置的中心点坐标, 最高置信度, 实际搜索的区域)，全屏搜索时区域为None
+        """
+        template = self._template_for_frame(template_name, template, screen)
+        if pyramid is None:
+            h, w = template.shape[:2]
+            pyramid = h * w >= self.pyramid_min_area
+        
+        def match(image):
+            if pyramid:
+                return self._match_pyramid(image, template, template_name)
+            return self._match_template(image, template)
+        
+        roi = self.get_template_roi(template_name)
+        if roi is not None:
+            crop, offset = self._crop_roi(screen, roi, template)
+            if crop is not None:
+                center, max_val = match(crop)
+                if max_val >= confidence:
+                    region = (offset[0], offset[1], crop.shape[1], crop.shape[0])
+                    return (center[0] + offset[0], center[1] + offset[1]), max_val, region
+        
+        # ROI未命中，回退到全屏搜索
+        center, max_val = match(screen)
+        if max_val >= confidence and template_name not in self.template_rois:
+            self._learn_roi(template_name, center, template)
+        return center, max_val, None
+    
+    def _template_for_frame(self, template_name, template, screen):
+        """
+        获取与截图通道数一致的模板
+        截图后端可能返回BGRA或灰度图像，此时直接在原截图上匹配转换后的模板，而不是复制转换整张截图
+        """
+        channels = 1 if screen.ndim == 2 else screen.shape[2]
+        template_channels = 1 if template.ndim == 2 else template.shape[2]
+        if channels == template_channels:
+            return template
+        
+        converted = self.template_store.get_variant(
+            template_name, ('channels', channels),
+            lambda image: convert_channels(image, channels),
+        )
+        return converted if converted is not None else convert_channels(template, channels)
+    
+    def _crop_roi(self, screen, roi, template):
+        """
+        按ROI裁剪截图（numpy视图，不复制数据）
+        :return: (裁剪后的截图, (x偏移, y偏移))，ROI无效或小于模板时返回(None, None)
+        """
+        x, y, w, h = roi
+        screen_h, screen_w = screen.shape[:2]
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(screen_w, x + w), min(screen_h, y + h)
+        
+        template_h, template_w = template.shape[:2]
+        if x2 - x1 < template_w or y2 - y1 < template_h:
+            return None, None
+        return screen[y1:y2, x1:x2], (x1, y1)
+    
+    def _learn_roi(self, template_name, center, template):
+        """
+        根据全屏命中的位置学习模板的搜索区域
+        """
+        template_h, template_w = template.shape[:2]
+        pad_x = int(template_w * self.roi_padding)
+        pad_y = int(template_h * self.roi_padding)
+        left = center[0] - template_w // 2 - pad_x
+        top = center[1] - template_h // 2 - pad_y
+        self.learned_rois[template_name] = (left, top, template_w + 2 * pad_x, template_h + 2 * pad_y)
+    
+    def _match_template(self, screen, template):
+        """
+        在截图上匹配模板，不做阈值判断
+        :param screen: 屏幕截图
+        :param template: 模板图像
+        :return: (最佳匹配位置的中心点坐标, 最高置信度)
+        """
+        result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        
+        # 计算匹配区域的中心点
+        h, w = template.shape[:2]
+        center = (max_loc[0] + w // 2, max_loc[1] + h // 2)
+        return center, max_val
+    
+    def _match_pyramid(self, screen, template, template_name):
+        """
+        由粗到细的金字塔匹配
+        先在缩小的截图上匹配缩小的模板找出前k个候选位置，
+        再只在候选窗口内按原分辨率匹配，返回的置信度仍是原分辨率下的TM_CCOEFF_NORMED，
+        因此已有的置信度阈值保持不变
+        :return: (最佳匹配位置的中心点坐标, 最高置信度)
+        """
+        template_h, template_w = template.shape[:2]
+        screen_h, screen_w = screen.shape[:2]
+        
+        scale = None
+        for candidate in self.pyramid_scales:
+            if min(template_h, template_w) // candidate >= self.pyramid_min_side:
+                scale = candidate
+                break
+        if scale is None:
+            # 模板太小，缩小后无法可靠匹配
+            return self._match_template(screen, template)
+        
+        small_w, small_h = template_w // scale, template_h // scale
+        small_template_channels = 1 if template.ndim == 2 else template.shape[2]
+        small_template = self.template_store.get_variant(
+            template_name, ('pyramid', scale, small_template_channels),
+            lambda image: cv2.resize(template, (small_w, small_h), interpolation=cv2.INTER_AREA),
+        )
+        if small_template is None or small_template.shape[:2] != (small_h, small_w):
+            return self._match_template(screen, template)
+        if screen_w // scale < small_w or screen_h // scale < small_h:
+            return self._match_template(screen, template)
+        small_screen = cv2.resize(screen, (screen_w // scale, screen_h // scale), interpolation=cv2.INTER_AREA)
+        
+        # 粗匹配：依次取响应最高的位置，并抑制其邻域，得到前k个候选
+        result = cv2.matchTemplate(small_screen, small_template, cv2.TM_CCOEFF_NORMED)
+        candidates = []
+        for _ in range(self.pyramid_top_k):
+            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+            candidates.append(max_loc)
+            x, y = max_loc
+            result[max(0, y - small_h // 2):y + small_h // 2 + 1,
+                   max(0, x - small_w // 2):x + small_w // 2 + 1] = -1.0
+        
+        # 精匹配：在候选窗口内按原分辨率匹配，窗口四周留出缩放带来的误差
+        margin = scale * 2
+        best_center, best_val = None, -1.0
+        for x, y in candidates:
+            x1 = max(0, x * scale - margin)
+            y1 = max(0, y * scale - margin)
+            x2 = min(screen_w, x * scale + template_w + margin)
+            y2 = min(screen_h, y * scale + template_h + margin)
+            if x2 - x1 < template_w or y2 - y1 < template_h:
+                continue
+            center, max_val = self._match_template(screen[y1:y2, x1:x2], template)
+            if max_val > best_val:
+                best_center, best_val = (center[0] + x1, center[1] + y1), max_val
+        
+        if best_center is None:
+            return self._match_template(screen, template)
+        return best_center, best_val
+    
+    def _report_match(self, template_name, center, max_val, confidence):
+        """
+        根据置信度阈值判断匹配结果并记录日志
+        :return: 匹配位置的中心点坐标，如果未达到阈值则返回None
+        """
+        if max_val >= confidence:
+            self.log(f"找到模板 {template_name} 在位置 ({center[0]}, {center[1]}) 置信度: {max_val:.2f}")
+            return center
+        
+        self.log(f"未找到模板 {template_name} (最高置信度: {max_val:.2f})")
+        return None
+    
+    def hud_region(self, template_name, position, side='right', span=4.0):
+        """
+        截取HUD图标旁边的数字区域，交给 digit_reader 读取
+        :param template_name: 图标模板文件名，数字区域的大小按图标大小确定
+        :param position: find_template() 返回的图标中心点
+        :param side: 数字相对图标的位置：'right' 右侧，'below' 下方，'inside' 图标区域内
+        :param span: 数字区域的宽度为图标宽度的倍数（'inside'时忽略）
+        :return: 当前决策帧截图上该区域的视图，无法截取时返回None
+        """
+        template = self.template_store.get(template_name)
+        screen = self.get_frame()
+        if template is None or screen is None or position is None:
+            return None
+        
+        template_h, template_w = template.shape[:2]
+        center_x, center_y = position
+        left, top = center_x - template_w // 2, center_y - template_h // 2
+        width = int(template_w * span)
+        if side == 'right':
+            x, y, w, h = left + template_w, top, width, template_h
+        elif side == 'below':
+            x, y, w, h = center_x - width // 2, top + template_h, width, template_h
+        elif side == 'inside':
+            x, y, w, h = left, top, template_w, template_h
+        else:
+            raise ValueError(f"未知的数字区域位置: {side}")
+        
+        screen_h, screen_w = screen.shape[:2]
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(screen_w, x + w), min(screen_h, y + h)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return screen[y1:y2, x1:x2]
+    
+    def prepare_input(self):
+        """
+        点击或拖动之前的准备，子类可以在这里激活游戏窗口
+        :return: 是否可以执行输入
+        """
+        return True
+    
+    def to_screen(self, position):
+        """
+        把截图坐标转换为输入后端使用的屏幕坐标，截图只包含窗口客户区的子类在这里加上客户区的位置
+        :param position: (x, y) 截图坐标
+        :return: (x, y) 屏幕坐标
+        """
+        return position
     
     def click(self, position, random_offset=5):
         """
@@ -123,18 +915,86 @@ class AutoGame:
             self.log("无法点击：位置为None")
             return False
         
-        x, y = position
+        if not self.prepare_input():
+            self.log("无法激活窗口，点击操作取消")
+            return False
+        x, y = self.to_screen(position)
         
         # 添加随机偏移
         if random_offset > 0:
             x += random.randint(-random_offset, random_offset)
             y += random.randint(-random_offset, random_offset)
         
+        # 点击后画面可能变化，共享截图作废
+        if self.pipeline is not None:
+            # 由输入线程执行点击和之后的停顿
+            self.pipeline.submit('click', (x, y))
+            self.log(f"点击位置: ({x}, {y})")
+            self._last_action_time = self.clock.now()
+            self.invalidate_frame()
+            return True
+        
         # 执行点击
-        pyautogui.click(x, y)
+        self.input.click(x, y, hold=self.timing.click_hold)
         self.log(f"点击位置: ({x}, {y})")
+        
+        self._last_action_time = self.clock.now()
+        self.invalidate_frame()
+        self.sleep(self.timing.after_click)
         return True
     
+    def drag(self, start, end, duration=None):
+        """
+        按住鼠标从起点拖动到终点
+        :param start: 起点 (x, y)
+        :param end: 终点 (x, y)
+        :param duration: 拖动持续的时间（秒），默认使用时序配置
+        """
+        if duration is None:
+            duration = self.timing.drag_duration
+        if not self.prepare_input():
+            self.log("无法激活窗口，拖动操作取消")
+            return
+        start, end = self.to_screen(start), self.to_screen(end)
+        if self.pipeline is not None:
+            self.pipeline.submit('drag', (start, end, duration))
+            self.log(f"拖动: {start} -> {end}")
+            self._last_action_time = self.clock.now()
+            self.invalidate_frame()
+            return
+        
+        self.input.drag(start, end, duration=duration, steps=self.timing.drag_steps)
+        self.log(f"拖动: {start} -> {end}")
+        
+        self._last_action_time = self.clock.now()
+        self.invalidate_frame()
+        self.sleep(self.timing.after_drag)
+    
+    def replay_position(self):
+        """
+        :return: 回放模式下已播放的帧数，不在回放时返回None
+        """
+        if not self.dry_run:
+            return None
+        return self.capture_backend.frames_played
+    
+    def check_replay_progress(self, position):
+        """
+        回放模式下确认循环有进展：自position以来没有读取任何新帧时抛出ReplayStalled
+        :param position: 本次循环开始时 replay_position() 的返回值
+        """
+        if self.dry_run and self.capture_backend.frames_played == position:
+            raise ReplayStalled(f"回放停留在第 {position} 帧，一次循环没有读取新的截图（模板文件是否缺失？）")
+    
+    def screen_size(self):
+        """
+        获取屏幕尺寸，回放模式下返回录制画面的尺寸
+        :return: (宽, 高)
+        """
+        if self.dry_run:
+            return self.capture_backend.frame_size
+        return self.input.screen_size()
+    
     def click_template(self, template_name, confidence=None, random_offset=5):
         """
         查找并点击模板图像
@@ -155,28 +1015,178 @@ class AutoGame:
         screenshot = pyautogui.screenshot(region=region)
         template_path = os.path.join(self.templates_dir, template_name)
         screenshot.save(template_path)
+        self.template_store.invalidate(template_name)
         self.log(f"保存模板 {template_name} 从区域 {region}")
     
+    def wait_until_stable(self, roi=None, max_wait=3.0, min_wait=0.1, threshold=0.005, stable_frames=2, interval=0.05):
+        """
+        等待画面稳定（动画播放完毕），代替动作之后固定时长的等待
+        连续截图比较区域内变化的像素比例，连续stable_frames次不超过阈值时立即返回
+        在决策帧内调用时，最后一张截图会作为决策帧的共享截图继续使用
+        :param roi: 要观察的区域 (x, y, width, height)，坐标相对于截图，None表示整个截图
+        :param max_wait: 最长等待时间（秒），超时后不再等待
+        :param min_wait: 开始观察前的最短等待时间（秒），避免动画还没开始就被判断为稳定
+        :param threshold: 变化像素占区域像素的比例阈值
+        :param stable_frames: 需要连续稳定的比较次数
+        :param interval: 两次截图之间的间隔（秒）
+        :return: 画面是否在超时前稳定
+        """
+        start_time = self.clock.now()
+        self.sleep(min_wait)
+        
+        previous = None
+        previous_seq = None
+        stable = 0
+        while True:
+            self.invalidate_frame()
+            screen = self.get_frame()
+            # 后台截图服务可能还没有新帧，同一帧不参与比较
+            if screen is not None and self.frame_seq != previous_seq:
+                previous_seq = self.frame_seq
+                current = self._stability_sample(screen, roi)
+                if previous is not None and previous.shape == current.shape:
+                    changed = np.count_nonzero(cv2.absdiff(current, previous) > 12)
+                    if changed <= threshold * current.size:
+                        stable += 1
+                        if stable >= stable_frames:
+                            return True
+                    else:
+                        stable = 0
+                previous = current
+            
+            if self.clock.now() - start_time >= max_wait:
+                self.log(f"等待画面稳定超时 ({max_wait} 秒)")
+                return False
+            self.sleep(interval)
+    
+    def _stability_sample(self, screen, roi):
+        """
+        截取用于稳定性比较的区域，缩小一半并转为灰度，过滤掉单个像素的噪声
+        """
+        if roi is not None:
+            x, y, w, h = roi
+            screen = screen[max(0, y):max(0, y + h), max(0, x):max(0, x + w)]
+        h, w = screen.shape[:2]
+        if h >= 2 and w >= 2:
+            screen = cv2.resize(screen, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+        return to_gray(screen)
+    
+    def expect_transition(self, duration=2.0):
+        """
+        标记即将发生画面切换（例如刚点击了确认对战按钮），
+        之后duration秒内的等待使用最短间隔快速轮询，尽早发现新画面
+        :param duration: 快速轮询的持续时间（秒）
+        """
+        self._transition_until = self.clock.now() + duration
+    
+    def wait_for_templates(self, template_names, max_wait=30, confidence=None,
+                           min_interval=0.1, max_interval=2.0, backoff=1.5):
+        """
+        等待多个模板中的任意一个出现，每次轮询只截图一次，所有模板在同一张截图上匹配
+        预期画面切换期间以min_interval快速轮询；其余时间轮询间隔按backoff倍数递增，最长max_interval，
+        长时间等待时既能及时发现短暂的切换，又不会持续占用CPU
+        :param template_names: 模板图像文件名列表
+        :param max_wait: 最大等待时间（秒）
+        :param confidence: 可选的置信度覆盖
+        :param min_interval: 最短轮询间隔（秒）
+        :param max_interval: 最长轮询间隔（秒）
+        :param backoff: 每次未找到时轮询间隔的增长倍数
+        :return: (找到的模板名, 位置)，超时返回(None, None)
+        """
+        self.log(f"等待模板 {', '.join(template_names)} 出现，最多等待 {max_wait} 秒")
+        start_time = self.clock.now()
+        interval = min_interval
+        
+        while True:
+            # 每次轮询都需要新的截图
+            self.invalidate_frame()
+            with self.frame_tick():
+                matches = self.find_templates(template_names, confidence=confidence)
+            for template_name in template_names:
+                if matches[template_name] is not None:
+                    return template_name, matches[template_name]
+            
+            now = self.clock.now()
+            remaining = max_wait - (now - start_time)
+            if remaining <= 0:
+                break
+            
+            if now < self._transition_until:
+                interval = min_interval
+            else:
+                interval = min(max_interval, interval * backoff)
+            self.sleep(min(interval, remaining))
+        
+        self.log(f"等待模板 {', '.join(template_names)} 超时")
+        return None, None
+    
     def wait_for_template(self, template_name, max_wait=30, check_interval=1, confidence=None):
         """
         等待模板图像出现
         :param template_name: 模板图像文件名
         :param max_wait: 最大等待时间（秒）
-        :param check_interval: 检查间隔（秒）
+        :param check_interval: 最长检查间隔（秒），轮询间隔从短到长逐渐增加到该值
         :param confidence: 可选的置信度覆盖
         :return: 找到的位置或None
         """
-        self.log(f"等待模板 {template_name} 出现，最多等待 {max_wait} 秒")
-        start_time = time.time()
+        _, position = self.wait_for_templates(
+            [template_name], max_wait=max_wait, confidence=confidence,
+            max_interval=max(check_interval, 0.1),
+        )
+        return position
+    
+    def classify_scene(self, detect, allowed=None):
+        """
+        识别当前画面所处的场景
+        先用画面指纹分类，不确定时再调用detect()通过模板匹配判断，并把结果记入指纹分类器
+        两种方式使用同一张截图，识别结果同时记入状态转移跟踪器
+        :param detect: 通过模板匹配判断场景的函数，返回场景名称
+        :param allowed: 允许由指纹直接给出的场景，None表示全部允许；
+                        场景还取决于画面以外的状态（如是否已选择圣物）时用来排除
+        :return: 场景名称
+        """
+        with self.frame_tick() as screen:
+            scene = self._classify_scene(screen, detect, allowed)
+        self.state_tracker.observe(scene)
+        return scene
+    
+    def _classify_scene(self, screen, detect, allowed):
+        if screen is None:
+            return detect()
         
-        while time.time() - start_time < max_wait:
-            position = self.find_template(template_name, confidence)
-            if position is not None:
-                return position
-            time.sleep(check_interval)
+        classifier = self.scene_classifier
+        thumbnail = self.change_detector.last_thumbnail
+        if screen is self.screen and thumbnail is not None:
+            # 画面变化检测已经为这张截图生成了缩略图，在它上面计算指纹几乎没有开销
+            screen = thumbnail
+        fingerprint = classifier.fingerprint(screen)
+        scene, confident = classifier.classify(fingerprint)
+        if allowed is not None and scene not in allowed:
+            # 结果受画面以外的状态影响，不用于学习
+            return detect()
+        if confident:
+            return scene
         
-        self.log(f"等待模板 {template_name} 超时")
-        return None
+        result = detect()
+        classifier.learn(fingerprint, result, predicted=scene)
+        return result
+    
+    def match_state(self, checks, default):
+        """
+        按状态转移概率依次进行状态检查，命中即返回，不再进行后面的检查
+        从上一个状态很少或从未转移到的状态排在后面或被跳过，每次检测需要的模板匹配更少
+        :param checks: [(状态, 检查函数)]，检查函数在当前决策帧的截图上判断是否处于该状态；
+                       列表顺序为还没有转移记录时的检查顺序
+        :param default: 所有检查都未命中时的状态
+        :return: 状态
+        """
+        with self.frame_tick():
+            # 画面大面积变化时可能发生了从未见过的转移，检查全部状态
+            force_full = self.change_detector.changed_fraction >= 0.5
+            for state, check in self.state_tracker.plan(checks, force_full=force_full):
+                if check():
+                    return state
+            return default
     
     def detect_battle_state(self):
         """
@@ -223,18 +1233,21 @@ class AutoGame:
         try:
             while battles_completed < num_battles:
                 self.log(f"开始第 {battles_completed + 1} 次战斗")
+                replay_position = self.replay_position()
                 
                 # 开始战斗
                 if not self.start_battle():
                     self.log("无法开始战斗，等待后重试")
-                    time.sleep(wait_between)
+                    self.check_replay_progress(replay_position)
+                    self.sleep(wait_between)
                     continue
                 
                 # 等待战斗开始
-                time.sleep(2)  # 等待战斗场景加载
+                self.sleep(2)  # 等待战斗场景加载
                 
-                # 执行战斗操作
-                self.perform_battle_actions()
+                # 执行战斗操作，同一决策帧内共用一次截图
+                with self.frame_tick():
+                    self.perform_battle_actions()
                 
                 # 处理战斗结果
                 result = self.handle_battle_result()
@@ -246,10 +1259,10 @@ class AutoGame:
                 # 战斗间隔
                 if battles_completed < num_battles:
                     self.log(f"等待 {wait_between} 秒后开始下一次战斗")
-                    time.sleep(wait_between)
+                    self.sleep(wait_between)
             
             self.log(f"自动战斗循环完成，共进行了 {battles_completed} 次战斗")
-            
+        
         except KeyboardInterrupt:
             self.log("用户中断了自动战斗循环")
         except Exception as e:
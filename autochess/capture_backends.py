@@ -0,0 +1,523 @@
+import cv2
+import numpy as np
+import ctypes
+import ctypes.util
+import os
+import sys
+import time
+
+
+class CaptureBackend:
+    """
+    截图后端接口
+    grab() 返回BGR(3通道)或BGRA(4通道)的numpy数组，
+    返回的数组可能是后端内部复用缓冲区的视图，下一次grab()后内容会被覆盖，
+    需要跨帧保留时由调用方自行复制
+    """
+    name = 'base'
+    
+    def grab(self, region=None):
+        """
+        截取屏幕
+        :param region: 截图区域 (left, top, width, height)，默认为全屏
+        :return: 屏幕截图的numpy数组
+        """
+        raise NotImplementedError
+    
+    def close(self):
+        """
+        释放后端占用的资源
+        """
+        pass
+
+
+class PyAutoGUICapture(CaptureBackend):
+    """
+    基于pyautogui的截图后端，适用于所有平台
+    PIL图像转换为BGR时写入预分配的缓冲区，避免每帧重新分配内存
+    """
+    name = 'pyautogui'
+    
+    def __init__(self):
+        self._buffer = None
+    
+    def _grab_image(self, region):
+        import pyautogui
+        return pyautogui.screenshot(region=region)
+    
+    def grab(self, region=None):
+        image = self._grab_image(region)
+        rgb = np.asarray(image)
+        shape = rgb.shape[:2] + (3,)
+        if self._buffer is None or self._buffer.shape != shape:
+            self._buffer = np.empty(shape, dtype=np.uint8)
+        code = cv2.COLOR_RGBA2BGR if rgb.shape[2] == 4 else cv2.COLOR_RGB2BGR
+        cv2.cvtColor(rgb, code, dst=self._buffer)
+        return self._buffer
+
+
+class ImageGrabCapture(PyAutoGUICapture):
+    """
+    基于PIL.ImageGrab的截图后端，作为pyautogui截图失败时的备用方法
+    """
+    name = 'imagegrab'
+    
+    def _grab_image(self, region):
+        from PIL import ImageGrab
+        if region:
+            left, top, width, height = region
+            return ImageGrab.grab(bbox=(left, top, left + width, top + height))
+        return ImageGrab.grab()
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+class _XImage(ctypes.Structure):
+    # 只声明需要读取的前部字段
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+    ]
+
+
+class X11ShmCapture(CaptureBackend):
+    """
+    基于X11 MIT-SHM扩展的截图后端（Linux）
+    X服务器把像素直接写入与本进程共享的内存段，
+    grab() 返回该内存段上的BGRA numpy视图，整个过程没有额外的复制和内存分配
+    """
+    name = 'x11-shm'
+    
+    _ZPIXMAP = 2
+    _ALL_PLANES = 0xFFFFFFFF
+    _IPC_PRIVATE = 0
+    _IPC_CREAT = 0o1000
+    _IPC_RMID = 0
+    
+    def __init__(self, display_name=None):
+        libx11 = ctypes.util.find_library('X11')
+        libxext = ctypes.util.find_library('Xext')
+        if not libx11 or not libxext:
+            raise OSError("未找到libX11或libXext")
+        
+        self._x11 = ctypes.CDLL(libx11)
+        self._xext = ctypes.CDLL(libxext)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._declare_functions()
+        
+        self._image = None
+        self._shm_info = None
+        self._frame = None
+        self._size = None
+        
+        self._display = self._x11.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self._display:
+            raise OSError("无法连接X11显示")
+        if not self._xext.XShmQueryExtension(self._display):
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+            raise OSError("X服务器不支持MIT-SHM扩展")
+        
+        screen = self._x11.XDefaultScreen(self._display)
+        self._root = self._x11.XRootWindow(self._display, screen)
+        self._visual = self._x11.XDefaultVisual(self._display, screen)
+        self._depth = self._x11.XDefaultDepth(self._display, screen)
+        self.screen_size = (
+            self._x11.XDisplayWidth(self._display, screen),
+            self._x11.XDisplayHeight(self._display, screen),
+        )
+        if self._depth not in (24, 32):
+            self.close()
+            raise OSError(f"不支持的颜色深度: {self._depth}")
+    
+    def _declare_functions(self):
+        x11, xext, libc = self._x11, self._xext, self._libc
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDestroyImage.argtypes = [ctypes.POINTER(_XImage)]
+        
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+            ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint,
+        ]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int, ctypes.c_ulong,
+        ]
+        
+        libc.shmget.restype = ctypes.c_int
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+    
+    def _allocate(self, width, height):
+        """
+        为指定尺寸分配共享内存段和XImage，并建立numpy视图
+        """
+        self._release_image()
+        
+        shm_info = _XShmSegmentInfo()
+        image = self._xext.XShmCreateImage(
+            self._display, self._visual, self._depth, self._ZPIXMAP,
+            None, ctypes.byref(shm_info), width, height,
+        )
+        if not image:
+            raise OSError("XShmCreateImage失败")
+        
+        stride = image.contents.bytes_per_line
+        size = stride * height
+        shm_info.shmid = self._libc.shmget(self._IPC_PRIVATE, size, self._IPC_CREAT | 0o600)
+        if shm_info.shmid < 0:
+            self._x11.XDestroyImage(image)
+            raise OSError(ctypes.get_errno(), "shmget失败")
+        
+        address = self._libc.shmat(shm_info.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            self._libc.shmctl(shm_info.shmid, self._IPC_RMID, None)
+            self._x11.XDestroyImage(image)
+            raise OSError(ctypes.get_errno(), "shmat失败")
+        
+        shm_info.shmaddr = address
+        shm_info.readOnly = 0
+        image.contents.data = address
+        self._xext.XShmAttach(self._display, ctypes.byref(shm_info))
+        self._x11.XSync(self._display, 0)
+        # 标记删除，所有进程分离后内核自动回收
+        self._libc.shmctl(shm_info.shmid, self._IPC_RMID, None)
+        
+        self._image = image
+        self._shm_info = shm_info
+        self._size = (width, height)
+        
+        # ZPixmap 32位像素在小端机器上的字节顺序为B、G、R、A
+        raw = (ctypes.c_ubyte * size).from_address(address)
+        buffer = np.frombuffer(raw, dtype=np.uint8).reshape(height, stride // 4, 4)
+        self._frame = buffer[:, :width]
+    
+    def _release_image(self):
+        if self._image is None:
+            return
+        self._xext.XShmDetach(self._display, ctypes.byref(self._shm_info))
+        self._x11.XSync(self._display, 0)
+        self._x11.XDestroyImage(self._image)
+        self._libc.shmdt(self._shm_info.shmaddr)
+        self._image = None
+        self._shm_info = None
+        self._frame = None
+        self._size = None
+    
+    def grab(self, region=None):
+        screen_w, screen_h = self.screen_size
+        if region:
+            left, top, width, height = region
+        else:
+            left, top, width, height = 0, 0, screen_w, screen_h
+        
+        # 超出屏幕范围会触发X11错误并终止进程，先裁剪到屏幕内
+        left = max(0, min(int(left), screen_w - 1))
+        top = max(0, min(int(top), screen_h - 1))
+        width = max(1, min(int(width), screen_w - left))
+        height = max(1, min(int(height), screen_h - top))
+        
+        if self._size != (width, height):
+            self._allocate(width, height)
+        
+        if not self._xext.XShmGetImage(self._display, self._root, self._image, left, top, self._ALL_PLANES):
+            raise OSError("XShmGetImage失败")
+        return self._frame
+    
+    def close(self):
+        if self._display:
+            self._release_image()
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+
+
+class ReplayFinished(BaseException):
+    """
+    录制画面已全部回放完毕
+    继承BaseException而不是Exception，不会被机器人循环里的 except Exception 吞掉，
+    回放结束时能一直传递到回放入口
+    """
+    pass
+
+
+class ReplayStalled(ReplayFinished):
+    """
+    回放中机器人的一次循环没有读取任何新帧
+    例如模板文件缺失时查找模板不截图，回放画面不会前进，虚拟时钟下的等待也不消耗时间，
+    继续运行只会原地空转，因此中止回放
+    """
+    pass
+
+
+class _DirectorySource:
+    """
+    按文件名顺序读取目录中的截图
+    目录下的timestamps.txt（每行一个秒数）提供每帧的时间戳，没有时按固定帧率生成
+    """
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+    
+    def __init__(self, path, fps):
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(self.IMAGE_EXTENSIONS)
+        )
+        if not self.files:
+            raise OSError(f"录制目录中没有截图: {path}")
+        
+        self.timestamps = None
+        timestamps_path = os.path.join(path, 'timestamps.txt')
+        if os.path.exists(timestamps_path):
+            with open(timestamps_path, 'r', encoding='utf-8') as f:
+                self.timestamps = [float(line) for line in f if line.strip()]
+        self.fps = fps
+        self.index = 0
+    
+    def rewind(self):
+        self.index = 0
+    
+    def next_frame(self):
+        """
+        :return: (时间戳, BGR图像)，没有更多帧时返回None
+        """
+        if self.index >= len(self.files):
+            return None
+        index = self.index
+        self.index += 1
+        
+        # 使用np.fromfile读取，兼容包含中文的路径
+        image = cv2.imdecode(np.fromfile(self.files[index], dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise OSError(f"无法读取录制的截图: {self.files[index]}")
+        if self.timestamps is not None and index < len(self.timestamps):
+            timestamp = self.timestamps[index]
+        else:
+            timestamp = index / self.fps
+        return timestamp, image
+    
+    def close(self):
+        pass
+
+
+class _VideoSource:
+    """
+    顺序解码视频文件，时间戳取自视频的播放位置
+    """
+    def __init__(self, path):
+        self.path = path
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise OSError(f"无法打开录制视频: {path}")
+        self.fps = self._capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.index = 0
+    
+    def rewind(self):
+        self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self.index = 0
+    
+    def next_frame(self):
+        ok, image = self._capture.read()
+        if not ok:
+            return None
+        timestamp = self._capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if timestamp <= 0 and self.index > 0:
+            timestamp = self.index / self.fps
+        self.index += 1
+        return timestamp, image
+    
+    def close(self):
+        self._capture.release()
+
+
+class ReplayCapture(CaptureBackend):
+    """
+    回放录制画面的截图后端，不需要显示器和游戏窗口
+    录制源可以是截图目录、视频文件或 FrameRecorder 录制的 .agfr 文件
+    
+    两种回放方式:
+        step     每次grab()返回下一帧，用于确定性的回归测试和吞吐量测试
+        realtime 按录制时间戳和经过的时间选择当前帧，机器人的等待逻辑与实际运行时一致
+    
+    录制画面对应屏幕上origin处开始的区域，grab()的region按屏幕坐标裁剪
+    """
+    name = 'replay'
+    
+    def __init__(self, source, mode='step', loop=False, fps=10.0, origin=(0, 0), speed=1.0, clock=time.monotonic):
+        """
+        初始化回放后端
+        :param source: 截图目录、视频文件或 .agfr 录制文件路径
+        :param mode: 回放方式，'step' 或 'realtime'
+        :param loop: 播放完毕后是否从头开始
+        :param fps: 截图目录没有timestamps.txt时使用的帧率
+        :param origin: 录制画面左上角对应的屏幕坐标
+        :param speed: realtime方式下的播放速度倍数
+        :param clock: realtime方式下使用的时钟
+        """
+        if mode not in ('step', 'realtime'):
+            raise ValueError(f"未知的回放方式: {mode}")
+        self.source_path = source
+        self.mode = mode
+        self.loop = loop
+        self.origin = origin
+        self.speed = speed
+        self.clock = clock
+        self._source = self._open_source(source, fps)
+        
+        self._current = None  # 当前帧 (时间戳, 图像)
+        self._pending = None  # 预读的下一帧
+        self._started = None  # realtime方式开始播放的时钟读数
+        self.frames_played = 0
+    
+    def _open_source(self, source, fps):
+        if os.path.isdir(source):
+            return _DirectorySource(source, fps)
+        if source.lower().endswith('.agfr'):
+            from frame_recorder import FrameReader
+            return FrameReader(source)
+        return _VideoSource(source)
+    
+    @property
+    def frame_size(self):
+        """
+        :return: 录制画面的 (宽, 高)
+        """
+        if self._current is None and self._pending is None:
+            self._pending = self._read_next()
+        image = (self._current or self._pending)[1]
+        return image.shape[1], image.shape[0]
+    
+    def _read_next(self):
+        frame = self._source.next_frame()
+        if frame is None and self.loop and self.frames_played > 0:
+            self._source.rewind()
+            self._started = None
+            frame = self._source.next_frame()
+        return frame
+    
+    def _take_pending(self):
+        frame = self._pending if self._pending is not None else self._read_next()
+        self._pending = None
+        if frame is None:
+            raise ReplayFinished()
+        self._current = frame
+        self.frames_played += 1
+        return frame
+    
+    def _advance(self):
+        """
+        根据回放方式前进到应当显示的帧
+        """
+        if self.mode == 'step' or self._current is None:
+            frame = self._take_pending()
+            if self.mode == 'realtime' and self._started is None:
+                self._started = self.clock() - frame[0] / self.speed
+            return frame[1]
+        
+        position = (self.clock() - self._started) * self.speed
+        while True:
+            if self._pending is None:
+                self._pending = self._read_next()
+                if self._pending is None:
+                    # 最后一帧显示满一个帧间隔后结束
+                    if position - self._current[0] > 1.0:
+                        raise ReplayFinished()
+                    break
+                if self._started is None:
+                    # 循环回放重新开始
+                    self._started = self.clock() - self._pending[0] / self.speed
+                    position = self._pending[0]
+            if self._pending[0] > position:
+                break
+            self._take_pending()
+        return self._current[1]
+    
+    def grab(self, region=None):
+        image = self._advance()
+        if not region:
+            return image
+        
+        left, top, width, height = region
+        x1 = max(0, int(left) - self.origin[0])
+        y1 = max(0, int(top) - self.origin[1])
+        x2 = min(image.shape[1], int(left + width) - self.origin[0])
+        y2 = min(image.shape[0], int(top + height) - self.origin[1])
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"截图区域 {region} 不在录制画面内")
+        return image[y1:y2, x1:x2]
+    
+    def close(self):
+        self._source.close()
+
+
+def create_capture_backend(name=None):
+    """
+    创建截图后端
+    未指定名称时依次读取环境变量AUTOGAME_REPLAY（录制画面路径，使用回放后端）、
+    AUTOGAME_FRAME_BUS（帧总线名称，从生产者进程的帧总线读取）和AUTOGAME_CAPTURE（后端名称），
+    因此不修改机器人代码即可让它们在录制画面上或工作进程中运行
+    :param name: 后端名称('x11-shm'、'pyautogui'、'imagegrab'、'replay'、'frame-bus')，默认在Linux上优先使用X11共享内存
+    :return: 截图后端实例
+    """
+    if name is None:
+        if os.environ.get('AUTOGAME_REPLAY'):
+            name = 'replay'
+        elif os.environ.get('AUTOGAME_FRAME_BUS'):
+            name = 'frame-bus'
+        else:
+            name = os.environ.get('AUTOGAME_CAPTURE') or None
+    
+    if name == 'replay':
+        return ReplayCapture(
+            os.environ['AUTOGAME_REPLAY'],
+            mode=os.environ.get('AUTOGAME_REPLAY_MODE', 'step'),
+            loop=os.environ.get('AUTOGAME_REPLAY_LOOP') == '1',
+        )
+    if name == 'frame-bus':
+        from frame_bus import FrameBusCapture
+        return FrameBusCapture(os.environ['AUTOGAME_FRAME_BUS'])
+    if name == 'pyautogui':
+        return PyAutoGUICapture()
+    if name == 'imagegrab':
+        return ImageGrabCapture()
+    
+    if name == 'x11-shm' or (name is None and sys.platform.startswith('linux') and os.environ.get('DISPLAY')):
+        try:
+            return X11ShmCapture()
+        except OSError:
+            if name == 'x11-shm':
+                raise
+    
+    return PyAutoGUICapture()
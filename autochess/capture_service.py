@@ -0,0 +1,176 @@
+import numpy as np
+import threading
+import time
+from collections import namedtuple
+
+# 截图帧：序号、开始截图时的时钟读数、图像
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'image'])
+
+
+class CaptureService:
+    """
+    后台截图服务
+    后台线程持续截图，把最新的若干帧保存在固定大小的环形缓冲区中，
+    每帧带有时间戳和递增序号，决策循环直接读取最新帧而不必同步等待截图；
+    时间戳取自clock，应与读取方判断帧年龄、记录动作时间所用的时钟相同
+    
+    缓冲区的每个槽位都是预分配的数组；读取方通过 acquire_latest() 取得的帧会被锁定，
+    在 release() 之前后台线程不会覆盖该槽位，因此读取方可以零复制地使用帧数据
+    """
+    def __init__(self, backend, region=None, buffer_size=4, interval=0.0, clock=time.monotonic):
+        """
+        初始化截图服务
+        :param backend: 截图后端
+        :param region: 截图区域 (left, top, width, height)，默认为全屏
+        :param buffer_size: 环形缓冲区的槽位数，至少为3（读取方锁定、最新帧、正在写入）
+        :param interval: 两次截图之间的最小间隔（秒），0表示尽可能快
+        :param clock: 返回当前时间的函数，用于帧时间戳和帧年龄，例如机器人时钟的 now
+        """
+        self.backend = backend
+        self.clock = clock
+        self.region = region
+        self.interval = interval
+        self.buffer_size = max(3, buffer_size)
+        
+        self._slots = [None] * self.buffer_size  # 预分配的图像缓冲区
+        self._frames = [None] * self.buffer_size  # 槽位中的帧
+        self._pins = [0] * self.buffer_size  # 每个槽位被读取方锁定的次数
+        self._latest = None  # 最新帧所在的槽位
+        self._seq = 0
+        self._cond = threading.Condition()
+        
+        self._thread = None
+        self._running = False
+        
+        # 统计信息
+        self.frames_captured = 0
+        self.frames_skipped = 0  # 所有槽位都被锁定时跳过的帧
+        self.last_error = None
+    
+    def start(self):
+        """
+        启动后台截图线程
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='capture-service', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """
+        停止后台截图线程
+        """
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+    
+    @property
+    def running(self):
+        return self._running
+    
+    def _run(self):
+        while self._running:
+            started = time.monotonic()
+            timestamp = self.clock()
+            try:
+                image = self.backend.grab(self.region)
+            except Exception as e:
+                self.last_error = e
+                time.sleep(0.1)
+                continue
+            
+            self._store(image, timestamp)
+            
+            remaining = self.interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+    
+    def _store(self, image, timestamp):
+        """
+        把截图复制到一个未被锁定的槽位并发布为最新帧
+        """
+        with self._cond:
+            index = self._free_slot()
+        if index is None:
+            self.frames_skipped += 1
+            return
+        
+        slot = self._slots[index]
+        if slot is None or slot.shape != image.shape:
+            slot = np.empty(image.shape, dtype=image.dtype)
+            self._slots[index] = slot
+        np.copyto(slot, image)
+        
+        with self._cond:
+            self._seq += 1
+            self._frames[index] = Frame(self._seq, timestamp, slot)
+            self._latest = index
+            self.frames_captured += 1
+            self._cond.notify_all()
+    
+    def _free_slot(self):
+        """
+        选择最旧的未锁定槽位，调用方需持有锁
+        """
+        best_index = None
+        best_seq = None
+        for index in range(self.buffer_size):
+            if index == self._latest or self._pins[index] > 0:
+                continue
+            frame = self._frames[index]
+            seq = frame.seq if frame is not None else -1
+            if best_seq is None or seq < best_seq:
+                best_index, best_seq = index, seq
+        
+        if best_index is not None:
+            # 槽位即将被覆盖，先撤下旧帧
+            self._frames[best_index] = None
+        return best_index
+    
+    def acquire_latest(self, max_age=None, min_seq=0, min_timestamp=None, timeout=1.0):
+        """
+        获取最新帧并锁定其槽位，使用完毕后必须调用 release()
+        :param max_age: 帧的最大年龄（秒，按clock计算），最新帧比这更旧时等待新帧
+        :param min_seq: 帧序号的下限，用于等待比已处理帧更新的帧
+        :param min_timestamp: 帧时间戳的下限（clock读数），用于等待某个动作之后才开始截取的帧
+        :param timeout: 最长等待的真实时间（秒）
+        :return: Frame，超时返回None
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._latest is not None:
+                    frame = self._frames[self._latest]
+                    fresh = max_age is None or self.clock() - frame.timestamp <= max_age
+                    after = min_timestamp is None or frame.timestamp >= min_timestamp
+                    if frame.seq >= min_seq and fresh and after:
+                        self._pins[self._latest] += 1
+                        return frame
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    return None
+                self._cond.wait(remaining)
+    
+    def release(self, frame):
+        """
+        释放 acquire_latest() 锁定的帧
+        """
+        if frame is None:
+            return
+        with self._cond:
+            for index in range(self.buffer_size):
+                if self._slots[index] is frame.image:
+                    if self._pins[index] > 0:
+                        self._pins[index] -= 1
+                    return
+    
+    def latest_seq(self):
+        """
+        :return: 最新帧的序号，尚无帧时返回0
+        """
+        return self._seq
@@ -1,10 +1,10 @@
 import cv2
 import numpy as np
-import pyautogui
 import time
 import os
 import random
 from autogame import AutoGame
+from hud_reader import EnergyBarReader
 
 class ClashRoyaleBot(AutoGame):
     """
@@ -20,6 +20,9 @@ class ClashRoyaleBot(AutoGame):
         self.elixir_bar = 0  # 法力值/能量条
         self.card_positions = []  # 卡牌位置
         
+        # 圣水条位于屏幕底部、卡牌下方，已填充部分为紫红色（根据实际游戏调整）
+        self.elixir_reader = EnergyBarReader(region=(0.28, 0.95, 0.68, 0.02), hue_range=(140, 170))
+        
         # 确保所需的模板存在
         self.check_templates()
     
@@ -53,26 +56,22 @@ class ClashRoyaleBot(AutoGame):
     
     def detect_battle_state(self):
         """
-        检测当前战斗状态
+        检测当前战斗状态，画面指纹能确定时不做模板匹配
         :return: 状态描述字符串
         """
-        # 检测是否在主界面
-        if self.find_template('battle_button.png', confidence=0.7):
-            return "main_menu"
-        
-        # 检测是否在战斗中
-        # 这里可以通过识别战斗界面的特定元素来判断
-        # 例如能量条、场地等
-        
-        # 检测是否战斗结束
-        if self.find_template('victory_screen.png', confidence=0.7):
-            return "victory"
-        
-        if self.find_template('defeat_screen.png', confidence=0.7):
-            return "defeat"
-        
-        # 默认假设在战斗中
-        return "in_battle"
+        return self.classify_scene(self._match_battle_state)
+    
+    def _match_battle_state(self):
+        """
+        通过模板匹配检测当前战斗状态
+        :return: 状态描述字符串
+        """
+        # 按上一个状态下最可能出现的顺序依次检查，命中即停止
+        return self.match_state([
+            ("main_menu", lambda: self.find_template('battle_button.png', confidence=0.7) is not None),
+            ("victory", lambda: self.find_template('victory_screen.png', confidence=0.7) is not None),
+            ("defeat", lambda: self.find_template('defeat_screen.png', confidence=0.7) is not None),
+        ], default="in_battle")  # 默认假设在战斗中
     
     def start_battle(self):
         """
@@ -87,15 +86,17 @@ class ClashRoyaleBot(AutoGame):
                 self.log("无法找到对战按钮")
                 return False
             
-            # 等待确认对战按钮出现
-            time.sleep(1)
-            if not self.click_template('confirm_battle.png'):
+            # 等待确认对战按钮出现，按钮通常很快弹出，快速轮询
+            self.expect_transition()
+            confirm_position = self.wait_for_template('confirm_battle.png', max_wait=3)
+            if not self.click(confirm_position):
                 self.log("无法找到确认对战按钮")
                 return False
+            self.expect_transition()
             
             # 等待进入战斗
             self.log("等待进入战斗...")
-            time.sleep(5)  # 等待加载战斗场景
+            self.wait_until_stable(max_wait=5, min_wait=1.0)  # 等待加载战斗场景
             
             self.in_battle = True
             return True
@@ -110,12 +111,16 @@ class ClashRoyaleBot(AutoGame):
     def detect_elixir_bar(self):
         """
         检测当前能量/法力值
-        :return: 估计的能量值(0-10)
+        通过圣水条的填充长度判断
+        :return: 估计的能量值(0-10)，可以是小数
         """
-        # 这里需要根据游戏界面实现能量条检测
-        # 可以使用颜色识别或模板匹配等方法
-        # 简化版本，随机返回一个值用于测试
-        return random.randint(5, 10)
+        elixir = self.elixir_reader.read(self.get_frame())
+        if elixir is None:
+            self.log("无法读取能量条")
+            return self.elixir_bar
+        
+        self.elixir_bar = elixir
+        return self.elixir_bar
     
     def detect_card_positions(self):
         """
@@ -124,10 +129,12 @@ class ClashRoyaleBot(AutoGame):
         """
         positions = []
         
-        # 检测每个卡牌槽位
-        for i in range(1, 5):
-            card_template = f'card_slot_{i}.png'
-            position = self.find_template(card_template, confidence=0.6)
+        # 在同一张截图上并行检测所有卡牌槽位
+        card_templates = [f'card_slot_{i}.png' for i in range(1, 5)]
+        matches = self.find_templates(card_templates, confidence=0.6)
+        
+        for i, card_template in enumerate(card_templates, start=1):
+            position = matches[card_template]
             if position:
                 positions.append((position, i))
         
@@ -161,7 +168,7 @@ class ClashRoyaleBot(AutoGame):
         # 如果没有指定目标位置，则在场地中心区域随机选择一个位置
         if target_position is None:
             # 假设游戏场地在屏幕中央区域
-            screen_width, screen_height = pyautogui.size()
+            screen_width, screen_height = self.screen_size()
             center_x, center_y = screen_width // 2, screen_height // 2
             
             # 在中心区域随机选择一个点
@@ -170,7 +177,7 @@ class ClashRoyaleBot(AutoGame):
             target_position = (target_x, target_y)
         
         # 点击目标位置放置卡牌
-        time.sleep(0.5)  # 短暂延迟，模拟人类操作
+        self.sleep(0.5)  # 短暂延迟，模拟人类操作
         self.click(target_position)
         
         self.log(f"已打出卡牌{card_index}到位置{target_position}")
@@ -186,7 +193,7 @@ class ClashRoyaleBot(AutoGame):
         
         # 检测当前能量
         elixir = self.detect_elixir_bar()
-        self.log(f"当前能量: {elixir}")
+        self.log(f"当前能量: {elixir:.1f}")
         
         # 简单的战斗策略：能量足够时随机打出卡牌
         if elixir >= 4:  # 假设大多数卡牌需要4点能量
@@ -197,34 +204,29 @@ class ClashRoyaleBot(AutoGame):
             # 等待一段时间，让能量恢复
             wait_time = random.uniform(1.5, 3.0)
             self.log(f"等待{wait_time:.1f}秒后继续操作")
-            time.sleep(wait_time)
+            self.sleep(wait_time)
     
     def handle_battle_result(self):
         """
         处理战斗结果
         :return: 战斗结果描述
         """
-        # 等待战斗结束画面
+        # 等待战斗结束画面，最多等待10秒
         result = None
-        wait_start = time.time()
+        template_name, _ = self.wait_for_templates(
+            ['victory_screen.png', 'defeat_screen.png'], max_wait=10, confidence=0.7
+        )
         
-        while time.time() - wait_start < 10:  # 最多等待10秒
-            state = self.detect_battle_state()
-            
-            if state == "victory":
-                result = "胜利"
-                break
-            elif state == "defeat":
-                result = "失败"
-                break
-            
-            time.sleep(1)
+        if template_name == 'victory_screen.png':
+            result = "胜利"
+        elif template_name == 'defeat_screen.png':
+            result = "失败"
         
         if result:
             self.log(f"战斗结束，结果: {result}")
             
             # 点击确认按钮关闭结果画面
-            time.sleep(1)
+            self.sleep(1)
             self.click_template('ok_button.png')
             
             # 重置战斗状态
@@ -261,6 +263,7 @@ if __name__ == "__main__":
         print("\n是否要进入模板创建模式？(y/n)")
         choice = input().strip().lower()
         if choice == 'y':
+            import pyautogui
             print("请将鼠标移动到要截图的区域左上角，然后按Enter")
             input()
             start_x, start_y = pyautogui.position()
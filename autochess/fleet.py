@@ -0,0 +1,219 @@
+import threading
+import time
+import traceback
+from capture_backends import CaptureBackend, create_capture_backend
+from capture_service import CaptureService
+from input_backends import InputBackend, create_input_backend
+
+
+class InputArbiter(InputBackend):
+    """
+    输入仲裁器
+    多个机器人共用一个输入后端，每次完整的点击或拖动持有同一把锁，
+    不同机器人的按下、移动、松开不会交错在一起；操作之后的停顿不持有锁
+    """
+    name = 'arbiter'
+    
+    def __init__(self, backend):
+        """
+        :param backend: 实际执行输入的后端
+        """
+        super().__init__()
+        self.backend = backend
+        self._lock = threading.RLock()
+        
+        # 统计信息
+        self.actions = 0
+    
+    def move(self, x, y):
+        with self._lock:
+            self.backend.move(x, y)
+    
+    def mouse_down(self):
+        with self._lock:
+            self.backend.mouse_down()
+    
+    def mouse_up(self):
+        with self._lock:
+            self.backend.mouse_up()
+    
+    def position(self):
+        return self.backend.position()
+    
+    def screen_size(self):
+        return self.backend.screen_size()
+    
+    def click(self, x, y, hold=0.0):
+        with self._lock:
+            self.backend.click(x, y, hold=hold)
+            self.actions += 1
+    
+    def drag(self, start, end, duration=0.5, steps=20):
+        with self._lock:
+            self.backend.drag(start, end, duration=duration, steps=steps)
+            self.actions += 1
+    
+    def close(self):
+        self.backend.close()
+
+
+class FleetView(CaptureBackend):
+    """
+    机器人在共享桌面截图上的视图，作为该机器人的截图后端
+    grab() 返回最新一帧桌面截图中窗口区域的numpy视图，不复制数据；
+    视图所在的缓冲区在该机器人下一次截图之前不会被覆盖
+    """
+    name = 'fleet'
+    
+    def __init__(self, fleet, bot):
+        self.fleet = fleet
+        self.bot = bot
+        self.frame = None  # 当前锁定的桌面截图帧
+    
+    def grab(self, region=None):
+        return self.fleet._grab_view(self, region)
+    
+    def close(self):
+        service = self.fleet.service
+        if service is not None:
+            service.release(self.frame)
+        self.frame = None
+
+
+class Fleet:
+    """
+    多窗口机器人组
+    同一桌面上并排运行多个游戏实例时，每个周期只截取一次整个桌面，
+    按各机器人的窗口区域切出零复制的视图；每个机器人在自己的线程中运行，
+    所有输入都经过同一个仲裁器，不再通过切换前台窗口来抢占焦点，
+    因此截图开销与运行单个实例时接近
+    
+    用法:
+        fleet = Fleet()
+        for hwnd in AutoBattleSpirit.list_game_windows("对战精灵"):
+            fleet.add(AutoBattleSpirit(hwnd=hwnd))
+        fleet.run(lambda bot: bot.auto_battle_loop(num_battles=3))
+    """
+    def __init__(self, backend=None, input_backend=None, interval=0.05, max_age=0.1):
+        """
+        初始化机器人组
+        :param backend: 截取整个桌面的截图后端，默认自动选择
+        :param input_backend: 实际执行输入的后端，默认自动选择
+        :param interval: 两次桌面截图之间的最小间隔（秒）
+        :param max_age: 机器人读取的桌面截图最多允许多旧（秒）
+        """
+        self.backend = backend if backend is not None else create_capture_backend()
+        self.input = InputArbiter(input_backend if input_backend is not None else create_input_backend())
+        self.interval = interval
+        self.max_age = max_age
+        self.bots = []
+        self.service = None
+        
+        # 所有机器人共用一个模板匹配线程池，线程数不随实例数量增加
+        self._executor = None
+    
+    def add(self, bot):
+        """
+        把机器人加入组，替换它的截图后端和输入后端
+        :param bot: AutoGame 或其子类的实例，region 为它的窗口在桌面上的区域
+        :return: bot
+        """
+        if self.service is not None:
+            raise RuntimeError("机器人组已启动，不能再加入机器人")
+        
+        bot.capture_backend.close()
+        bot.capture_backend = FleetView(self, bot)
+        bot.input.close()
+        bot.input = self.input
+        bot.fleet_mode = True
+        bot.log_prefix = f"[窗口{len(self.bots) + 1}] "
+        
+        if self._executor is None:
+            self._executor = bot._get_match_executor()
+        bot._match_executor = self._executor
+        
+        self.bots.append(bot)
+        return bot
+    
+    def start(self):
+        """
+        启动共享的桌面截图线程
+        每个机器人最多锁定一帧，环形缓冲区比机器人数量多两个槽位，截图线程总有空闲槽位可写；
+        帧时间戳使用机器人的时钟，与机器人记录的动作时间可以直接比较
+        """
+        if self.service is not None:
+            return
+        clock = self.bots[0].clock.now if self.bots else time.monotonic
+        self.service = CaptureService(
+            self.backend, None, buffer_size=len(self.bots) + 2, interval=self.interval, clock=clock,
+        )
+        self.service.start()
+    
+    def stop(self):
+        """
+        停止桌面截图线程并释放各机器人锁定的帧
+        """
+        if self.service is None:
+            return
+        for bot in self.bots:
+            bot.capture_backend.close()
+        self.service.stop()
+        self.service = None
+    
+    def run(self, task):
+        """
+        每个机器人在自己的线程中运行task(bot)，全部结束后返回
+        :param task: 以机器人为参数的函数，例如 lambda bot: bot.auto_battle_loop(num_battles=3)
+        :return: 每个机器人的返回值列表，出错的机器人对应None
+        """
+        self.start()
+        results = [None] * len(self.bots)
+        
+        def worker(index, bot):
+            try:
+                results[index] = task(bot)
+            except Exception as e:
+                bot.log(f"机器人运行出错: {str(e)}")
+                bot.log(traceback.format_exc())
+        
+        threads = [
+            threading.Thread(target=worker, args=(index, bot), name=f'fleet-bot-{index + 1}', daemon=True)
+            for index, bot in enumerate(self.bots)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                # 带超时地等待，主线程仍能响应Ctrl+C
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        finally:
+            self.stop()
+        return results
+    
+    def _grab_view(self, view, region):
+        """
+        等待比该机器人上一次截图更新、且在它最近一次动作之后截取的桌面截图，返回窗口区域的视图
+        """
+        service = self.service
+        if service is None:
+            raise RuntimeError("机器人组尚未启动")
+        
+        last_seq = view.frame.seq if view.frame is not None else 0
+        frame = service.acquire_latest(
+            max_age=self.max_age,
+            min_seq=last_seq + 1,
+            min_timestamp=view.bot._last_action_time,
+            timeout=1.0,
+        )
+        if frame is None:
+            raise RuntimeError(f"桌面截图未能提供新帧: {service.last_error}")
+        service.release(view.frame)
+        view.frame = frame
+        
+        if region is None:
+            return frame.image
+        left, top, width, height = region
+        image_height, image_width = frame.image.shape[:2]
+        right, bottom = min(image_width, left + width), min(image_height, top + height)
+        return frame.image[max(0, top):bottom, max(0, left):right]
@@ -0,0 +1,278 @@
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy as np
+from capture_backends import CaptureBackend
+
+# 共享内存布局: 文件头 | 每个槽位的元数据 | 每个槽位的图像数据，各部分按64字节对齐
+_MAGIC = 0x52424741  # 'AGBR'
+_ALIGN = 64
+_HEADER_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('slots', '<u4'),
+    ('slot_bytes', '<u8'),
+    ('latest_seq', '<u8'),  # 最新发布的帧序号，0表示尚无帧
+])
+
+# 槽位元数据；version为顺序锁计数，奇数表示生产者正在写入该槽位
+SLOT_DTYPE = np.dtype([
+    ('version', '<u8'),
+    ('seq', '<u8'),
+    ('timestamp', '<f8'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+    ('channels', '<u4'),
+    ('_pad', '<u4'),
+])
+
+# 从总线读取的帧：序号、时间戳、共享内存上的只读图像视图、读取时槽位的顺序锁计数
+BusFrame = namedtuple('BusFrame', ['seq', 'timestamp', 'image', 'version'])
+
+
+def _aligned(size):
+    return -(-size // _ALIGN) * _ALIGN
+
+
+class FrameBus:
+    """
+    共享内存帧总线
+    一个生产者进程把截图写入固定数量的共享内存槽位，组成环形缓冲区，
+    工作进程按帧序号读取，得到的是共享内存上的numpy视图，跨进程传递帧不需要序列化或复制
+    
+    覆盖/丢弃策略：
+    - 生产者从不等待读取方，第seq帧总是写入第 (seq - 1) % slots 个槽位，覆盖其中最旧的帧
+    - 每个槽位有一个顺序锁计数，写入前后各加一；读取方在读取前后比较计数，
+      槽位正在写入或已被更新的帧覆盖时，该帧视为丢弃
+    - 读取方持有的视图在槽位被覆盖后内容会改变，使用完毕后用 valid() 确认，
+      返回False时应丢弃基于该帧的结果；槽位数越多，读取方可以落后得越多
+    """
+    def __init__(self, shm, owner):
+        """
+        请使用 FrameBus.create() 或 FrameBus.attach()
+        """
+        self._shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self._header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=shm.buf, offset=0)
+        if int(self._header['magic']) != _MAGIC:
+            self._header = None
+            self._close_shm()
+            raise ValueError(f"不是有效的帧总线: {shm.name}")
+        
+        self.slots = int(self._header['slots'])
+        self.slot_bytes = int(self._header['slot_bytes'])
+        self._meta_offset = _aligned(_HEADER_DTYPE.itemsize)
+        self._data_offset = self._meta_offset + _aligned(SLOT_DTYPE.itemsize * self.slots)
+        self._meta = np.ndarray((self.slots,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=self._meta_offset)
+        
+        # 统计信息
+        self.frames_published = 0
+        self.frames_dropped = 0  # 读取时已被覆盖或正在写入的帧
+    
+    @classmethod
+    def create(cls, slot_bytes, slots=8, name=None):
+        """
+        创建帧总线（生产者）
+        :param slot_bytes: 每个槽位的字节数，不能小于最大的截图
+        :param slots: 槽位数
+        :param name: 共享内存名称，默认自动生成
+        :return: FrameBus
+        """
+        slot_bytes = _aligned(slot_bytes)
+        meta_offset = _aligned(_HEADER_DTYPE.itemsize)
+        data_offset = meta_offset + _aligned(SLOT_DTYPE.itemsize * slots)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=data_offset + slot_bytes * slots)
+        
+        header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=shm.buf, offset=0)
+        header['slots'] = slots
+        header['slot_bytes'] = slot_bytes
+        header['latest_seq'] = 0
+        header['magic'] = _MAGIC
+        del header
+        return cls(shm, owner=True)
+    
+    @classmethod
+    def attach(cls, name):
+        """
+        连接到已有的帧总线（工作进程）
+        :param name: 共享内存名称，即生产者的 bus.name
+        :return: FrameBus
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python 3.13之前连接方也会登记到资源跟踪器，独立启动的工作进程退出时会删除生产者的共享内存；
+            # 事后注销又会删掉同一跟踪器中生产者的登记，因此连接期间跳过登记
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        return cls(shm, owner=False)
+    
+    def _slot_index(self, seq):
+        return (seq - 1) % self.slots
+    
+    def _image_view(self, index, shape):
+        offset = self._data_offset + index * self.slot_bytes
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf, offset=offset)
+    
+    def publish(self, image, timestamp=None):
+        """
+        发布一帧（只能由生产者调用），写入下一个槽位并覆盖其中最旧的帧
+        :param image: uint8截图
+        :param timestamp: 单调时钟时间戳，默认为当前时间
+        :return: 帧序号
+        """
+        if image.nbytes > self.slot_bytes:
+            raise ValueError(f"截图大小 {image.nbytes} 字节超过帧总线槽位大小 {self.slot_bytes} 字节")
+        if timestamp is None:
+            timestamp = time.monotonic()
+        
+        seq = int(self._header['latest_seq']) + 1
+        index = self._slot_index(seq)
+        meta = self._meta[index:index + 1]
+        shape = image.shape if image.ndim == 3 else image.shape + (1,)
+        
+        meta['version'] += 1  # 奇数：正在写入
+        np.copyto(self._image_view(index, image.shape), image)
+        meta['seq'] = seq
+        meta['timestamp'] = timestamp
+        meta['height'], meta['width'], meta['channels'] = shape
+        meta['version'] += 1  # 偶数：写入完成
+        self._header['latest_seq'] = seq
+        
+        self.frames_published += 1
+        return seq
+    
+    def latest_seq(self):
+        """
+        :return: 最新发布的帧序号，尚无帧时返回0
+        """
+        return int(self._header['latest_seq'])
+    
+    def read(self, seq):
+        """
+        读取指定序号的帧
+        :param seq: 帧序号
+        :return: BusFrame，该帧已被覆盖或正在写入时返回None
+        """
+        if seq <= 0 or seq > self.latest_seq():
+            return None
+        index = self._slot_index(seq)
+        meta = self._meta[index]
+        version = int(meta['version'])
+        if version % 2 == 1 or int(meta['seq']) != seq:
+            self.frames_dropped += 1
+            return None
+        
+        height, width, channels = int(meta['height']), int(meta['width']), int(meta['channels'])
+        timestamp = float(meta['timestamp'])
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        image = self._image_view(index, shape)
+        image.flags.writeable = False
+        
+        if int(self._meta[index]['version']) != version:
+            # 读取元数据期间槽位被覆盖
+            self.frames_dropped += 1
+            return None
+        return BusFrame(seq, timestamp, image, version)
+    
+    def acquire(self, min_seq=1, timeout=1.0, poll_interval=0.001):
+        """
+        等待并读取最新的帧，跳过尚未读取的中间帧
+        :param min_seq: 帧序号的下限
+        :param timeout: 最长等待时间（秒）
+        :param poll_interval: 轮询间隔（秒）
+        :return: BusFrame，超时返回None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            seq = self.latest_seq()
+            if seq >= min_seq:
+                frame = self.read(seq)
+                if frame is not None:
+                    return frame
+                # 最新帧在读取时被覆盖，说明已有更新的帧，立即重试
+                continue
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+    
+    def valid(self, frame):
+        """
+        检查之前读取的帧是否仍然完整（槽位没有被覆盖）
+        :param frame: read() 或 acquire() 返回的帧
+        """
+        if frame is None:
+            return False
+        return int(self._meta[self._slot_index(frame.seq)]['version']) == frame.version
+    
+    def close(self):
+        """
+        断开共享内存；生产者同时删除共享内存
+        调用前应释放所有读取到的帧视图
+        """
+        if self._shm is None:
+            return
+        self._header = None
+        self._meta = None
+        self._close_shm()
+    
+    def _close_shm(self):
+        shm, self._shm = self._shm, None
+        try:
+            shm.close()
+        except BufferError:
+            # 调用方仍持有帧视图，映射在这些视图释放后由垃圾回收关闭
+            pass
+        if self.owner:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class FrameBusCapture(CaptureBackend):
+    """
+    从帧总线读取截图的截图后端，用于工作进程
+    每次截图返回比上一次更新的最新帧（零复制视图），生产者更快时中间的帧被跳过
+    region 坐标相对于生产者发布的截图
+    """
+    name = 'frame-bus'
+    
+    def __init__(self, bus_name, timeout=1.0):
+        """
+        :param bus_name: 帧总线的共享内存名称
+        :param timeout: 等待新帧的最长时间（秒）
+        """
+        self.bus = FrameBus.attach(bus_name)
+        self.timeout = timeout
+        self.frame = None  # 最近一次读取的帧
+        self.frames_skipped = 0
+    
+    def grab(self, region=None):
+        last_seq = self.frame.seq if self.frame is not None else 0
+        frame = self.bus.acquire(min_seq=last_seq + 1, timeout=self.timeout)
+        if frame is None:
+            raise RuntimeError("帧总线上没有新的截图")
+        if last_seq:
+            self.frames_skipped += frame.seq - last_seq - 1
+        self.frame = frame
+        
+        if region is None:
+            return frame.image
+        x, y, w, h = region
+        return frame.image[max(0, y):y + h, max(0, x):x + w]
+    
+    def frame_valid(self):
+        """
+        :return: 最近一次读取的帧是否仍然完整，处理耗时较长时用于确认结果可用
+        """
+        return self.bus.valid(self.frame)
+    
+    def close(self):
+        self.frame = None
+        self.bus.close()
@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+from vision_utils import to_gray
+
+
+class FrameChangeDetector:
+    """
+    画面变化检测器
+    把每帧缩小为灰度缩略图，按固定大小的图块（默认32x32像素）与参考缩略图比较，
+    图块内的最大灰度差超过阈值时认为该图块发生变化，并记录它最后一次变化时的版本号
+    模板匹配结果记下计算时的版本号和所依赖的区域，区域内没有图块变化时即可直接复用
+    
+    参考缩略图只在变化的图块上更新，缓慢的渐变累积到阈值后同样会被识别为变化
+    """
+    def __init__(self, scale=8, threshold=12, tile_size=32):
+        """
+        初始化画面变化检测器
+        :param scale: 缩略图的缩小倍数
+        :param threshold: 图块内缩略图像素的最大灰度差超过该值时认为图块变化
+        :param tile_size: 图块边长（像素），按缩小倍数取整
+        """
+        self.scale = scale
+        self.threshold = threshold
+        self.tile_cells = max(1, tile_size // scale)  # 每个图块在缩略图中的边长
+        self.tile_size = self.tile_cells * scale
+        self.version = 0  # 每次检测到任何变化时加一
+        self.changed_fraction = 0.0  # 最近一帧中发生变化的图块比例
+        self.last_thumbnail = None  # 最近一帧的灰度缩略图，可供其他分析复用
+        self._reference = None
+        self._tile_versions = None  # 每个图块最后一次变化时的版本号
+    
+    def thumbnail(self, frame):
+        """
+        生成用于比较的灰度缩略图
+        先缩小再转灰度，只需处理很少的像素
+        """
+        h, w = frame.shape[:2]
+        size = (max(1, w // self.scale), max(1, h // self.scale))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return to_gray(small)
+    
+    def update(self, frame):
+        """
+        检测新帧相对参考帧是否发生变化，并更新变化图块的版本号
+        :param frame: 屏幕截图
+        :return: 画面是否变化
+        """
+        thumb = self.thumbnail(frame)
+        self.last_thumbnail = thumb
+        reference = self._reference
+        if reference is None or reference.shape != thumb.shape:
+            # 第一帧或分辨率变化，所有图块都视为变化
+            self.version += 1
+            self._reference = thumb
+            self._tile_versions = np.full(self._tile_grid(thumb.shape), self.version, dtype=np.int64)
+            self.changed_fraction = 1.0
+            return True
+        
+        dirty = self._dirty_tiles(cv2.absdiff(thumb, reference))
+        self.changed_fraction = np.count_nonzero(dirty) / dirty.size
+        if not dirty.any():
+            return False
+        
+        self.version += 1
+        self._tile_versions[dirty] = self.version
+        cells = self.tile_cells
+        mask = np.repeat(np.repeat(dirty, cells, axis=0), cells, axis=1)[:thumb.shape[0], :thumb.shape[1]]
+        np.copyto(reference, thumb, where=mask)
+        return True
+    
+    def _tile_grid(self, shape):
+        cells = self.tile_cells
+        return (-(-shape[0] // cells), -(-shape[1] // cells))
+    
+    def _dirty_tiles(self, diff):
+        """
+        计算每个图块内的最大差异并与阈值比较
+        :return: 图块是否变化的布尔数组
+        """
+        cells = self.tile_cells
+        rows, cols = self._tile_grid(diff.shape)
+        h, w = diff.shape
+        if h != rows * cells or w != cols * cells:
+            padded = np.zeros((rows * cells, cols * cells), dtype=diff.dtype)
+            padded[:h, :w] = diff
+            diff = padded
+        tile_max = diff.reshape(rows, cells, cols, cells).max(axis=(1, 3))
+        return tile_max > self.threshold
+    
+    def changed_since(self, version, region=None):
+        """
+        判断某个区域在指定版本之后是否发生过变化
+        :param version: 之前记录的版本号
+        :param region: (x, y, width, height) 截图坐标，None表示整个画面
+        :return: 区域内是否有图块在该版本之后变化
+        """
+        if self._tile_versions is None:
+            return True
+        if region is None:
+            return self.version > version
+        
+        x, y, w, h = region
+        size = self.tile_size
+        rows, cols = self._tile_versions.shape
+        col1 = min(cols, max(0, int(x) // size))
+        row1 = min(rows, max(0, int(y) // size))
+        col2 = min(cols, max(col1 + 1, -(-int(x + w) // size)))
+        row2 = min(rows, max(row1 + 1, -(-int(y + h) // size)))
+        tiles = self._tile_versions[row1:row2, col1:col2]
+        return tiles.size == 0 or int(tiles.max()) > version
+    
+    def reset(self):
+        """
+        丢弃参考帧，下一帧一定被视为变化
+        """
+        self._reference = None
+        self._tile_versions = None
+        self.last_thumbnail = None
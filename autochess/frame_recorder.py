@@ -0,0 +1,329 @@
+import mmap
+import queue
+import struct
+import threading
+import time
+import numpy as np
+
+# 文件头: 魔数、格式版本、图块边长、关键帧间隔、帧数、索引偏移，补齐到64字节
+_HEADER = struct.Struct('<4sHHIIQ')
+_HEADER_SIZE = 64
+_MAGIC = b'AGFR'
+_VERSION = 1
+
+# 每条帧记录的头部: 类型、高、宽、通道数、时间戳、数据长度
+_RECORD = struct.Struct('<BxxxIIIdQ')
+
+KEYFRAME = 0
+DELTA = 1
+
+# 索引表的每一项，numpy结构化类型，读取时直接映射到文件内容
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),  # 帧数据（不含记录头）在文件中的偏移
+    ('length', '<u8'),
+    ('timestamp', '<f8'),
+    ('kind', 'u1'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+    ('channels', 'u1'),
+])
+
+
+class FrameRecorder:
+    """
+    会话录制器
+    把截图追加写入 .agfr 文件：固定长度的文件头、逐帧记录、文件末尾的偏移索引
+    每隔keyframe_interval帧保存一个完整的关键帧，其余帧只保存与上一帧相比发生变化的图块
+    
+    record() 只复制截图并放入有界队列，由后台线程计算差异和写盘；
+    写盘跟不上截图速度时丢弃新帧而不是阻塞决策循环
+    """
+    def __init__(self, path, keyframe_interval=30, tile_size=32, queue_size=8):
+        """
+        初始化录制器并创建文件
+        :param path: 录制文件路径
+        :param keyframe_interval: 关键帧间隔（帧）
+        :param tile_size: 差异图块的边长（像素）
+        :param queue_size: 等待写盘的最大帧数
+        """
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.tile_size = tile_size
+        
+        self._file = open(path, 'wb')
+        self._file.write(b'\0' * _HEADER_SIZE)
+        self._write_header(0, 0)
+        self._offset = _HEADER_SIZE
+        self._index = []
+        
+        self._previous = None  # 上一帧补齐到图块整数倍后的图像
+        self._since_keyframe = 0
+        self._start_time = None
+        
+        # 统计信息
+        self.frames_recorded = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+        self.last_error = None
+        
+        self._closed = False
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='frame-recorder', daemon=True)
+        self._thread.start()
+    
+    def record(self, image, timestamp=None):
+        """
+        录制一帧，截图会被复制，调用后可以立即复用截图缓冲区
+        :param image: 截图的numpy数组
+        :param timestamp: 单调时钟时间戳，默认为当前时间
+        :return: 是否进入写盘队列（队列已满时丢弃）
+        """
+        if self._closed:
+            return False
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self._start_time is None:
+            self._start_time = timestamp
+        
+        if self._queue.full():
+            self.frames_dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((np.array(image, copy=True), timestamp - self._start_time))
+        except queue.Full:
+            self.frames_dropped += 1
+            return False
+        return True
+    
+    def close(self):
+        """
+        写完队列中剩余的帧，写入索引并关闭文件
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        index_offset = self._offset
+        self._file.write(index.tobytes())
+        self._write_header(len(index), index_offset)
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def _write_header(self, frame_count, index_offset):
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, self.tile_size, self.keyframe_interval, frame_count, index_offset))
+        self._file.seek(position)
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            image, timestamp = item
+            try:
+                self._write_frame(image, timestamp)
+            except Exception as e:
+                self.last_error = e
+    
+    def _pad(self, image):
+        """
+        把图像补齐到图块边长的整数倍，便于按图块比较
+        """
+        if image.ndim == 2:
+            image = image[:, :, None]
+        h, w, c = image.shape
+        size = self.tile_size
+        padded_h = -(-h // size) * size
+        padded_w = -(-w // size) * size
+        if padded_h == h and padded_w == w:
+            return image
+        padded = np.zeros((padded_h, padded_w, c), dtype=np.uint8)
+        padded[:h, :w] = image
+        return padded
+    
+    def _write_frame(self, image, timestamp):
+        h, w = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        padded = self._pad(image)
+        size = self.tile_size
+        rows, cols = padded.shape[0] // size, padded.shape[1] // size
+        
+        payload = None
+        kind = KEYFRAME
+        previous = self._previous
+        if previous is not None and previous.shape == padded.shape and self._since_keyframe < self.keyframe_interval:
+            tiles = padded.reshape(rows, size, cols, size, channels).swapaxes(1, 2)
+            previous_tiles = previous.reshape(rows, size, cols, size, channels).swapaxes(1, 2)
+            changed = np.flatnonzero((tiles != previous_tiles).any(axis=(2, 3, 4)))
+            # 变化超过一半时直接保存关键帧，读取更快
+            if len(changed) <= rows * cols // 2:
+                kind = DELTA
+                tile_data = tiles.reshape(rows * cols, size, size, channels)[changed]
+                payload = [struct.pack('<I', len(changed)), changed.astype('<u4').tobytes(), tile_data.tobytes()]
+        
+        if kind == KEYFRAME:
+            # 关键帧保存未补齐的原始像素，读取时可以直接映射为numpy数组
+            payload = [np.ascontiguousarray(image).tobytes()]
+            self._since_keyframe = 0
+        self._since_keyframe += 1
+        self._previous = padded
+        
+        length = sum(len(part) for part in payload)
+        self._file.write(_RECORD.pack(kind, h, w, channels, timestamp, length))
+        for part in payload:
+            self._file.write(part)
+        data_offset = self._offset + _RECORD.size
+        self._index.append((data_offset, length, timestamp, kind, h, w, channels))
+        self._offset = data_offset + length
+        self.frames_recorded += 1
+        self.bytes_written += _RECORD.size + length
+
+
+class FrameReader:
+    """
+    读取 .agfr 录制文件
+    文件通过mmap映射，关键帧直接返回映射内存上的只读numpy视图，没有复制；
+    差异帧从最近的关键帧开始依次应用变化的图块，结果写入复用的缓冲区，
+    顺序读取时每帧只需应用一次差异
+    """
+    def __init__(self, path):
+        """
+        打开录制文件
+        :param path: 录制文件路径
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic, version, self.tile_size, self.keyframe_interval, frame_count, index_offset = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f"不是有效的录制文件: {path}")
+        if version != _VERSION:
+            self.close()
+            raise ValueError(f"不支持的录制文件版本: {version}")
+        
+        if index_offset:
+            self.index = np.frombuffer(self._mmap, dtype=INDEX_DTYPE, count=frame_count, offset=index_offset)
+        else:
+            # 录制未正常结束，没有写入索引，逐条扫描帧记录重建
+            self.index = self._scan()
+        
+        self._buffer = None  # 差异帧的重建缓冲区（补齐到图块整数倍）
+        self._buffer_frame = None  # 缓冲区当前对应的帧号
+        self._position = 0  # 顺序读取的位置
+    
+    def _scan(self):
+        entries = []
+        offset = _HEADER_SIZE
+        end = len(self._mmap)
+        while offset + _RECORD.size <= end:
+            kind, h, w, channels, timestamp, length = _RECORD.unpack_from(self._mmap, offset)
+            data_offset = offset + _RECORD.size
+            if data_offset + length > end:
+                break  # 最后一条记录不完整
+            entries.append((data_offset, length, timestamp, kind, h, w, channels))
+            offset = data_offset + length
+        return np.array(entries, dtype=INDEX_DTYPE)
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def timestamp(self, frame_index):
+        """
+        :return: 帧相对录制开始的时间戳（秒）
+        """
+        return float(self.index[frame_index]['timestamp'])
+    
+    def frame(self, frame_index):
+        """
+        按帧号读取一帧
+        返回的数组是只读的；差异帧位于复用的缓冲区中，下一次读取后内容会被覆盖
+        :param frame_index: 帧号
+        :return: 截图的numpy数组
+        """
+        entry = self.index[frame_index]
+        h, w, channels = int(entry['height']), int(entry['width']), int(entry['channels'])
+        if entry['kind'] == KEYFRAME:
+            image = self._keyframe(entry)
+        else:
+            image = self._reconstruct(frame_index)[:h, :w]
+        return image if channels > 1 else image[:, :, 0]
+    
+    def _keyframe(self, entry):
+        h, w, channels = int(entry['height']), int(entry['width']), int(entry['channels'])
+        return np.frombuffer(self._mmap, dtype=np.uint8, count=h * w * channels, offset=int(entry['offset'])).reshape(h, w, channels)
+    
+    def _reconstruct(self, frame_index):
+        """
+        从最近的关键帧（或缓冲区中已重建的更近的帧）开始应用差异
+        """
+        start = frame_index
+        while self.index[start]['kind'] != KEYFRAME:
+            start -= 1
+        if self._buffer_frame is not None and start <= self._buffer_frame < frame_index:
+            start = self._buffer_frame + 1
+        else:
+            key = self.index[start]
+            image = self._keyframe(key)
+            size = self.tile_size
+            h, w, channels = image.shape
+            shape = (-(-h // size) * size, -(-w // size) * size, channels)
+            if self._buffer is None or self._buffer.shape != shape:
+                self._buffer = np.zeros(shape, dtype=np.uint8)
+            self._buffer[:h, :w] = image
+            start += 1
+        
+        for index in range(start, frame_index + 1):
+            self._apply_delta(self.index[index])
+        self._buffer_frame = frame_index
+        return self._buffer
+    
+    def _apply_delta(self, entry):
+        size = self.tile_size
+        channels = self._buffer.shape[2]
+        cols = self._buffer.shape[1] // size
+        offset = int(entry['offset'])
+        count = struct.unpack_from('<I', self._mmap, offset)[0]
+        tile_ids = np.frombuffer(self._mmap, dtype='<u4', count=count, offset=offset + 4)
+        tiles = np.frombuffer(
+            self._mmap, dtype=np.uint8, count=count * size * size * channels, offset=offset + 4 + 4 * count
+        ).reshape(count, size, size, channels)
+        
+        grid = self._buffer.reshape(-1, size, cols, size, channels).swapaxes(1, 2)
+        grid[tile_ids // cols, tile_ids % cols] = tiles
+    
+    def rewind(self):
+        self._position = 0
+    
+    def next_frame(self):
+        """
+        顺序读取下一帧
+        :return: (时间戳, 图像)，没有更多帧时返回None
+        """
+        if self._position >= len(self.index):
+            return None
+        index = self._position
+        self._position += 1
+        return self.timestamp(index), self.frame(index)
+    
+    def close(self):
+        self.index = None
+        self._buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # 调用方仍持有关键帧的视图，映射在这些视图释放后由垃圾回收关闭
+                pass
+            self._mmap = None
+        self._file.close()
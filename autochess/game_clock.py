@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+
+class SystemClock:
+    """
+    真实时钟，sleep() 会真正等待
+    """
+    name = 'system'
+    
+    def now(self):
+        """
+        :return: 单调时钟读数（秒）
+        """
+        return time.monotonic()
+    
+    def sleep(self, seconds):
+        """
+        等待指定的秒数
+        """
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    虚拟时钟，sleep() 立即返回并把时间向前推进
+    用于回放和测试：机器人里所有的等待都不再消耗真实时间，
+    配合按时间戳回放的录制画面，画面仍然按照等待的时长前进
+    """
+    name = 'virtual'
+    
+    def __init__(self, start=0.0):
+        """
+        :param start: 起始时间（秒）
+        """
+        self._now = start
+        self._lock = threading.Lock()
+        
+        # 统计信息
+        self.slept = 0.0  # 累计跳过的等待时间
+    
+    def now(self):
+        return self._now
+    
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance(seconds)
+    
+    def advance(self, seconds):
+        """
+        把时间向前推进
+        """
+        with self._lock:
+            self._now += seconds
+            self.slept += seconds
+
+
+def create_clock(name=None):
+    """
+    创建时钟
+    :param name: 'system' 或 'virtual'，默认读取环境变量AUTOGAME_CLOCK，未设置时使用真实时钟
+    :return: 时钟实例
+    """
+    if name is None:
+        name = os.environ.get('AUTOGAME_CLOCK', 'system')
+    if name == 'virtual':
+        return VirtualClock()
+    if name == 'system':
+        return SystemClock()
+    raise ValueError(f"未知的时钟类型: {name}")
@@ -0,0 +1,268 @@
+import time
+import cv2
+import numpy as np
+from vision_utils import to_gray
+
+# 字形库中的字符 -> 模板文件名（位于模板目录的 digits 子目录）
+GLYPH_FILES = {str(digit): f'{digit}.png' for digit in range(10)}
+GLYPH_FILES['/'] = 'slash.png'  # 可选，用于读取 "3/6" 这样的分数
+
+
+def binarize(gray):
+    """
+    用Otsu阈值把灰度图二值化，笔画为True
+    笔画像素总是少于背景，因此亮底暗字时自动反转
+    :param gray: 灰度图像
+    :return: 布尔数组
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = binary > 0
+    if np.count_nonzero(mask) > mask.size // 2:
+        mask = ~mask
+    return mask
+
+
+def segment_glyphs(mask, min_height_ratio=0.5):
+    """
+    按列投影切分字形：连续有笔画的列为一个字形，再裁掉字形上下的空白
+    :param mask: binarize() 的结果
+    :param min_height_ratio: 高度不到最高字形该比例的片段视为噪点
+    :return: [(x, y, width, height)]，从左到右排列
+    """
+    columns = mask.any(axis=0)
+    if not columns.any():
+        return []
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], columns.astype(np.int8), [0]))))
+    boxes = []
+    for x1, x2 in zip(edges[::2], edges[1::2]):
+        rows = np.flatnonzero(mask[:, x1:x2].any(axis=1))
+        boxes.append((int(x1), int(rows[0]), int(x2 - x1), int(rows[-1] - rows[0] + 1)))
+    
+    tallest = max(box[3] for box in boxes)
+    return [box for box in boxes if box[3] >= tallest * min_height_ratio]
+
+
+class DigitReader:
+    """
+    HUD数字读取器
+    在数字区域内二值化并切分出每个字形，缩放到统一大小后去均值归一化，
+    与字形库（模板目录下 digits/0.png ~ digits/9.png，可选 digits/slash.png）
+    用一次矩阵乘法比较全部相关系数，每个字形取最相似的字符；
+    读取一个数字区域只需零点几毫秒
+    
+    字形库图片是从游戏截图中裁出的单个字符，背景和笔画颜色与游戏中一致即可
+    """
+    def __init__(self, template_store, glyph_dir='digits', glyph_size=(12, 16), min_score=0.6):
+        """
+        初始化数字读取器
+        :param template_store: 模板缓存，字形库通过它加载，修改后自动重新加载
+        :param glyph_dir: 字形库所在的模板子目录
+        :param glyph_size: 比较时字形缩放到的 (宽, 高)
+        :param min_score: 与最相似字符的相关系数低于该值时视为无法识别
+        """
+        self.template_store = template_store
+        self.glyph_dir = glyph_dir
+        self.glyph_size = glyph_size
+        self.min_score = min_score
+        
+        self._bank_key = None
+        self._bank_version = None  # 构建字形库时模板缓存的 version
+        self._bank_checked_at = float('-inf')
+        self._bank = None  # (字符数, 特征维数) 的字形特征矩阵
+        self._chars = []
+    
+    def _glyph_vector(self, mask):
+        """
+        把字形二值图保持宽高比居中放入统一大小，再去均值归一化
+        数字1这样的窄字形不会被拉伸成实心方块
+        """
+        width, height = self.glyph_size
+        h, w = mask.shape
+        box_w, box_h = max(w, int(round(h * width / height))), max(h, int(round(w * height / width)))
+        canvas = np.zeros((box_h, box_w), dtype=np.float32)
+        top, left = (box_h - h) // 2, (box_w - w) // 2
+        canvas[top:top + h, left:left + w] = mask
+        glyph = cv2.resize(canvas, self.glyph_size, interpolation=cv2.INTER_AREA).ravel()
+        glyph -= glyph.mean()
+        norm = np.linalg.norm(glyph)
+        return glyph / norm if norm > 1e-6 else glyph
+    
+    def _load_bank(self):
+        """
+        加载字形库，字形图片没有变化时复用上一次构建的特征矩阵
+        模板缓存的 version 不变时，每个检查间隔内只查询一次字形图片，而不是每次读取都查询
+        :return: 是否有完整的0-9字形
+        """
+        store = self.template_store
+        now = time.monotonic()
+        if store.version == self._bank_version and now - self._bank_checked_at < store.check_interval:
+            return self._bank is not None
+        self._bank_checked_at = now
+        
+        images = {
+            char: self.template_store.get(f'{self.glyph_dir}/{file_name}')
+            for char, file_name in GLYPH_FILES.items()
+        }
+        key = tuple(id(image) for image in images.values())
+        self._bank_version = store.version
+        if key == self._bank_key:
+            return self._bank is not None
+        self._bank_key = key
+        
+        if any(images[str(digit)] is None for digit in range(10)):
+            self._bank, self._chars = None, []
+            return False
+        
+        chars, vectors = [], []
+        for char, image in images.items():
+            if image is None:
+                continue
+            mask = binarize(to_gray(image))
+            boxes = segment_glyphs(mask)
+            if boxes:
+                # 字形图片可能带有空白边，只取笔画的外接矩形
+                x1 = min(box[0] for box in boxes)
+                x2 = max(box[0] + box[2] for box in boxes)
+                y1 = min(box[1] for box in boxes)
+                y2 = max(box[1] + box[3] for box in boxes)
+                mask = mask[y1:y2, x1:x2]
+            chars.append(char)
+            vectors.append(self._glyph_vector(mask))
+        self._chars = chars
+        self._bank = np.stack(vectors)
+        return True
+    
+    @property
+    def available(self):
+        """
+        字形库是否完整可用
+        """
+        return self._load_bank()
+    
+    def read_text(self, image):
+        """
+        读取图像中的一行数字
+        :param image: 只包含数字的截图区域（BGR、BGRA或灰度）
+        :return: 识别出的字符串，无法识别的字形记为'?'；字形库不可用或区域内没有字形时返回None
+        """
+        if image is None or image.size == 0 or not self._load_bank():
+            return None
+        mask = binarize(to_gray(image))
+        boxes = segment_glyphs(mask)
+        if not boxes:
+            return None
+        
+        glyphs = np.stack([self._glyph_vector(mask[y:y + h, x:x + w]) for x, y, w, h in boxes])
+        scores = glyphs @ self._bank.T
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(boxes)), best]
+        return ''.join(
+            self._chars[index] if score >= self.min_score else '?'
+            for index, score in zip(best, best_scores)
+        )
+    
+    def read_number(self, image):
+        """
+        读取一个整数
+        :return: 整数，有无法识别的字形或没有数字时返回None
+        """
+        text = self.read_text(image)
+        if not text or not text.isdigit():
+            return None
+        return int(text)
+    
+    def read_fraction(self, image):
+        """
+        读取 "3/6" 形式的分数
+        字形库中没有斜杠时，把唯一一个无法识别的字形当作斜杠
+        :return: (分子, 分母)，无法读取时返回None
+        """
+        text = self.read_text(image)
+        if not text:
+            return None
+        parts = text.replace('?', '/').split('/')
+        if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+            return None
+        return int(parts[0]), int(parts[1])
+
+
+class EnergyBarReader:
+    """
+    能量条读取器
+    只取能量条区域中间的一行像素转换到HSV，按颜色范围判断每个像素是否已填充，
+    从左端起向右找到最远的、其左侧大部分像素都已填充的位置作为填充长度，
+    能量条上的分隔线和右侧零星的同色像素都不影响结果；读取一次只需几十微秒
+    """
+    def __init__(self, region, hue_range, min_saturation=80, min_value=80, max_energy=10, min_density=0.8):
+        """
+        初始化能量条读取器
+        :param region: 能量条在截图中的 (x, y, 宽, 高)，按截图宽高的比例表示，截图大小变化时不需要修改
+        :param hue_range: 已填充部分的色调范围 (最小, 最大)，OpenCV色调取值0-179，最小值大于最大值时表示跨过红色
+        :param min_saturation: 已填充部分的最低饱和度
+        :param min_value: 已填充部分的最低亮度
+        :param max_energy: 能量条满时对应的能量值
+        :param min_density: 填充长度内已填充像素至少占的比例
+        """
+        self.region = region
+        self.hue_range = hue_range
+        self.min_saturation = min_saturation
+        self.min_value = min_value
+        self.max_energy = max_energy
+        self.min_density = min_density
+    
+    def sample_row(self, screen):
+        """
+        :return: 能量条区域中间一行的BGR像素，形状为 (1, 宽, 3)；区域超出截图时返回None
+        """
+        screen_h, screen_w = screen.shape[:2]
+        x, y, w, h = self.region
+        left, right = int(x * screen_w), int((x + w) * screen_w)
+        row = int((y + h / 2) * screen_h)
+        left, right = max(0, left), min(screen_w, right)
+        if right <= left or not 0 <= row < screen_h:
+            return None
+        
+        pixels = screen[row:row + 1, left:right]
+        if pixels.ndim == 2:
+            # 灰度截图没有颜色信息
+            return None
+        return np.ascontiguousarray(pixels[:, :, :3])
+    
+    def fill_fraction(self, screen):
+        """
+        测量能量条的填充比例
+        :param screen: 屏幕截图
+        :return: 0-1之间的比例，无法读取时返回None
+        """
+        if screen is None:
+            return None
+        pixels = self.sample_row(screen)
+        if pixels is None:
+            return None
+        
+        hsv = cv2.cvtColor(pixels, cv2.COLOR_BGR2HSV)[0]
+        hue, saturation, value = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+        low, high = self.hue_range
+        if low <= high:
+            hue_ok = (hue >= low) & (hue <= high)
+        else:
+            hue_ok = (hue >= low) | (hue <= high)
+        filled = hue_ok & (saturation >= self.min_saturation) & (value >= self.min_value)
+        
+        # 每个位置左侧（含自身）已填充像素的比例
+        density = np.cumsum(filled) / np.arange(1, filled.size + 1)
+        ends = np.flatnonzero(filled & (density >= self.min_density))
+        if ends.size == 0:
+            return 0.0
+        return (ends[-1] + 1) / filled.size
+    
+    def read(self, screen):
+        """
+        读取能量值
+        :param screen: 屏幕截图
+        :return: 0到max_energy之间的小数能量值，无法读取时返回None
+        """
+        fraction = self.fill_fraction(screen)
+        if fraction is None:
+            return None
+        return fraction * self.max_energy
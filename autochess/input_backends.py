@@ -0,0 +1,328 @@
+import ctypes
+import ctypes.util
+import os
+import time
+from collections import namedtuple
+
+# 输入时序配置：按下到松开的时长、点击后停顿、拖动后停顿、拖动持续时间、拖动的分段数
+TimingProfile = namedtuple('TimingProfile', ['click_hold', 'after_click', 'after_drag', 'drag_duration', 'drag_steps'])
+
+TIMING_PROFILES = {
+    # 没有任何停顿，用于回放和测试
+    'instant': TimingProfile(0.0, 0.0, 0.0, 0.0, 1),
+    # 游戏能够稳定响应的最短停顿
+    'fast': TimingProfile(0.02, 0.05, 0.1, 0.2, 10),
+    # 与原先 pyautogui.PAUSE = 0.5 的节奏相当
+    'default': TimingProfile(0.05, 0.5, 0.5, 0.5, 20),
+    # 更接近人类操作的节奏
+    'human': TimingProfile(0.08, 0.8, 0.8, 0.7, 30),
+}
+
+
+def get_timing_profile(name=None):
+    """
+    获取输入时序配置
+    :param name: 配置名称，默认读取环境变量AUTOGAME_TIMING，未设置时使用'default'
+    :return: TimingProfile
+    """
+    if name is None:
+        name = os.environ.get('AUTOGAME_TIMING', 'default')
+    if name not in TIMING_PROFILES:
+        raise ValueError(f"未知的输入时序配置: {name}")
+    return TIMING_PROFILES[name]
+
+
+class _FailSafeException(Exception):
+    """
+    无法导入pyautogui时XTest后端紧急停止抛出的异常
+    """
+
+
+class InputBackend:
+    """
+    鼠标输入后端接口
+    后端本身没有任何隐含的停顿，操作之间的等待由调用方按时序配置决定；
+    需要持续时间的操作（按住、拖动）通过 self.sleep 等待，可以替换为虚拟时钟
+    """
+    name = 'base'
+    
+    def __init__(self):
+        self.sleep = time.sleep
+    
+    def move(self, x, y):
+        raise NotImplementedError
+    
+    def mouse_down(self):
+        raise NotImplementedError
+    
+    def mouse_up(self):
+        raise NotImplementedError
+    
+    def position(self):
+        """
+        :return: 鼠标当前位置 (x, y)
+        """
+        raise NotImplementedError
+    
+    def screen_size(self):
+        """
+        :return: 屏幕尺寸 (宽, 高)
+        """
+        raise NotImplementedError
+    
+    def click(self, x, y, hold=0.0):
+        """
+        移动到指定位置并点击左键
+        :param hold: 按下到松开之间的时长（秒）
+        """
+        self.move(x, y)
+        self.mouse_down()
+        if hold > 0:
+            self.sleep(hold)
+        self.mouse_up()
+    
+    def drag(self, start, end, duration=0.5, steps=20):
+        """
+        按住左键从起点分段移动到终点
+        :param duration: 拖动持续的时间（秒）
+        :param steps: 移动的分段数
+        """
+        self.move(start[0], start[1])
+        self.mouse_down()
+        steps = max(1, steps)
+        for step in range(1, steps + 1):
+            x = start[0] + (end[0] - start[0]) * step // steps
+            y = start[1] + (end[1] - start[1]) * step // steps
+            if duration > 0:
+                self.sleep(duration / steps)
+            self.move(x, y)
+        self.mouse_up()
+    
+    def close(self):
+        pass
+
+
+class PyAutoGUIInput(InputBackend):
+    """
+    基于pyautogui的输入后端，适用于所有平台
+    首次使用时才导入pyautogui并关闭它自带的PAUSE，停顿完全由时序配置控制
+    """
+    name = 'pyautogui'
+    
+    def __init__(self):
+        super().__init__()
+        self._pyautogui = None
+    
+    def _api(self):
+        if self._pyautogui is None:
+            import pyautogui
+            pyautogui.PAUSE = 0
+            self._pyautogui = pyautogui
+        return self._pyautogui
+    
+    def move(self, x, y):
+        self._api().moveTo(x, y)
+    
+    def mouse_down(self):
+        self._api().mouseDown()
+    
+    def mouse_up(self):
+        self._api().mouseUp()
+    
+    def position(self):
+        x, y = self._api().position()
+        return x, y
+    
+    def screen_size(self):
+        width, height = self._api().size()
+        return width, height
+
+
+class XTestInput(InputBackend):
+    """
+    基于X11 XTest扩展的输入后端（Linux），需要通过 AUTOGAME_INPUT=xtest 显式启用
+    直接向X服务器注入鼠标事件，没有pyautogui的额外开销和隐含停顿；
+    事件不经过pyautogui，因此每次点击和拖动前自行检查鼠标是否在屏幕左上角，保留紧急停止功能
+    """
+    name = 'xtest'
+    
+    _LEFT_BUTTON = 1
+    
+    def __init__(self, display_name=None, fail_safe=True):
+        """
+        :param display_name: X11显示名称，默认使用环境变量DISPLAY
+        :param fail_safe: 鼠标位于屏幕左上角时是否中断程序，与 pyautogui.FAILSAFE 相同
+        """
+        super().__init__()
+        self.fail_safe = fail_safe
+        libx11 = ctypes.util.find_library('X11')
+        libxtst = ctypes.util.find_library('Xtst')
+        if not libx11 or not libxtst:
+            raise OSError("未找到libX11或libXtst")
+        
+        self._x11 = ctypes.CDLL(libx11)
+        self._xtst = ctypes.CDLL(libxtst)
+        self._declare_functions()
+        
+        self._display = self._x11.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self._display:
+            raise OSError("无法连接X11显示")
+        if not self._xtst.XTestQueryExtension(
+            self._display, ctypes.byref(ctypes.c_int()), ctypes.byref(ctypes.c_int()),
+            ctypes.byref(ctypes.c_int()), ctypes.byref(ctypes.c_int()),
+        ):
+            self.close()
+            raise OSError("X服务器不支持XTest扩展")
+        
+        self._screen = self._x11.XDefaultScreen(self._display)
+        self._root = self._x11.XRootWindow(self._display, self._screen)
+    
+    def _declare_functions(self):
+        x11, xtst = self._x11, self._xtst
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XFlush.argtypes = [ctypes.c_void_p]
+        x11.XQueryPointer.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong,
+            ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong),
+            ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+            ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+            ctypes.POINTER(ctypes.c_uint),
+        ]
+        
+        int_pointer = ctypes.POINTER(ctypes.c_int)
+        xtst.XTestQueryExtension.argtypes = [ctypes.c_void_p, int_pointer, int_pointer, int_pointer, int_pointer]
+        xtst.XTestFakeMotionEvent.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        xtst.XTestFakeButtonEvent.argtypes = [ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong]
+    
+    def _check_fail_safe(self):
+        """
+        鼠标位于屏幕左上角时中断程序，抛出与pyautogui相同的 FailSafeException
+        """
+        if not self.fail_safe or self.position() != (0, 0):
+            return
+        try:
+            from pyautogui import FailSafeException
+        except Exception:
+            FailSafeException = _FailSafeException
+        raise FailSafeException("鼠标位于屏幕左上角，紧急停止")
+    
+    def click(self, x, y, hold=0.0):
+        self._check_fail_safe()
+        super().click(x, y, hold)
+    
+    def drag(self, start, end, duration=0.5, steps=20):
+        self._check_fail_safe()
+        super().drag(start, end, duration, steps)
+    
+    def move(self, x, y):
+        self._xtst.XTestFakeMotionEvent(self._display, self._screen, int(x), int(y), 0)
+        self._x11.XFlush(self._display)
+    
+    def mouse_down(self):
+        self._xtst.XTestFakeButtonEvent(self._display, self._LEFT_BUTTON, 1, 0)
+        self._x11.XFlush(self._display)
+    
+    def mouse_up(self):
+        self._xtst.XTestFakeButtonEvent(self._display, self._LEFT_BUTTON, 0, 0)
+        self._x11.XFlush(self._display)
+    
+    def position(self):
+        root, child = ctypes.c_ulong(), ctypes.c_ulong()
+        root_x, root_y, win_x, win_y = ctypes.c_int(), ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+        mask = ctypes.c_uint()
+        self._x11.XQueryPointer(
+            self._display, self._root, ctypes.byref(root), ctypes.byref(child),
+            ctypes.byref(root_x), ctypes.byref(root_y), ctypes.byref(win_x), ctypes.byref(win_y),
+            ctypes.byref(mask),
+        )
+        return root_x.value, root_y.value
+    
+    def screen_size(self):
+        return (
+            self._x11.XDisplayWidth(self._display, self._screen),
+            self._x11.XDisplayHeight(self._display, self._screen),
+        )
+    
+    def close(self):
+        if self._display:
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+
+
+class RecordingInput(InputBackend):
+    """
+    只记录操作、不产生真实输入的后端，用于回放录制画面和测试
+    每个事件记录为 (时间, 动作, x, y)，时间取自clock（可以是虚拟时钟）
+    """
+    name = 'recording'
+    
+    def __init__(self, screen_size=(1920, 1080), clock=time.monotonic):
+        super().__init__()
+        self.clock = clock
+        self.events = []
+        self._position = (0, 0)
+        self._screen_size = screen_size
+        self._pressed = False
+    
+    def _record(self, action):
+        self.events.append((self.clock(), action, self._position[0], self._position[1]))
+    
+    def move(self, x, y):
+        self._position = (int(x), int(y))
+        if self._pressed:
+            self._record('drag')
+    
+    def mouse_down(self):
+        self._pressed = True
+        self._record('down')
+    
+    def mouse_up(self):
+        self._pressed = False
+        self._record('up')
+    
+    def clicks(self):
+        """
+        :return: 所有点击（按下后在原位松开）的位置列表
+        """
+        result = []
+        pressed_at = None
+        for _, action, x, y in self.events:
+            if action == 'down':
+                pressed_at = (x, y)
+            elif action == 'up':
+                if pressed_at == (x, y):
+                    result.append((x, y))
+                pressed_at = None
+            elif action == 'drag':
+                pressed_at = None
+        return result
+    
+    def position(self):
+        return self._position
+    
+    def screen_size(self):
+        return self._screen_size
+
+
+def create_input_backend(name=None):
+    """
+    创建输入后端
+    :param name: 后端名称('xtest'、'pyautogui'、'recording')，默认读取环境变量AUTOGAME_INPUT，
+                 未设置时使用pyautogui；XTest只在显式指定时使用
+    :return: 输入后端实例
+    """
+    if name is None:
+        name = os.environ.get('AUTOGAME_INPUT') or None
+    
+    if name == 'recording':
+        return RecordingInput()
+    if name == 'xtest':
+        return XTestInput()
+    return PyAutoGUIInput()
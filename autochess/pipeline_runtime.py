@@ -0,0 +1,360 @@
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+import numpy as np
+from frame_change import FrameChangeDetector
+
+# 排队等待执行的动作：编号、类型、参数、决策所依据的帧序号、提交时间
+Action = namedtuple('Action', ['action_id', 'kind', 'args', 'seq', 'created'])
+
+# 预取的帧：图像、截图时间、截图开始时已完成的最后一个动作编号、预先计算的匹配结果
+# matches 为 {缓存键: (模板, 匹配结果, 依赖区域)}，与 AutoGame 匹配缓存的条目一致
+PrefetchedFrame = namedtuple('PrefetchedFrame', ['image', 'timestamp', 'after_action', 'matches'])
+
+
+class PipelineRuntime:
+    """
+    流水线运行时
+    原来的决策循环完全串行：截图 -> 匹配 -> 决策 -> 点击 -> 等待
+    启用后点击和拖动只是提交到输入线程的队列，由输入线程注入事件并完成操作后的停顿；
+    每个动作完成后预取线程立即截图并预先匹配最近使用过的模板，与下一个动作的注入同时进行，
+    决策循环取帧时直接使用预取的帧，模板查找命中预先计算的结果
+    
+    每个动作带有决策时所依据的帧序号，输入线程在执行前检查：
+    - 动作排队时间超过max_action_age时丢弃
+    - 预取的帧中大部分画面发生变化（画面切换）时设置屏障，基于切换之前画面的动作全部丢弃
+    """
+    def __init__(self, bot, max_action_age=1.0, max_frame_age=0.3, scene_change=0.6, max_prefetch_templates=16):
+        """
+        初始化流水线运行时
+        :param bot: AutoGame 实例
+        :param max_action_age: 动作从提交到执行允许的最长时间（秒），None表示不限制
+        :param max_frame_age: 预取的帧最多允许多旧（秒），更旧时重新截图
+        :param scene_change: 变化图块的比例达到该值时视为画面切换，None表示不检测
+        :param max_prefetch_templates: 每帧最多预先匹配的模板数量
+        """
+        self.bot = bot
+        self.max_action_age = max_action_age
+        self.max_frame_age = max_frame_age
+        self.scene_change = scene_change
+        self.max_prefetch_templates = max_prefetch_templates
+        
+        self._cond = threading.Condition()
+        self._actions = deque()
+        self._submitted_action = 0  # 最后提交的动作编号
+        self._done_action = 0  # 最后完成（执行或丢弃）的动作编号
+        self._action_time = 0.0  # 最后一个动作完成的机器人时钟时间
+        self._barrier_seq = 0  # 决策帧序号小于该值的动作已过期
+        
+        self._prefetch_requests = 0
+        self._capturing = False
+        self._latest = None  # 最新的预取帧
+        self._adopted = None  # 决策循环正在使用的预取帧
+        self._buffers = []  # 预取帧的图像缓冲区，轮流复用
+        self._scene = FrameChangeDetector()
+        self._watched = OrderedDict()  # 缓存键 -> (模板名, 置信度, 金字塔匹配)
+        self._error = None  # 预取线程中需要转交给决策循环的异常（如回放结束）
+        
+        self._running = False
+        self._threads = []
+        
+        # 统计信息
+        self.actions_executed = 0
+        self.actions_dropped = 0
+        self.frames_prefetched = 0
+        self.frames_adopted = 0
+        self.prefetch_time = 0.0  # 截图加预先匹配的平均耗时（秒）
+    
+    def start(self):
+        """
+        启动输入线程和预取线程
+        """
+        if self._running:
+            return
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._input_loop, name='pipeline-input', daemon=True),
+            threading.Thread(target=self._prefetch_loop, name='pipeline-prefetch', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def stop(self):
+        """
+        执行完已排队的动作后停止
+        """
+        if not self._running:
+            return
+        self.drain(timeout=5.0)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+    
+    @property
+    def running(self):
+        return self._running
+    
+    def submit(self, kind, args):
+        """
+        提交一个动作，立即返回
+        :param kind: 'click' 或 'drag'
+        :param args: click为 (x, y)，drag为 (起点, 终点, 持续时间)
+        :return: 动作编号
+        """
+        with self._cond:
+            self._submitted_action += 1
+            action = Action(self._submitted_action, kind, args, self.bot.frame_seq, self.bot.clock.now())
+            self._actions.append(action)
+            self._cond.notify_all()
+        return action.action_id
+    
+    def barrier(self, seq=None):
+        """
+        丢弃所有基于seq之前的帧做出、尚未执行的动作
+        :param seq: 帧序号，默认为决策循环下一次取得的帧
+        """
+        if seq is None:
+            seq = self.bot.frame_seq + 1
+        with self._cond:
+            self._barrier_seq = max(self._barrier_seq, seq)
+    
+    def drain(self, timeout=None):
+        """
+        等待已提交的动作全部完成
+        :param timeout: 最长等待时间（秒）
+        :return: 是否全部完成
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._done_action >= self._submitted_action or not self._running, timeout
+            ) and self._done_action >= self._submitted_action
+    
+    def request_prefetch(self):
+        """
+        请求预取一帧，用于在等待结束前提前准备好下一次决策的截图
+        """
+        with self._cond:
+            self._prefetch_requests += 1
+            self._cond.notify_all()
+    
+    def watch(self, key, template_name, confidence, pyramid):
+        """
+        记录决策循环使用过的模板查找，之后的预取帧会预先完成这些匹配
+        :param key: AutoGame 匹配缓存的键
+        """
+        with self._cond:
+            self._watched[key] = (template_name, confidence, pyramid)
+            self._watched.move_to_end(key)
+            while len(self._watched) > self.max_prefetch_templates:
+                self._watched.popitem(last=False)
+    
+    def acquire_frame(self, timeout=2.0):
+        """
+        取得在所有已提交动作完成之后截取、且没有被使用过的最新预取帧
+        没有合适的帧时请求预取并等待
+        :param timeout: 最长等待时间（秒）
+        :return: PrefetchedFrame，超时返回None
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                
+                busy = self._prefetch_requests > 0 or self._capturing
+                frame = self._latest
+                if not busy and self._usable(frame):
+                    self._adopted = frame
+                    self.frames_adopted += 1
+                    return frame
+                if not busy and not self._actions:
+                    # 没有排队的动作会触发预取，主动请求一帧
+                    self._prefetch_requests += 1
+                    self._cond.notify_all()
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    return None
+                self._cond.wait(remaining)
+    
+    def _usable(self, frame):
+        """
+        判断预取帧能否作为下一次决策的截图，调用方需持有锁
+        """
+        if frame is None or frame is self._adopted:
+            return False
+        if frame.after_action < self._submitted_action:
+            return False
+        return self.bot.clock.now() - frame.timestamp <= self.max_frame_age
+    
+    def _input_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._actions or not self._running)
+                if not self._actions:
+                    return
+                action = self._actions[0]
+            
+            executed = False
+            reason = self._stale_reason(action)
+            if reason is not None:
+                self.actions_dropped += 1
+                self.bot.log(f"丢弃过期动作 {action.kind} {action.args[:2]}（基于第 {action.seq} 帧）: {reason}")
+            else:
+                try:
+                    self._execute(action)
+                    executed = True
+                except Exception as e:
+                    self.bot.log(f"执行动作 {action.kind} 失败: {str(e)}")
+            
+            with self._cond:
+                self._actions.popleft()
+                self._done_action = action.action_id
+                if executed:
+                    self.actions_executed += 1
+                    self._action_time = self.bot.clock.now()
+                    self._prefetch_requests += 1
+                self._cond.notify_all()
+    
+    def _stale_reason(self, action):
+        """
+        :return: 动作过期的原因，未过期时返回None
+        """
+        if action.seq < self._barrier_seq:
+            return "画面已切换"
+        if self.max_action_age is not None:
+            age = self.bot.clock.now() - action.created
+            if age > self.max_action_age:
+                return f"排队 {age:.2f} 秒"
+        return None
+    
+    def _execute(self, action):
+        """
+        注入动作的输入事件，并完成时序配置中操作之后的停顿
+        """
+        bot = self.bot
+        timing = bot.timing
+        if action.kind == 'click':
+            x, y = action.args
+            bot.input.click(x, y, hold=timing.click_hold)
+            bot.clock.sleep(timing.after_click)
+        elif action.kind == 'drag':
+            start, end, duration = action.args
+            bot.input.drag(start, end, duration=duration, steps=timing.drag_steps)
+            bot.clock.sleep(timing.after_drag)
+        else:
+            raise ValueError(f"未知的动作类型: {action.kind}")
+    
+    def _prefetch_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._prefetch_requests > 0 or not self._running)
+                if not self._running:
+                    return
+                self._prefetch_requests -= 1
+                self._capturing = True
+                after_action = self._done_action
+                action_time = self._action_time
+                watched = list(self._watched.items())
+            
+            frame = None
+            started = time.perf_counter()
+            try:
+                frame = self._prefetch(after_action, action_time, watched)
+            except Exception as e:
+                self.bot.log(f"预取截图失败: {str(e)}")
+            except BaseException as e:
+                with self._cond:
+                    self._error = e
+            
+            with self._cond:
+                self._capturing = False
+                if frame is not None:
+                    self._latest = frame
+                    self.frames_prefetched += 1
+                self._cond.notify_all()
+            if frame is not None:
+                self.prefetch_time = 0.8 * self.prefetch_time + 0.2 * (time.perf_counter() - started)
+    
+    def _prefetch(self, after_action, action_time, watched):
+        """
+        截图并预先匹配模板
+        还有更新的预取请求时这一帧很快会被取代，跳过匹配
+        """
+        image, timestamp = self._grab(action_time)
+        
+        if self.scene_change is not None:
+            # 第一帧没有可比较的画面，不设置屏障
+            changed = self._scene.update(image)
+            if changed and self._scene.version > 1 and self._scene.changed_fraction >= self.scene_change:
+                self.barrier()
+        
+        with self._cond:
+            superseded = self._prefetch_requests > 0
+        matches = {} if superseded else self._prematch(image, watched)
+        return PrefetchedFrame(image, timestamp, after_action, matches)
+    
+    def _grab(self, action_time):
+        """
+        截图并复制到预取缓冲区
+        启用了后台截图服务时读取服务中在最后一个动作之后截取的帧
+        :return: (图像, 截图时间)
+        """
+        bot = self.bot
+        service = bot.capture_service
+        if service is not None and service.running:
+            frame = service.acquire_latest(max_age=bot.max_frame_age, min_timestamp=action_time, timeout=1.0)
+            if frame is None:
+                raise RuntimeError(f"后台截图服务未能提供新帧: {service.last_error}")
+            try:
+                return self._copy(frame.image), frame.timestamp
+            finally:
+                service.release(frame)
+        
+        timestamp = bot.clock.now()
+        return self._copy(bot.capture_backend.grab(bot.region)), timestamp
+    
+    def _copy(self, image):
+        """
+        复制截图到一个空闲的缓冲区
+        决策循环正在使用的帧和最新的预取帧所在的缓冲区不会被覆盖
+        """
+        with self._cond:
+            in_use = [frame.image for frame in (self._adopted, self._latest) if frame is not None]
+        for buffer in self._buffers:
+            if buffer.shape == image.shape and buffer.dtype == image.dtype and not any(buffer is used for used in in_use):
+                np.copyto(buffer, image)
+                return buffer
+        
+        buffer = np.array(image, copy=True)
+        self._buffers = [b for b in self._buffers if any(b is used for used in in_use)] + [buffer]
+        return buffer
+    
+    def _prematch(self, image, watched):
+        """
+        在线程池中并行匹配最近使用过的模板
+        :return: {缓存键: (模板, (中心点, 置信度), 依赖区域)}
+        """
+        bot = self.bot
+        executor = bot._get_match_executor()
+        futures = {}
+        for key, (template_name, confidence, pyramid) in watched:
+            template = bot.template_store.get(template_name)
+            if template is None:
+                continue
+            futures[key] = (template, executor.submit(
+                bot._locate_template, image, template_name, template, confidence, pyramid
+            ))
+        
+        matches = {}
+        for key, (template, future) in futures.items():
+            try:
+                center, max_val, region = future.result()
+            except Exception:
+                continue
+            matches[key] = (template, (center, max_val), region)
+        return matches
@@ -5,6 +5,7 @@ import time
 import os
 import sys
 from auto_battle_spirit import AutoBattleSpirit
+from fleet import Fleet
 
 def clear_screen():
     """清除控制台屏幕"""
@@ -76,6 +77,7 @@ def main():
     print("1. 开始自动战斗")
     print("2. 测试窗口句柄获取")
     print("3. 测试模板识别")
+    print("4. 多窗口同时自动战斗")
     print("0. 退出")
     
     choice = input("\n请输入选项编号: ").strip()
@@ -195,6 +197,32 @@ def main():
         input("\n按Enter键返回主菜单...")
         main()
     
+    elif choice == '4':
+        # 同一桌面上并排运行的多个游戏窗口共用一次桌面截图
+        window_title = input("请输入游戏窗口标题(默认为'对战精灵'): ").strip() or "对战精灵"
+        hwnds = AutoBattleSpirit.list_game_windows(window_title)
+        if not hwnds:
+            print(f"未找到标题包含 '{window_title}' 的窗口")
+            input("\n按Enter键返回主菜单...")
+            main()
+            return
+        print(f"找到 {len(hwnds)} 个游戏窗口，请确保窗口并排显示、互不遮挡")
+        
+        num_battles = 3
+        try:
+            num_battles = int(input("请输入每个窗口要进行的战斗次数(默认3): ") or "3")
+        except ValueError:
+            print("输入无效，使用默认值3")
+        
+        fleet = Fleet()
+        for hwnd in hwnds:
+            fleet.add(AutoBattleSpirit(window_title=window_title, confidence=0.7, hwnd=hwnd))
+        fleet.run(lambda bot: bot.auto_battle_loop(num_battles=num_battles))
+        
+        print("\n所有窗口的自动战斗已完成")
+        input("\n按Enter键返回主菜单...")
+        main()
+    
     elif choice == '0':
         print("感谢使用对战精灵自动战斗脚本，再见！")
         return
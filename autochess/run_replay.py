@@ -0,0 +1,91 @@
+import argparse
+import importlib
+import os
+import random
+import sys
+import time
+
+# 可在录制画面上运行的机器人: 名称 -> (模块, 类名)
+BOTS = {
+    'autogame': ('autogame', 'AutoGame'),
+    'advanced': ('advanced_battle_bot', 'AdvancedBattleBot'),
+    'spirit': ('auto_battle_spirit', 'AutoBattleSpirit'),
+    'clash': ('clash_royale_bot', 'ClashRoyaleBot'),
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="在录制的画面上回放运行机器人，不需要显示器和游戏窗口")
+    parser.add_argument('source', help="录制画面：截图目录或视频文件")
+    parser.add_argument('--bot', choices=sorted(BOTS), default='advanced', help="要运行的机器人")
+    parser.add_argument('--mode', choices=['step', 'realtime'], default='step',
+                        help="step: 每次截图前进一帧；realtime: 按录制时间戳播放")
+    parser.add_argument('--loop', action='store_true', help="播放完毕后从头开始")
+    parser.add_argument('--battles', type=int, default=1, help="自动战斗的次数")
+    parser.add_argument('--templates', help="只测试模板匹配：逗号分隔的模板名，每帧匹配一次")
+    parser.add_argument('--confidence', type=float, default=0.7, help="图像匹配的置信度阈值")
+    parser.add_argument('--seed', type=int, default=0, help="随机数种子，保证回放结果可重复")
+    parser.add_argument('--real-clock', action='store_true',
+                        help="使用真实时钟，机器人中的等待会真正消耗时间（默认使用立即返回的虚拟时钟）")
+    parser.add_argument('--pipeline', action='store_true', help="启用流水线运行时，动作异步执行并预取下一帧")
+    return parser.parse_args(argv)
+
+def benchmark_templates(bot, template_names):
+    """
+    逐帧匹配模板直到回放结束，用于测量模板匹配的吞吐量
+    """
+    while True:
+        with bot.frame_tick():
+            bot.find_templates(template_names)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.source):
+        print(f"错误: 录制画面不存在 - {args.source}")
+        return 1
+    
+    # 机器人创建截图后端时读取这些环境变量，自动使用回放后端
+    os.environ['AUTOGAME_REPLAY'] = os.path.abspath(args.source)
+    os.environ['AUTOGAME_REPLAY_MODE'] = args.mode
+    os.environ['AUTOGAME_REPLAY_LOOP'] = '1' if args.loop else '0'
+    os.environ['AUTOGAME_CLOCK'] = 'system' if args.real_clock else 'virtual'
+    random.seed(args.seed)
+    
+    from capture_backends import ReplayFinished, ReplayStalled
+    module_name, class_name = BOTS[args.bot]
+    bot_class = getattr(importlib.import_module(module_name), class_name)
+    bot = bot_class(confidence=args.confidence)
+    
+    if args.pipeline:
+        bot.start_pipeline()
+    
+    status = 0
+    start_time = time.perf_counter()
+    try:
+        if args.templates:
+            benchmark_templates(bot, [name.strip() for name in args.templates.split(',') if name.strip()])
+        else:
+            bot.auto_battle_loop(num_battles=args.battles, wait_between=0)
+    except ReplayStalled as e:
+        bot.log(f"回放中止: {e}")
+        status = 1
+    except ReplayFinished:
+        bot.log("录制画面回放完毕")
+    except KeyboardInterrupt:
+        bot.log("用户中断回放")
+    finally:
+        bot.stop_pipeline()
+    elapsed = time.perf_counter() - start_time
+    
+    frames = bot.capture_backend.frames_played
+    print(f"回放帧数: {frames}")
+    print(f"耗时: {elapsed:.2f} 秒")
+    if elapsed > 0:
+        print(f"吞吐量: {frames / elapsed:.1f} 帧/秒")
+    print(f"匹配缓存命中: {bot.match_cache_hits} 次")
+    print(f"模拟点击: {len(bot.input.clicks())} 次")
+    if hasattr(bot.clock, 'slept'):
+        print(f"跳过的等待: {bot.clock.slept:.1f} 秒")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+
+
+class SceneClassifier:
+    """
+    画面指纹分类器
+    把截图缩小为很小的灰度缩略图，去均值并归一化后作为指纹，
+    与各场景（主界面、胜利、失败等）的参考指纹比较余弦相似度，在缩略图上整个过程只需几十微秒
+    
+    参考指纹在运行中学习：分类不确定时由调用方用模板匹配判断场景，再把结果记入参考指纹；
+    最相似的场景相似度足够高、且明显高于其他场景时才认为分类确定，
+    每隔一定次数的确定分类仍交给模板匹配复核，复核不一致时删除误导的参考指纹
+    """
+    def __init__(self, size=(32, 24), threshold=0.95, margin=0.05, max_references=8, verify_interval=30):
+        """
+        初始化分类器
+        :param size: 指纹缩略图的 (宽, 高)
+        :param threshold: 最相似参考指纹的相似度达到该值才可能确定
+        :param margin: 最相似场景需要比其他场景的相似度高出的值
+        :param max_references: 每个场景最多保留的参考指纹数量，超出时丢弃最旧的
+        :param verify_interval: 每隔多少次确定分类复核一次，0表示不复核
+        """
+        self.size = size
+        self.threshold = threshold
+        self.margin = margin
+        self.max_references = max_references
+        self.verify_interval = verify_interval
+        
+        self._references = {}  # 场景 -> 参考指纹列表，从旧到新
+        self._matrix = None  # 所有参考指纹按行堆叠
+        self._labels = []  # 每行参考指纹对应的场景
+        self._confident_count = 0
+        
+        # 统计信息
+        self.hits = 0  # 直接由指纹确定的次数
+        self.fallbacks = 0  # 交给模板匹配的次数
+        self.mismatches = 0  # 指纹分类与模板匹配结果不一致的次数
+    
+    def fingerprint(self, image):
+        """
+        计算截图的指纹
+        先隔行隔列取样到指纹大小的两倍左右，再双线性缩小，只需处理很少的像素；
+        传入已经按区域平均缩小过的缩略图时指纹更稳定
+        :param image: BGR、BGRA或灰度截图，或其缩略图
+        :return: 归一化的一维float32数组，纯色画面返回全零数组
+        """
+        width, height = self.size
+        h, w = image.shape[:2]
+        step = max(1, min(h // (height * 2), w // (width * 2)))
+        small = cv2.resize(image[::step, ::step], self.size, interpolation=cv2.INTER_LINEAR)
+        if small.ndim == 3:
+            small = small[:, :, :3].mean(axis=2)
+        
+        vector = small.astype(np.float32).ravel()
+        vector -= vector.mean()
+        norm = np.linalg.norm(vector)
+        if norm < 1e-3:
+            return np.zeros_like(vector)
+        return vector / norm
+    
+    def classify(self, fingerprint):
+        """
+        把指纹与参考指纹比较
+        :param fingerprint: fingerprint() 的返回值
+        :return: (最相似的场景, 是否确定)，没有参考指纹时返回 (None, False)
+        """
+        if self._matrix is None or not fingerprint.any():
+            self.fallbacks += 1
+            return None, False
+        
+        similarities = self._matrix @ fingerprint
+        best = int(np.argmax(similarities))
+        scene = self._labels[best]
+        others = [sim for sim, label in zip(similarities, self._labels) if label != scene]
+        runner_up = max(others) if others else -1.0
+        
+        confident = similarities[best] >= self.threshold and similarities[best] - runner_up >= self.margin
+        if confident and self.verify_interval:
+            self._confident_count += 1
+            if self._confident_count % self.verify_interval == 0:
+                confident = False
+        if confident:
+            self.hits += 1
+        else:
+            self.fallbacks += 1
+        return scene, confident
+    
+    def learn(self, fingerprint, scene, predicted=None):
+        """
+        记录模板匹配判断出的场景
+        :param fingerprint: 该截图的指纹
+        :param scene: 模板匹配判断出的场景，None表示无法判断，不学习
+        :param predicted: 指纹分类给出的场景，与scene不一致时删除与该截图相似的误导参考指纹
+        """
+        if scene is None or not fingerprint.any():
+            return
+        
+        if predicted is not None and predicted != scene and predicted in self._references:
+            self.mismatches += 1
+            kept = [ref for ref in self._references[predicted] if float(ref @ fingerprint) < self.threshold]
+            if kept:
+                self._references[predicted] = kept
+            else:
+                del self._references[predicted]
+        
+        references = self._references.setdefault(scene, [])
+        if any(float(ref @ fingerprint) >= 0.99 for ref in references):
+            # 已有几乎相同的参考指纹
+            self._rebuild()
+            return
+        references.append(fingerprint)
+        if len(references) > self.max_references:
+            references.pop(0)
+        self._rebuild()
+    
+    def _rebuild(self):
+        labels = [scene for scene, references in self._references.items() for _ in references]
+        if not labels:
+            self._matrix, self._labels = None, []
+            return
+        self._matrix = np.stack([ref for references in self._references.values() for ref in references])
+        self._labels = labels
+    
+    def reset(self):
+        """
+        丢弃所有参考指纹，例如游戏分辨率或界面主题改变之后
+        """
+        self._references = {}
+        self._rebuild()
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+class StateTracker:
+    """
+    界面状态转移跟踪器
+    记录连续两次状态检测之间的转移次数，按拉普拉斯平滑后的转移概率
+    决定下一次检测时各状态检查的先后顺序，最可能出现的状态最先检查，命中即停止
+    
+    从当前状态出发观察足够多次、却从未转移到某个状态时，跳过该状态的检查；
+    为了不错过从未见过的转移，每隔一定次数以及画面大面积变化时仍检查全部状态
+    """
+    def __init__(self, alpha=1.0, min_observations=20, full_check_interval=5):
+        """
+        初始化状态跟踪器
+        :param alpha: 拉普拉斯平滑系数，每个转移预先计入的次数
+        :param min_observations: 从某状态出发的转移次数达到该值后才开始跳过检查
+        :param full_check_interval: 每隔多少次检测检查一次全部状态，0表示从不跳过
+        """
+        self.alpha = alpha
+        self.min_observations = min_observations
+        self.full_check_interval = full_check_interval
+        
+        self.previous = None  # 上一次检测到的状态
+        self._index = {}  # 状态 -> 转移计数矩阵的行列号
+        self._counts = np.zeros((0, 0), dtype=np.float64)
+        self._plans = 0
+        
+        # 统计信息
+        self.checks_planned = 0
+        self.checks_skipped = 0
+    
+    def _state_index(self, state):
+        index = self._index.get(state)
+        if index is None:
+            index = len(self._index)
+            self._index[state] = index
+            self._counts = np.pad(self._counts, ((0, 1), (0, 1)))
+        return index
+    
+    def observe(self, state):
+        """
+        记录一次检测结果
+        :param state: 检测到的状态
+        """
+        if state is None:
+            return
+        index = self._state_index(state)
+        if self.previous is not None:
+            self._counts[self._index[self.previous], index] += 1
+        self.previous = state
+    
+    def probabilities(self, previous=None):
+        """
+        从指定状态出发转移到各状态的概率
+        :param previous: 出发状态，默认为上一次检测到的状态
+        :return: {状态: 概率}，没有出发状态时所有状态概率相同
+        """
+        if previous is None:
+            previous = self.previous
+        states = list(self._index)
+        if not states:
+            return {}
+        if previous is None or previous not in self._index:
+            return {state: 1.0 / len(states) for state in states}
+        
+        row = self._counts[self._index[previous]]
+        smoothed = (row + self.alpha) / (row.sum() + self.alpha * len(states))
+        return {state: float(smoothed[index]) for state, index in self._index.items()}
+    
+    def plan(self, checks, force_full=False):
+        """
+        按转移概率从高到低排列状态检查，并去掉可以跳过的检查
+        :param checks: [(状态, 检查函数)]，概率相同时保持列表中的顺序
+        :param force_full: 是否检查全部状态，例如画面刚刚大面积变化时
+        :return: 排好序的 [(状态, 检查函数)]
+        """
+        for state, _ in checks:
+            self._state_index(state)
+        self._plans += 1
+        
+        previous = self.previous
+        if previous is None:
+            self.checks_planned += len(checks)
+            return list(checks)
+        
+        probabilities = self.probabilities(previous)
+        ordered = sorted(checks, key=lambda check: -probabilities[check[0]])
+        
+        row = self._counts[self._index[previous]]
+        full = force_full or not self.full_check_interval or self._plans % self.full_check_interval == 0
+        if not full and row.sum() >= self.min_observations:
+            kept = [check for check in ordered if row[self._index[check[0]]] > 0]
+            self.checks_skipped += len(ordered) - len(kept)
+            ordered = kept
+        
+        self.checks_planned += len(ordered)
+        return ordered
+    
+    def reset(self):
+        """
+        丢弃所有转移记录
+        """
+        self.previous = None
+        self._index = {}
+        self._counts = np.zeros((0, 0), dtype=np.float64)
@@ -0,0 +1,167 @@
+import cv2
+import numpy as np
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TemplateStore:
+    """
+    模板图像内存缓存
+    每个模板只从磁盘读取并解码一次，之后常驻内存，超出容量时按LRU淘汰
+    模板文件的修改时间变化且内容哈希不同时才重新解码，
+    因此模板工具(template_creator.py、fix_templates.py)可以在机器人运行时更新模板；
+    不存在的模板同样在检查间隔内缓存，可选模板缺失时不会每次都访问磁盘
+    
+    version 在任何模板被加载、替换、删除或缓存被清空时加一，
+    由多个模板构建的派生数据（如数字字形库）可以据此判断是否需要重建
+    """
+    def __init__(self, templates_dir, max_size=64, check_interval=1.0):
+        """
+        初始化模板缓存
+        :param templates_dir: 模板目录
+        :param max_size: 最多缓存的模板数量
+        :param check_interval: 检查模板文件是否变化的最小间隔（秒）
+        """
+        self.templates_dir = templates_dir
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self._entries = OrderedDict()  # 模板名 -> 缓存条目
+        self._missing = {}  # 不存在或无法解码的模板名 -> 上一次检查的时间
+        self._lock = threading.Lock()
+        self.version = 0  # 缓存内容的变化计数
+        
+        # 统计信息
+        self.hits = 0
+        self.loads = 0
+    
+    def get(self, template_name):
+        """
+        获取解码后的模板图像
+        :param template_name: 模板图像文件名
+        :return: BGR格式的模板图像，模板不存在或无法解码时返回None
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(template_name)
+            if entry is not None:
+                self._entries.move_to_end(template_name)
+                if now - entry['checked_at'] < self.check_interval:
+                    self.hits += 1
+                    return entry['image']
+            elif now - self._missing.get(template_name, float('-inf')) < self.check_interval:
+                return None
+            
+            entry = self._refresh(template_name, entry, now)
+            if entry is None:
+                return None
+            return entry['image']
+    
+    def get_variant(self, template_name, key, builder):
+        """
+        获取模板的派生图像（如缩小后的模板），与原模板一起缓存
+        模板重新加载后派生图像随之失效
+        :param template_name: 模板图像文件名
+        :param key: 派生图像的标识
+        :param builder: 根据原模板生成派生图像的函数
+        :return: 派生图像，模板不存在时返回None
+        """
+        image = self.get(template_name)
+        if image is None:
+            return None
+        
+        with self._lock:
+            entry = self._entries.get(template_name)
+            if entry is None or entry['image'] is not image:
+                # 缓存条目已被淘汰或替换，直接生成不缓存
+                return builder(image)
+            variants = entry['variants']
+            if key not in variants:
+                variants[key] = builder(image)
+            return variants[key]
+    
+    def invalidate(self, template_name=None):
+        """
+        使缓存失效
+        :param template_name: 模板名，为None时清空全部缓存
+        """
+        with self._lock:
+            if template_name is None:
+                self._entries.clear()
+                self._missing.clear()
+            else:
+                self._entries.pop(template_name, None)
+                self._missing.pop(template_name, None)
+            self.version += 1
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _refresh(self, template_name, entry, now):
+        """
+        检查模板文件是否变化，必要时重新加载
+        调用方需持有锁
+        """
+        template_path = os.path.join(self.templates_dir, template_name)
+        try:
+            stat = os.stat(template_path)
+        except OSError:
+            # 模板文件不存在或已被删除
+            self._forget(template_name, now)
+            return None
+        
+        if entry is not None and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            entry['checked_at'] = now
+            self.hits += 1
+            return entry
+        
+        # 使用np.fromfile读取，兼容包含中文的路径
+        try:
+            data = np.fromfile(template_path, dtype=np.uint8)
+        except OSError:
+            self._forget(template_name, now)
+            return None
+        digest = hashlib.md5(data.tobytes()).hexdigest()
+        
+        if entry is not None and entry['digest'] == digest:
+            # 文件被重新保存但内容未变，无需重新解码
+            entry['mtime'] = stat.st_mtime_ns
+            entry['size'] = stat.st_size
+            entry['checked_at'] = now
+            self.hits += 1
+            return entry
+        
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if image is None:
+            self._forget(template_name, now)
+            return None
+        
+        entry = {
+            'image': image,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'digest': digest,
+            'checked_at': now,
+            'variants': {},
+        }
+        self._entries[template_name] = entry
+        self._entries.move_to_end(template_name)
+        self._missing.pop(template_name, None)
+        self.loads += 1
+        self.version += 1
+        
+        # 超出容量时淘汰最久未使用的模板
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        
+        return entry
+    
+    def _forget(self, template_name, now):
+        """
+        记录模板不可用，调用方需持有锁
+        """
+        if self._entries.pop(template_name, None) is not None:
+            self.version += 1
+        self._missing[template_name] = now
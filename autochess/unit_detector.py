@@ -0,0 +1,103 @@
+from collections import namedtuple
+import cv2
+import numpy as np
+
+# 一方单位的检测结果，坐标为截图坐标：
+# centroids 为 (N, 2) 的中心点数组，areas 为 (N,) 的面积数组（像素），boxes 为 (N, 4) 的 (x, y, 宽, 高) 数组
+UnitDetections = namedtuple('UnitDetections', ['centroids', 'areas', 'boxes'])
+
+
+def empty_detections():
+    return UnitDetections(
+        np.empty((0, 2), dtype=np.float32),
+        np.empty(0, dtype=np.int32),
+        np.empty((0, 4), dtype=np.int32),
+    )
+
+
+class UnitDetector:
+    """
+    按队伍颜色检测场上单位
+    在战斗区域内（先缩小）转换到HSV，按每方的队伍颜色范围生成掩码，
+    开运算去掉零星噪点、闭运算补上单位内部的空洞，再用 connectedComponentsWithStats
+    一次性得到所有连通区域的面积、外接矩形和中心点，按面积过滤后即为单位；
+    战斗区域缩小一半后每帧只需几毫秒
+    """
+    def __init__(self, team_colors, scale=0.5, min_area=60, max_area_ratio=0.05, kernel_size=3):
+        """
+        初始化单位检测器
+        :param team_colors: {队伍名: [(HSV下限, HSV上限), ...]}，同一方可以有多个颜色范围（如跨过色调0的红色）
+        :param scale: 检测前战斗区域的缩放比例
+        :param min_area: 单位的最小面积（原始截图中的像素数），更小的区域视为噪点
+        :param max_area_ratio: 单位面积最多占战斗区域的比例，更大的同色区域（如场地上的河流）不是单位
+        :param kernel_size: 形态学运算的核大小（缩小后的像素）
+        """
+        self.team_colors = {
+            team: [(np.array(low, dtype=np.uint8), np.array(high, dtype=np.uint8)) for low, high in ranges]
+            for team, ranges in team_colors.items()
+        }
+        self.scale = scale
+        self.min_area = min_area
+        self.max_area_ratio = max_area_ratio
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    
+    def team_mask(self, hsv, team):
+        """
+        :param hsv: HSV图像
+        :param team: 队伍名
+        :return: 该方队伍颜色经过形态学处理后的掩码
+        """
+        ranges = self.team_colors[team]
+        mask = cv2.inRange(hsv, ranges[0][0], ranges[0][1])
+        for low, high in ranges[1:]:
+            mask |= cv2.inRange(hsv, low, high)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.kernel)
+    
+    def detect(self, screen, region=None):
+        """
+        检测各方单位
+        :param screen: BGR或BGRA截图
+        :param region: 战斗区域 (x, y, 宽, 高)，None表示整张截图
+        :return: {队伍名: UnitDetections}，截图为灰度或区域为空时每方都没有单位
+        """
+        results = {team: empty_detections() for team in self.team_colors}
+        if screen is None or screen.ndim != 3:
+            return results
+        
+        if region is None:
+            left, top = 0, 0
+            crop = screen
+        else:
+            x, y, w, h = region
+            left, top = max(0, x), max(0, y)
+            crop = screen[top:y + h, left:x + w]
+        if crop.size == 0:
+            return results
+        
+        small = cv2.resize(crop, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if small.shape[2] == 4:
+            small = cv2.cvtColor(small, cv2.COLOR_BGRA2BGR)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        
+        area_scale = 1.0 / (self.scale * self.scale)
+        max_area = self.max_area_ratio * crop.shape[0] * crop.shape[1]
+        for team in self.team_colors:
+            # 指定BBDT算法（CCL_GRANA），稀疏的单位掩码上比默认算法快数倍
+            count, _, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+                self.team_mask(hsv, team), 8, cv2.CV_32S, cv2.CCL_GRANA,
+            )
+            # 第0个连通区域是背景
+            stats, centroids = stats[1:count], centroids[1:count]
+            areas = stats[:, cv2.CC_STAT_AREA] * area_scale
+            keep = (areas >= self.min_area) & (areas <= max_area)
+            
+            boxes = np.round(stats[keep, :4] / self.scale).astype(np.int32)
+            boxes[:, 0] += left
+            boxes[:, 1] += top
+            results[team] = UnitDetections(
+                ((centroids[keep] + 0.5) / self.scale - 0.5 + (left, top)).astype(np.float32),
+                areas[keep].astype(np.int32),
+                boxes,
+            )
+        return results
@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+
+def to_gray(image):
+    """
+    将BGR、BGRA或灰度截图转换为灰度图像
+    :param image: 截图的numpy数组
+    :return: 灰度图像，输入已是灰度图像时直接返回
+    """
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def convert_channels(image, channels):
+    """
+    将BGR模板转换为与截图相同的通道数，使模板可以直接在BGRA或灰度截图上匹配
+    模板的alpha通道为常数，在TM_CCOEFF_NORMED中去均值后贡献为零，不影响置信度
+    :param image: BGR图像
+    :param channels: 目标通道数(1、3或4)
+    :return: 转换后的图像
+    """
+    if channels == 1:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if channels == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    return image
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.3, max_results=None):
+    """
+    非极大值抑制，按得分从高到低保留互相重叠不超过阈值的框
+    每保留一个框，用numpy一次性计算它与剩余所有框的交并比
+    :param boxes: (N, 4) 数组，每行为 (x, y, width, height)
+    :param scores: (N,) 得分数组
+    :param iou_threshold: 交并比超过该值的框被抑制
+    :param max_results: 最多保留的框数量，None表示不限制
+    :return: 保留的框在输入中的索引数组，按得分从高到低排列
+    """
+    boxes = np.asarray(boxes, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float32)
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.intp)
+    
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = x1 + boxes[:, 2]
+    y2 = y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        if max_results is not None and len(keep) >= max_results:
+            break
+        
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-6)
+        order = rest[iou <= iou_threshold]
+    
+    return np.array(keep, dtype=np.intp)
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 import cv2
 import numpy as np
-import pyautogui
 import time
 import os
 import sys
 import random
 
+try:
+    import pyautogui
+except Exception:
+    # 没有显示器的环境（如在Linux上回放录制画面）无法导入pyautogui
+    pyautogui = None
+
 # 使用绝对导入替代相对导入
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from autogame import AutoGame
@@ -160,6 +165,24 @@ def create_troop_templates(missing_templates, templates_dir):
         if choice != 'y':
             break
 
+def find_best_troop(auto_game, target_templates, screen):
+    """
+    在一张截图上查找所有目标野怪，返回置信度最高的一个的位置
+    每个模板只在截图上匹配一次，同时得到屏幕上的全部实例
+    """
+    best_position = None
+    best_score = -1.0
+    for template in target_templates:
+        troops = auto_game.find_all(template, threshold=0.7, frame=screen)
+        for x, y, score in troops:
+            print(f"找到目标: {template} 在位置 ({int(x)}, {int(y)}) 置信度: {score:.2f}")
+            if score > best_score:
+                best_position, best_score = (int(x), int(y)), score
+    
+    if best_position:
+        print(f"选择置信度最高的目标，位置 {best_position}")
+    return best_position
+
 def directional_search(auto_game, target_templates, direction, max_iterations=50):
     """
     按指定方向拖动地图搜索野怪
@@ -168,7 +191,7 @@ def directional_search(auto_game, target_templates, direction, max_iterations=50
     print("按Ctrl+C可随时中断搜索")
     
     # 设置拖动参数
-    screen_width, screen_height = pyautogui.size()
+    screen_width, screen_height = auto_game.screen_size()
     center_x, center_y = screen_width // 2, screen_height // 2
     
     # 拖动距离和方向
@@ -190,23 +213,20 @@ def directional_search(auto_game, target_templates, direction, max_iterations=50
     for iteration in range(1, max_iterations + 1):
         print(f"搜索次数: {iteration}/{max_iterations}")
         
-        # 检查当前屏幕是否有目标
-        for template in target_templates:
-            position = auto_game.find_template(template, confidence=0.7)
+        # 检查当前屏幕是否有目标，所有模板在同一张截图上匹配
+        screen = auto_game.take_screenshot()
+        if screen is not None:
+            position = find_best_troop(auto_game, target_templates, screen)
             if position:
-                print(f"找到目标: {template} 在位置 {position}")
                 # 点击目标
                 auto_game.click(position)
                 return True
         
         # 拖动地图
-        pyautogui.moveTo(start_x, start_y)
-        pyautogui.mouseDown()
-        pyautogui.moveTo(end_x, end_y, duration=0.5)  # 0.5秒完成拖动
-        pyautogui.mouseUp()
+        auto_game.drag((start_x, start_y), (end_x, end_y), duration=0.5)  # 0.5秒完成拖动
         
         # 等待地图停止移动
-        time.sleep(1)
+        auto_game.sleep(1)
     
     return False
 
@@ -218,7 +238,7 @@ def spiral_search(auto_game, target_templates, max_iterations=50):
     print("按Ctrl+C可随时中断搜索")
     
     # 设置拖动参数
-    screen_width, screen_height = pyautogui.size()
+    screen_width, screen_height = auto_game.screen_size()
     center_x, center_y = screen_width // 2, screen_height // 2
     
     # 螺旋搜索参数
@@ -237,19 +257,19 @@ def spiral_search(auto_game, target_templates, max_iterations=50):
     for iteration in range(1, max_iterations + 1):
         print(f"搜索次数: {iteration}/{max_iterations}")
         
-        # 检查当前屏幕是否有目标
+        # 检查当前屏幕是否有目标，所有模板在同一张截图上匹配
         template_found = False
-        for template in target_templates:
-            try:
-                position = auto_game.find_template(template, confidence=0.7)
+        try:
+            screen = auto_game.take_screenshot()
+            if screen is not None:
+                position = find_best_troop(auto_game, target_templates, screen)
                 if position:
-                    print(f"找到目标: {template} 在位置 {position}")
                     # 点击目标
                     auto_game.click(position)
                     return True
-                template_found = True  # 至少一个模板搜索成功（即使没找到匹配）
-            except Exception as e:
-                print(f"搜索模板 {template} 时出错: {str(e)}")
+                template_found = True  # 截图成功且完成了搜索（即使没找到匹配）
+        except Exception as e:
+            print(f"搜索模板时出错: {str(e)}")
         
         # 如果所有模板搜索都失败（可能是截图问题）
         if not template_found:
@@ -267,7 +287,7 @@ def spiral_search(auto_game, target_templates, max_iterations=50):
             
             # 短暂暂停后继续
             print("暂停2秒后继续...")
-            time.sleep(2)
+            auto_game.sleep(2)
         else:
             consecutive_failures = 0  # 重置连续失败计数
         
@@ -289,13 +309,10 @@ def spiral_search(auto_game, target_templates, max_iterations=50):
             end_x, end_y = center_x, center_y - drag_distance//2
         
         # 拖动地图
-        pyautogui.moveTo(start_x, start_y)
-        pyautogui.mouseDown()
-        pyautogui.moveTo(end_x, end_y, duration=0.5)  # 0.5秒完成拖动
-        pyautogui.mouseUp()
+        auto_game.drag((start_x, start_y), (end_x, end_y), duration=0.5)  # 0.5秒完成拖动
         
         # 等待地图停止移动
-        time.sleep(1)
+        auto_game.sleep(1)
         
         # 更新螺旋搜索状态
         steps_taken += 1
@@ -1,10 +1,15 @@
 import cv2
 import numpy as np
-import pyautogui
 import time
 import os
 import sys
 
+try:
+    import pyautogui
+except Exception:
+    # 没有显示器的环境（如在Linux上回放录制画面）无法导入pyautogui
+    pyautogui = None
+
 def clear_screen():
     """清除控制台屏幕"""
     os.system('cls' if os.name == 'nt' else 'clear')